@@ -21,6 +21,13 @@ from archiver import BALArchiver
 from common import BALCommon, IncorrectUsage
 from config import BALConfig
 from converter import BALConverter
+from http import BALHttp
+from lease import BALLease
+from ledger import BALLedger
 from maintenance import BALMaintenance
 from message import BALMessage
+from retry import BALRetry
+from scheduler import BALScheduler
 from sqldb import BALSqlDb
+from sqlite import BALSqlite
+from staging import BALStaging
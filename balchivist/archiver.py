@@ -14,6 +14,9 @@
 # You should have received a copy of the GNU General Public License
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
+import collections
+import multiprocessing.pool
+import os
 import time
 
 import internetarchive
@@ -21,10 +24,20 @@ import internetarchive
 from . import BALVERSION
 import common
 from exception import IncorrectUsage
+from ledger import BALLedger
 import message
+from retry import BALRetry
+from scheduler import BALScheduler
 
 
 class BALArchiver(object):
+    # The number of times a file may be put back into the upload queue
+    requeues = 3
+    # The initial delay and the maximum time (in seconds) for polling the
+    # Internet Archive while it processes the item creation
+    readydelay = 1
+    readytimeout = 60
+
     def __init__(self, identifier='', retries=3, debug=False, verbose=False):
         """
         This module is used for providing regular functions used for
@@ -41,6 +54,10 @@ class BALArchiver(object):
         self.debug = debug
         self.verbose = verbose
         self.common = common.BALCommon(debug=debug, verbose=verbose)
+        self.retry = BALRetry(retries=retries, debug=debug, verbose=verbose)
+        self.scheduler = BALScheduler(debug=debug, verbose=verbose)
+        self.lasterror = None
+        self.ledger = None
 
         # Files that are present by default in all Internet Archive items
         self.defaultFiles = [
@@ -57,9 +74,62 @@ class BALArchiver(object):
 
         - exception (object): The exception object caught.
         """
+        self.lasterror = exception
         msg = "%s was caught" % (type(exception).__name__)
         self.common.giveDebugMessage(msg)
 
+    def getItem(self):
+        """
+        This function is used to get the item object from the Internet
+        Archive, retrying if a temporary error has occurred.
+
+        Returns: The item object, False if an error has occurred.
+        """
+        try:
+            return self.retry.call(internetarchive.get_item,
+                                   identifier=self.identifier)
+        except Exception as exception:
+            self.handleException(exception=exception)
+            return False
+
+    def isItemReady(self):
+        """
+        This function is used to check whether the item has been created on
+        the Internet Archive and is ready to accept more files.
+
+        Returns: True if the item exists, False if otherwise.
+        """
+        try:
+            iaitem = internetarchive.get_item(identifier=self.identifier)
+            return iaitem.exists
+        except Exception as exception:
+            self.handleException(exception=exception)
+            return False
+
+    def waitForItem(self):
+        """
+        This function is used to wait for the Internet Archive to process the
+        creation of the item by polling the item metadata with a short
+        backoff, rather than sleeping for a fixed amount of time.
+
+        Returns: True if the item is ready, False if it is still not ready
+        after the maximum waiting time (the upload can still be attempted).
+        """
+        delay = self.readydelay
+        waited = 0
+        while not self.isItemReady():
+            if (waited >= self.readytimeout):
+                self.common.giveDebugMessage("The item %s is still not ready "
+                                             "after %d seconds" %
+                                             (self.identifier, waited))
+                return False
+            time.sleep(delay)
+            waited += delay
+            delay = min(delay * 2, self.readytimeout - waited)
+        self.common.giveDebugMessage("The item %s is ready after %d seconds" %
+                                     (self.identifier, waited))
+        return True
+
     def getFileList(self):
         """
         This function is used to get the list of files in an item and excludes
@@ -68,18 +138,9 @@ class BALArchiver(object):
         Returns: List of files in the item excluding default files in
         alphabetical order. False if an error has occurred.
         """
-        tries = 0
-        while tries < self.retries:
-            try:
-                iaitem = internetarchive.get_item(identifier=self.identifier)
-                break
-            except Exception as exception:
-                self.handleException(exception=exception)
-                if tries == self.retries:
-                    return False
-                else:
-                    tries += 1
-                    time.sleep(60*tries)
+        iaitem = self.getItem()
+        if iaitem is False:
+            return False
         filelist = []
         for thefile in iaitem.files:
             filename = thefile['name']
@@ -89,6 +150,57 @@ class BALArchiver(object):
                 filelist.append(filename)
         return sorted(filelist)
 
+    def getLedger(self):
+        """
+        This function is used to get the local ledger, which is only opened
+        when it is first needed.
+
+        Returns: The BALLedger object.
+        """
+        if self.ledger is None:
+            self.ledger = BALLedger()
+        return self.ledger
+
+    def getDoneFiles(self):
+        """
+        This function is used to get the files that do not have to be
+        uploaded again. The files that the local ledger records as uploaded
+        are confirmed against the files in the item on the Internet Archive,
+        which must have the same size and md5sum (when these are recorded),
+        so that files that never reached the Internet Archive or that have
+        been regenerated since are uploaded again.
+
+        Returns: Set of file names.
+        """
+        records = self.getLedger().getFiles(
+            self.identifier, states=self.getLedger().donestates)
+        if not records:
+            return set()
+        iaitem = self.getItem()
+        if iaitem is False:
+            self.common.giveDebugMessage("Unable to confirm the uploaded "
+                                         "files of %s" % (self.identifier))
+            return set()
+        iafiles = {}
+        for thefile in iaitem.files:
+            iafiles[thefile['name']] = thefile
+        done = set()
+        for filename, record in records.items():
+            iafile = iafiles.get(filename)
+            if iafile is None:
+                continue
+            elif (record['md5'] is not None and
+                    record['md5'] != iafile.get('md5')):
+                continue
+            elif (record['size'] is not None and
+                    str(record['size']) != str(iafile.get('size'))):
+                continue
+            done.add(filename)
+        for filename in set(records) - done:
+            self.common.giveMessage("File recorded as uploaded is not on the "
+                                    "Internet Archive: %s" % (filename))
+        return done
+
     def getMd5Sums(self, dumpfile):
         """
         This function will get the md5sums for a given file in the item on the
@@ -96,20 +208,11 @@ class BALArchiver(object):
 
         - dumpfile (string): The name of the file to get the md5sums for.
 
-        Returns: String with the md5sums.
-        """
-        tries = 0
-        while tries < self.retries:
-            try:
-                iaitem = internetarchive.get_item(identifier=self.identifier)
-                break
-            except Exception as exception:
-                self.handleException(exception=exception)
-                if tries == self.retries:
-                    return False
-                else:
-                    tries += 1
-                    time.sleep(60*tries)
+        Returns: String with the md5sums, False if an error has occurred.
+        """
+        iaitem = self.getItem()
+        if iaitem is False:
+            return False
         thefile = iaitem.get_files(dumpfile)
         return thefile.md5
 
@@ -134,23 +237,16 @@ class BALArchiver(object):
         if not metadata.get('scanner'):
             scanner = 'Balchivist Python Library %s' % (BALVERSION)
             metadata['scanner'] = scanner
-        tries = 0
-        iaupload = internetarchive.upload
-
-        while tries < self.retries:
-            try:
-                iaupload(identifier=self.identifier, files=body,
-                         metadata=metadata, headers=headers,
-                         queue_derive=queuederive, verbose=self.verbose,
-                         verify=verify, debug=self.debug, retries=self.retries)
-                return True
-            except Exception as exception:
-                self.handleException(exception=exception)
-                if tries == self.retries:
-                    return False
-                else:
-                    tries += 1
-                    time.sleep(60*tries)
+        self.lasterror = None
+        try:
+            self.retry.call(internetarchive.upload, identifier=self.identifier,
+                            files=body, metadata=metadata, headers=headers,
+                            queue_derive=queuederive, verbose=self.verbose,
+                            verify=verify, debug=self.debug)
+            return True
+        except Exception as exception:
+            self.handleException(exception=exception)
+            return False
 
     def modifyMetadata(self, metadata, target='metadata', append=False,
                        priority=None):
@@ -166,31 +262,147 @@ class BALArchiver(object):
 
         Returns: True if the modification is successful, False if otherwise.
         """
-        if not metadata.get('scanner'):
-            scanner = 'Balchivist Python Library %s' % (BALVERSION)
-            metadata['scanner'] = scanner
-        tries = 0
-        iamodifymd = internetarchive.modify_metadata
-
-        while tries < self.retries:
-            try:
-                iamodifymd(identifier=self.identifier, metadata=metadata,
-                           target=target, append=append, priority=priority,
-                           debug=self.debug)
-                return True
-            except Exception as exception:
-                self.handleException(exception=exception)
-                if tries == self.retries:
-                    return False
-                else:
-                    tries += 1
-                    time.sleep(60*tries)
+        # The scanner is only set when the item is created, so that it is not
+        # sent again with every change
+        try:
+            self.retry.call(internetarchive.modify_metadata,
+                            identifier=self.identifier, metadata=metadata,
+                            target=target, append=append, priority=priority,
+                            debug=self.debug)
+            return True
+        except Exception as exception:
+            self.handleException(exception=exception)
+            return False
+
+    def getMetadata(self):
+        """
+        This function is used to get the current metadata of the item on the
+        Internet Archive.
+
+        Returns: Dict with the item metadata, False if an error has occurred.
+        """
+        iaitem = self.getItem()
+        if iaitem is False:
+            return False
+        return iaitem.metadata
+
+    @staticmethod
+    def normalizeMetadata(value):
+        """
+        This function is used to normalize a metadata value for comparison,
+        since the Internet Archive may return fields with multiple values
+        (such as "subject") as a list.
+
+        - value (string or list): The metadata value.
+
+        Returns: String with the normalized value.
+        """
+        if isinstance(value, list):
+            return ';'.join(value)
+        else:
+            return value
+
+    def getChangedMetadata(self, metadata, current):
+        """
+        This function is used to compare the given metadata with the current
+        metadata of the item.
+
+        - metadata (dict): The metadata that the item should have.
+        - current (dict): The current metadata of the item.
+
+        Returns: Dict with only the fields that need to be changed.
+        """
+        changed = {}
+        for key, val in metadata.iteritems():
+            if (self.normalizeMetadata(current.get(key)) ==
+                    self.normalizeMetadata(val)):
+                continue
+            else:
+                changed[key] = val
+        return changed
+
+    def updateMetadata(self, metadata):
+        """
+        This function will update the metadata of an item on the Internet
+        Archive, but only sends the fields that differ from the current
+        metadata of the item.
+
+        - metadata (dict): The metadata that the item should have.
+
+        Returns: True if the item is up-to-date or the modification is
+        successful, False if otherwise.
+        """
+        current = self.getMetadata()
+        if current is False:
+            return False
+        changed = self.getChangedMetadata(metadata, current)
+        if changed == {}:
+            self.common.giveDebugMessage("The metadata of %s is up-to-date" %
+                                         (self.identifier))
+            return True
+        self.common.giveMessage("Updating %s for %s" %
+                                (', '.join(sorted(changed)), self.identifier))
+        if not self.scheduler.wait(self.identifier):
+            return False
+        return self.modifyMetadata(changed)
+
+    @classmethod
+    def bulkUpdateMetadata(cls, items, workers=4, debug=False,
+                           verbose=False):
+        """
+        This function is used to update the metadata of many items on the
+        Internet Archive concurrently. Only the fields that have changed are
+        sent, and every modification waits for the Internet Archive to accept
+        it.
+
+        - items (dict): The identifiers of the items and their metadata.
+        - workers (int): The number of items to work on at the same time.
+        - debug (boolean): Whether or not to provide debugging output.
+        - verbose (boolean): Whether or not to provide more verbosity.
+
+        Returns: List of identifiers that failed to be updated.
+        """
+        def update(identifier):
+            iaitem = cls(identifier=identifier, debug=debug, verbose=verbose)
+            return iaitem.updateMetadata(items[identifier])
+
+        pool = multiprocessing.pool.ThreadPool(processes=workers)
+        try:
+            identifiers = sorted(items)
+            results = pool.map(update, identifiers)
+        finally:
+            pool.close()
+            pool.join()
+        return [identifier for identifier, status in
+                zip(identifiers, results) if not status]
+
+    def recordState(self, dumpfile, state):
+        """
+        This function is used to record the upload state of a file in the
+        local ledger, so that the upload can be resumed after a restart.
+
+        Note: Nothing is recorded in debug mode as nothing is uploaded.
+
+        - dumpfile (string): The path to the file.
+        - state (string): The new state of the file.
+        """
+        if self.debug:
+            return
+        size = None
+        if os.path.isfile(dumpfile):
+            size = os.path.getsize(dumpfile)
+        self.getLedger().setState(self.identifier, os.path.basename(dumpfile),
+                                  state, size=size)
 
     def upload(self, body, metadata={}, headers={}, queuederive=False,
                verify=True):
         """
         This function acts as a wrapper for the uploadFile function, but adds
-        additional functionality to ensure better error handling.
+        additional functionality to ensure better error handling. Each file
+        waits for the Internet Archive to accept uploads, and files rejected
+        due to rate limiting are put back at the end of the queue. Files that
+        the local ledger records as uploaded are skipped if the Internet
+        Archive has them (see self.getDoneFiles).
 
         - body (string or list): The path to the file(s) to upload.
         - metadata (dict): The metadata for the Internet Archive item.
@@ -201,30 +413,51 @@ class BALArchiver(object):
 
         Returns: True if process is successful, False if otherwise.
         """
-        count = 0
-        for dumpfile in body:
+        created = False
+        queue = collections.deque(body)
+        requeued = collections.Counter()
+        done = self.getDoneFiles()
+        while queue:
+            dumpfile = queue.popleft()
+            filename = os.path.basename(dumpfile)
+            if filename in done:
+                self.common.giveMessage("File already uploaded: %s" %
+                                        (dumpfile))
+                created = True
+                continue
+            if not self.scheduler.wait(self.identifier):
+                self.common.giveMessage("Gave up waiting for the Internet "
+                                        "Archive to accept uploads")
+                return False
             self.common.giveMessage("Uploading file: %s" % (dumpfile))
+            self.recordState(dumpfile, "uploading")
             time.sleep(1)  # For Ctrl+C
-            if count == 0:
+            if not created:
                 upload = self.uploadFile(dumpfile, metadata=metadata,
                                          headers=headers, verify=verify,
                                          queuederive=queuederive)
                 # Allow the Internet Archive to process the item creation
-                if self.debug:
+                if (upload is False or self.debug):
                     pass
                 else:
-                    timenow = time.strftime("%Y-%m-%d %H:%M:%S",
-                                            time.localtime())
-                    self.common.giveMessage("Sleeping for 30 seconds, %s" %
-                                            (timenow))
-                    time.sleep(30)
+                    self.waitForItem()
             else:
                 upload = self.uploadFile(dumpfile, queuederive=queuederive,
                                          verify=verify)
 
             if upload:
                 self.common.giveDebugMessage(upload)
-                count += 1
+                created = True
+                self.recordState(dumpfile, "verified" if verify else
+                                 "uploaded")
+            elif (self.lasterror is not None and
+                  self.retry.isRetriable(self.lasterror) and
+                  requeued[dumpfile] < self.requeues):
+                # The Internet Archive is likely overloaded, put the file
+                # back into the queue instead of failing the whole item
+                self.scheduler.markOverloaded(self.identifier)
+                requeued[dumpfile] += 1
+                queue.append(dumpfile)
             else:
                 return False
         return True
@@ -14,10 +14,10 @@
 # You should have received a copy of the GNU General Public License
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
+import hashlib
 import os
 import re
 import sys
-import urllib
 
 from exception import IncorrectUsage
 import config
@@ -35,6 +35,20 @@ class BALCommon(object):
         self.log = log
         BALConfig = config.BALConfig('main')
         self.logtofile = BALConfig.get('logfile')
+        self.http = None
+
+    def getHttp(self):
+        """
+        This function is used for getting the HTTP client used for requests
+        to remote servers.
+
+        Returns: BALHttp instance.
+        """
+        # Imported here as the http module depends on this module
+        from http import BALHttp
+        if self.http is None:
+            self.http = BALHttp(debug=self.debug, verbose=self.verbose)
+        return self.http
 
     def giveMessage(self, message):
         """
@@ -138,14 +152,26 @@ class BALCommon(object):
 
         - url (string): The URL to work on.
 
+        Returns list of links without the trailing slash and the parent
+        directory, or an empty list if the URL could not be retrieved.
+        """
+        raw = self.getHttp().getText(url)
+        if raw is None:
+            return []
+        return self.parseLinks(raw)
+
+    @staticmethod
+    def parseLinks(raw):
+        """
+        This function is for getting a list of links from the contents of a
+        directory listing (see self.extractLinks).
+
+        - raw (string): The contents of the directory listing.
+
         Returns list of links without the trailing slash and the parent
         directory.
         """
         links = []
-        page = urllib.urlopen(url)
-        raw = page.read()
-        page.close()
-
         regex = r'<a href="(?P<link>[^>]+)">'
         m = re.compile(regex).finditer(raw)
         for i in m:
@@ -159,7 +185,7 @@ class BALCommon(object):
                 links.append(link)
         return sorted(links)
 
-    def downloadFiles(self, filelist, directory, baseurl):
+    def downloadFiles(self, filelist, directory, baseurl, reserved=False):
         """
         This function is used for downloading all the files for a given dump
         into the given directory.
@@ -168,29 +194,85 @@ class BALCommon(object):
         - directory (string): The path to the directory that will store the
         downloaded files.
         - baseurl (string): The URL to the directory that contains the files.
+        - reserved (boolean): Whether the staging space for the files has
+        already been reserved, in which case the files are not limited to
+        the staging space that is still available.
+
+        Returns: True if all files are downloaded, False if an error occurred
+        or if there is not enough staging space for a file.
         """
-        fileopener = urllib.URLopener()
+        # Imported here as the staging module depends on this module
+        from staging import BALStaging
+        space = BALStaging(directory, debug=self.debug, verbose=self.verbose)
 
         if (os.path.exists(directory)):
             pass
         else:
             os.makedirs(directory)
 
-        os.chdir(directory)
         for thefile in filelist:
-            if (os.path.isfile(thefile)):
+            # Use the full path as the working directory is shared by all
+            # threads
+            filepath = os.path.join(directory, thefile)
+            if (os.path.isfile(filepath)):
                 continue
             else:
                 self.giveMessage("Downloading file: %s" % (thefile))
                 fileurl = "%s/%s" % (baseurl, thefile)
-                try:
-                    fileopener.retrieve(fileurl, thefile)
-                except:
-                    # Remove the last file as it may be corrupted
-                    os.remove(thefile)
+                maxsize = None
+                if not reserved:
+                    maxsize = space.getAvailable()
+                if not self.getHttp().download(fileurl, filepath, maxsize):
                     return False
         return True
 
+    @staticmethod
+    def getFileMd5(path, blocksize=1024*1024):
+        """
+        This function is used for calculating the md5sum of a local file
+        without reading the whole file into memory.
+
+        - path (string): The path to the file.
+        - blocksize (int): The number of bytes to read at a time.
+
+        Returns: String with the hexadecimal md5sum of the file.
+        """
+        md5 = hashlib.md5()
+        with open(path, 'rb') as thefile:
+            for block in iter(lambda: thefile.read(blocksize), b''):
+                md5.update(block)
+        return md5.hexdigest()
+
+    @staticmethod
+    def getStagingCapacity(path):
+        """
+        This function is used for getting the number of bytes of an item that
+        this host can take on, which is limited by the free disk space where
+        the item is staged, the staging budget of the host and the amount of
+        data that the host can download within the time given for an item.
+        The budget (in GB), bandwidth (in MB/s) and time (in hours) are given
+        in the "main" section of the configuration, where 0 means no limit.
+
+        - path (string): The directory where items are staged.
+
+        Returns: Int with the number of bytes.
+        """
+        BALConfig = config.BALConfig('main')
+        budget = float(BALConfig.get('stagingbudget', default='0'))
+        bandwidth = float(BALConfig.get('bandwidth', default='0'))
+        hours = float(BALConfig.get('itemhours', default='0'))
+
+        # Use the closest existing directory for the free disk space
+        while not os.path.exists(path) and path != os.path.dirname(path):
+            path = os.path.dirname(path)
+        stat = os.statvfs(path)
+        limits = [stat.f_bavail * stat.f_frsize]
+        if (budget > 0):
+            limits.append(budget * 1024 * 1024 * 1024)
+        if (bandwidth > 0 and hours > 0):
+            limits.append(bandwidth * 1024 * 1024 * hours * 60 * 60)
+        return int(min(limits))
+
     def checkDownloadFileExistence(self, fileurl):
         """
         This function is used for checking if a resource exists in the given
@@ -202,11 +284,7 @@ class BALCommon(object):
         Returns: True if a resource exists in the given URL, False if
         otherwise.
         """
-        thefile = urllib.urlopen(fileurl)
-        if (thefile.getcode() == 200):
-            return True
-        else:
-            return False
+        return self.getHttp().exists(fileurl)
 
 
 if __name__ == "__main__":
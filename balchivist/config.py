@@ -38,17 +38,23 @@ class BALConfig(object):
             self.configfile = configfile
         self.section = section
 
-    def get(self, variable):
+    def get(self, variable, default=None):
         """
         This function is used to get the value for a given configuration
         variable in a certain section.
 
         - variable (string): The variable in the section to get the value for.
+        - default (string): The value to use if the variable is not set, so
+        that existing configuration files continue to work when new variables
+        are introduced.
 
         Returns: Any type depending on the variable.
         """
         config = ConfigParser.SafeConfigParser()
         config.read(self.configfile)
+        if (default is not None and
+                not config.has_option(self.section, variable)):
+            return default
         return config.get(self.section, variable)
 
 
@@ -18,9 +18,9 @@ import datetime
 import json
 import os
 import time
-import urllib
 
 from exception import IncorrectUsage
+from http import BALHttp
 import message
 
 
@@ -124,12 +124,7 @@ class BALConverter(object):
 
         Returns: Boolean to indicate status of the language list retrieval.
         """
-        fileopener = urllib.URLopener()
-        try:
-            fileopener.retrieve(self.apiUrl, self.langFile)
-            return True
-        except:
-            return False
+        return BALHttp().download(self.apiUrl, self.langFile)
 
     def getLanguages(self):
         """
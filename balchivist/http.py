@@ -0,0 +1,396 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Copyright (C) 2015-2018 Hydriz Scholz
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import hashlib
+import json
+import multiprocessing.pool
+import os
+import tempfile
+import threading
+import time
+import urlparse
+
+import requests
+
+from . import BALVERSION
+import common
+import config
+from exception import IncorrectUsage
+import message
+from retry import BALRetry
+
+
+class BALHttp(object):
+    """
+    This module is used for making HTTP requests to remote servers, such as
+    the Wikimedia dumps servers. All instances in a process share the same
+    session, so that connections to each host are kept alive and reused for
+    later requests instead of being opened for every request.
+
+    Every request has a timeout, temporary errors are retried using BALRetry
+    and the number of requests made at the same time to each host is
+    limited, so that many requests can be made concurrently using self.map
+    without flooding any host.
+    """
+    useragent = "Balchivist/%s" % (BALVERSION)
+
+    # The session and the limits on concurrent requests for each host, which
+    # are shared by all instances in this process
+    session = None
+    limits = {}
+    lock = threading.Lock()
+
+    def __init__(self, timeout=None, connections=None, debug=False,
+                 verbose=False):
+        """
+        This function is executed when a new instance of BALHttp is
+        initialized.
+
+        - timeout (int): The number of seconds to wait for the server to
+        respond, the "httptimeout" option in the "main" section of the
+        configuration (or 60 seconds) will be used by default.
+        - connections (int): The maximum number of requests made at the same
+        time to each host, the "httpconnections" option in the "main" section
+        of the configuration (or 4) will be used by default.
+        - debug (boolean): Whether or not to provide debugging output.
+        - verbose (boolean): Whether or not to provide more verbosity.
+        """
+        BALConfig = config.BALConfig('main')
+        if timeout is None:
+            timeout = BALConfig.get('httptimeout', default='60')
+        if connections is None:
+            connections = BALConfig.get('httpconnections', default='4')
+        self.timeout = float(timeout)
+        self.connections = max(1, int(connections))
+        self.common = common.BALCommon(debug=debug, verbose=verbose)
+        self.retry = BALRetry(client="http", debug=debug, verbose=verbose)
+
+    def getSession(self):
+        """
+        This function is used for getting the session shared by all instances
+        in this process, which is created when it is first needed.
+
+        Returns: The requests.Session object.
+        """
+        with self.lock:
+            if BALHttp.session is None:
+                session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(
+                    pool_connections=16, pool_maxsize=self.connections)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                session.headers['User-Agent'] = self.useragent
+                BALHttp.session = session
+            return BALHttp.session
+
+    def getLimit(self, url):
+        """
+        This function is used for getting the semaphore that limits the
+        number of requests made at the same time to the host of a URL.
+
+        - url (string): The URL that will be requested.
+
+        Returns: The threading.BoundedSemaphore object for the host.
+        """
+        host = urlparse.urlsplit(url).netloc
+        with self.lock:
+            if host not in self.limits:
+                self.limits[host] = threading.BoundedSemaphore(
+                    self.connections)
+            return self.limits[host]
+
+    def request(self, url, method="GET", stream=False, limit=True):
+        """
+        This function is used for making a request, which is retried if a
+        temporary error has occurred.
+
+        - url (string): The URL to request.
+        - method (string): The HTTP method to use.
+        - stream (boolean): Whether to leave the body of the response to be
+        read later, in which case the response must be closed by the caller.
+        - limit (boolean): Whether to wait for the limit on the requests made
+        at the same time to the host, False if the caller already holds it.
+
+        Returns: The requests.Response object. The last exception raised is
+        raised again if all retries have been used up.
+        """
+        def send():
+            return self.getSession().request(method, url,
+                                             timeout=self.timeout,
+                                             stream=stream,
+                                             allow_redirects=True)
+
+        def attempt():
+            if limit:
+                with self.getLimit(url):
+                    response = send()
+            else:
+                response = send()
+            if response.status_code in self.retry.retriablecodes:
+                response.close()
+                response.raise_for_status()
+            return response
+
+        self.common.giveDebugMessage("%s %s" % (method, url))
+        return self.retry.call(attempt)
+
+    def getText(self, url):
+        """
+        This function is used for getting the contents of a URL.
+
+        - url (string): The URL to retrieve.
+
+        Returns: String with the raw contents, None if an error occurred.
+        """
+        try:
+            response = self.request(url)
+        except (requests.exceptions.RequestException, IOError):
+            return None
+        if (response.status_code != 200):
+            return None
+        return response.content
+
+    def getJson(self, url):
+        """
+        This function is used for getting a JSON document from a URL.
+
+        - url (string): The URL to retrieve.
+
+        Returns: The decoded JSON document, None if an error occurred or if
+        the contents are not in JSON format.
+        """
+        raw = self.getText(url)
+        if raw is None:
+            return None
+        try:
+            return json.loads(raw)
+        except ValueError:
+            self.common.giveDebugMessage("The contents of %s are not in JSON "
+                                         "format" % (url))
+            return None
+
+    def exists(self, url):
+        """
+        This function is used for checking whether a resource exists at a URL
+        without downloading it, using a HEAD request. A GET request is only
+        made if the server does not support HEAD requests, and the body is
+        not read.
+
+        - url (string): The URL to check.
+
+        Returns: True if the resource exists, False if otherwise.
+        """
+        try:
+            response = self.request(url, method="HEAD")
+            if response.status_code in [405, 501]:
+                response = self.request(url, stream=True)
+                response.close()
+        except (requests.exceptions.RequestException, IOError):
+            return False
+        return response.status_code == 200
+
+    def getSize(self, url):
+        """
+        This function is used for getting the size of a resource at a URL
+        without downloading it, using a HEAD request.
+
+        - url (string): The URL to check.
+
+        Returns: Int with the size in bytes, None if the resource does not
+        exist or the server did not give its size.
+        """
+        try:
+            response = self.request(url, method="HEAD")
+        except (requests.exceptions.RequestException, IOError):
+            return None
+        size = response.headers.get('Content-Length')
+        if (response.status_code != 200 or size is None):
+            return None
+        return int(size)
+
+    def existsMany(self, urls):
+        """
+        This function is used for checking whether resources exist at many
+        URLs at the same time.
+
+        - urls (list): The URLs to check.
+
+        Returns: Dict with the URLs and whether a resource exists at each.
+        """
+        urls = list(urls)
+        return dict(zip(urls, self.map(self.exists, urls)))
+
+    def download(self, url, path, maxsize=None):
+        """
+        This function is used for downloading a URL into a local file. A
+        partially downloaded file is removed if an error has occurred.
+
+        - url (string): The URL to download.
+        - path (string): The path to the local file.
+        - maxsize (int): The maximum number of bytes allowed, nothing is
+        downloaded if the size given by the server is larger than this.
+
+        Returns: True if the file is downloaded, False if otherwise.
+        """
+        # The body is read after the request has returned, so the limit is
+        # held until the whole file has been downloaded
+        with self.getLimit(url):
+            try:
+                response = self.request(url, stream=True, limit=False)
+            except (requests.exceptions.RequestException, IOError):
+                return False
+            try:
+                if (response.status_code != 200):
+                    return False
+                size = response.headers.get('Content-Length')
+                if (maxsize is not None and size is not None and
+                        int(size) > maxsize):
+                    self.common.giveError("Error: %s is larger than the "
+                                          "space available for it!" % (url))
+                    return False
+                with open(path, 'wb') as localfile:
+                    for block in response.iter_content(1024*1024):
+                        localfile.write(block)
+                return True
+            except (requests.exceptions.RequestException, IOError):
+                if (os.path.exists(path)):
+                    os.remove(path)
+                return False
+            finally:
+                response.close()
+
+    @staticmethod
+    def writeFile(path, contents):
+        """
+        This function is used for replacing a local file at once, so that it
+        is never read while it is only partly written. The contents are first
+        written into a temporary file of its own in the same directory, since
+        the file may be written by other threads at the same time.
+
+        - path (string): The path to the local file.
+        - contents (string): The contents to write.
+        """
+        directory, filename = os.path.split(path)
+        fd, temppath = tempfile.mkstemp(prefix=filename + '.', dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as localfile:
+                localfile.write(contents)
+            os.rename(temppath, path)
+        except:
+            if (os.path.exists(temppath)):
+                os.remove(temppath)
+            raise
+
+    def getCached(self, url, filename, maxage=60*60*24):
+        """
+        This function is used for getting the contents of a URL through a
+        local copy kept in the cache directory (the "cachedir" option in the
+        "main" section of the configuration). The copy is revalidated with a
+        conditional request once it is older than the given age, so that the
+        contents are only downloaded again if they have changed. The local
+        copy is used if the server cannot be reached.
+
+        - url (string): The URL to retrieve.
+        - filename (string): The name of the local copy in the cache
+        directory.
+        - maxage (int): The number of seconds after which the local copy is
+        revalidated.
+
+        Returns: Tuple with the contents and their md5sum, (None, None) if
+        the URL could not be retrieved and there is no local copy.
+        """
+        BALConfig = config.BALConfig('main')
+        cachedir = BALConfig.get('cachedir', default=os.path.join(
+            tempfile.gettempdir(), 'balchivist-cache'))
+        cachedir = os.path.expanduser(cachedir)
+        if not os.path.exists(cachedir):
+            os.makedirs(cachedir)
+        path = os.path.join(cachedir, filename)
+        metapath = path + '.meta.json'
+
+        meta = {}
+        if os.path.exists(path) and os.path.exists(metapath):
+            with open(metapath, 'r') as metafile:
+                try:
+                    meta = json.load(metafile)
+                except ValueError:
+                    meta = {}
+
+        def readCopy():
+            if not meta:
+                return None, None
+            with open(path, 'rb') as localfile:
+                return localfile.read(), meta.get('md5')
+
+        if (meta and time.time() - meta.get('checked', 0) < maxage):
+            return readCopy()
+
+        headers = {}
+        if meta.get('etag') is not None:
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('modified') is not None:
+            headers['If-Modified-Since'] = meta['modified']
+        try:
+            with self.getLimit(url):
+                response = self.getSession().get(url, headers=headers,
+                                                 timeout=self.timeout)
+        except (requests.exceptions.RequestException, IOError):
+            self.common.giveDebugMessage("Unable to revalidate %s, using the "
+                                         "local copy" % (url))
+            return readCopy()
+
+        if (response.status_code == 304 and meta):
+            self.common.giveDebugMessage("%s has not changed" % (url))
+        elif (response.status_code == 200):
+            md5 = hashlib.md5(response.content).hexdigest()
+            if (md5 != meta.get('md5')):
+                self.writeFile(path, response.content)
+            meta = {
+                'md5': md5,
+                'etag': response.headers.get('ETag'),
+                'modified': response.headers.get('Last-Modified')
+            }
+        else:
+            return readCopy()
+        meta['checked'] = time.time()
+        self.writeFile(metapath, json.dumps(meta))
+        return readCopy()
+
+    def map(self, function, arguments):
+        """
+        This function is used for calling a function (such as one that makes
+        requests) with each of the given arguments concurrently.
+
+        - function (function): The function to call with each argument.
+        - arguments (list): The arguments to give to the function.
+
+        Returns: List with the return values in the order of the arguments.
+        """
+        arguments = list(arguments)
+        if (len(arguments) <= 1):
+            return [function(argument) for argument in arguments]
+        workers = min(len(arguments), self.connections)
+        pool = multiprocessing.pool.ThreadPool(processes=workers)
+        try:
+            return pool.map(function, arguments)
+        finally:
+            pool.close()
+            pool.join()
+
+
+if __name__ == '__main__':
+    BALMessage = message.BALMessage()
+    raise IncorrectUsage(BALMessage.getMessage('exception-incorrectusage'))
@@ -0,0 +1,128 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Copyright (C) 2015-2018 Hydriz Scholz
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+
+import common
+from exception import IncorrectUsage
+import message
+
+
+class BALLease(object):
+    """
+    This module is used for keeping the claim on an item alive while a job is
+    running on it. The claim is renewed in the background on a separate
+    database connection, so that the claims of workers that have died can be
+    told apart from those of workers that are still busy.
+
+    It is used as a context manager around the job:
+
+        with BALLease(sqldb=sqldb, dbtable=dbtable, token=token):
+            ...
+    """
+
+    def __init__(self, sqldb, dbtable, token, period=None, debug=False,
+                 verbose=False):
+        """
+        This function is executed when a new instance of BALLease is
+        initialized.
+
+        - sqldb (object): A BALSqlDb instance with the settings to use.
+        - dbtable (string): The name of the database table.
+        - token (string): The token of the claim given by claimItem, nothing
+        is renewed if this is None (such as in debug mode).
+        - period (int): The number of seconds between two renewals, the
+        heartbeat period of the database backend will be used by default.
+        - debug (boolean): Whether or not to provide debugging output.
+        - verbose (boolean): Whether or not to provide more verbosity.
+        """
+        self.sqldb = sqldb
+        self.dbtable = dbtable
+        self.token = token
+        if period is None:
+            self.period = sqldb.heartbeatperiod
+        else:
+            self.period = period
+        self.common = common.BALCommon(debug=debug, verbose=verbose)
+        self.stopped = threading.Event()
+        self.thread = None
+        self.lost = False
+
+    def run(self):
+        """
+        This function is used for renewing the claim until the lease is
+        stopped. Errors are not fatal, since the claim only expires after a
+        few renewals have been missed.
+        """
+        sqldb = self.sqldb.getCopy()
+        try:
+            while not self.stopped.wait(self.period):
+                try:
+                    renewed = sqldb.renewClaim(self.dbtable, self.token)
+                except Exception as exception:
+                    self.common.giveDebugMessage("%s was caught when renewing "
+                                                 "the claim" %
+                                                 (type(exception).__name__))
+                    continue
+                if not renewed and not self.lost:
+                    self.lost = True
+                    self.common.giveError("Warning: The claim on the item "
+                                          "has expired and may be worked on "
+                                          "by another host!")
+        finally:
+            sqldb.close()
+
+    def start(self):
+        """
+        This function is used for starting to renew the claim.
+        """
+        if self.token is None or self.thread is not None:
+            return
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """
+        This function is used for stopping the renewals of the claim, which
+        should be done before the claim is released.
+        """
+        if self.thread is None:
+            return
+        self.stopped.set()
+        self.thread.join()
+        self.thread = None
+
+    def __enter__(self):
+        """
+        This function is executed when entering the "with" block.
+        """
+        self.start()
+        return self
+
+    def __exit__(self, exctype, excvalue, traceback):
+        """
+        This function is executed when leaving the "with" block, even if an
+        exception has been raised inside it.
+        """
+        self.stop()
+        return False
+
+
+if __name__ == '__main__':
+    BALMessage = message.BALMessage()
+    raise IncorrectUsage(BALMessage.getMessage('exception-incorrectusage'))
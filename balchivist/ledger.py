@@ -0,0 +1,187 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Copyright (C) 2015-2018 Hydriz Scholz
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import sqlite3
+import time
+
+from exception import IncorrectUsage
+import message
+
+
+class BALLedger(object):
+    """
+    This module is used for keeping a local record of the state of every file
+    that is being archived, so that an interrupted archiving process can be
+    resumed after a restart without downloading the files again. Files
+    recorded as uploaded should still be confirmed with the Internet Archive
+    (see BALArchiver.getDoneFiles) before they are skipped.
+
+    The states that a file goes through are:
+    - "downloaded": The file has been downloaded into the local directory.
+    - "hashed": The md5sum of the local file matches the one given upstream.
+    - "uploading": The file is being uploaded to the Internet Archive.
+    - "uploaded": The file has been uploaded to the Internet Archive.
+    - "verified": The Internet Archive has verified the md5sum of the file.
+    """
+    ledgerfile = os.path.dirname(os.path.realpath(__file__))
+    ledgerfile += "/../ledger.sqlite"
+    states = [
+        "downloaded",
+        "hashed",
+        "uploading",
+        "uploaded",
+        "verified"
+    ]
+    # States in which the file does not have to be uploaded again
+    donestates = [
+        "uploaded",
+        "verified"
+    ]
+
+    def __init__(self, ledgerfile=None):
+        """
+        This function is executed when a new instance of BALLedger is
+        initialized.
+
+        - ledgerfile (string): The path to the ledger file. The file
+        "ledger.sqlite" in the root directory will be used by default.
+        """
+        if ledgerfile is not None:
+            self.ledgerfile = ledgerfile
+        self.execute('CREATE TABLE IF NOT EXISTS files ('
+                     'identifier TEXT NOT NULL, '
+                     'filename TEXT NOT NULL, '
+                     'state TEXT NOT NULL, '
+                     'size INTEGER, '
+                     'md5 TEXT, '
+                     'updated REAL, '
+                     'PRIMARY KEY (identifier, filename))')
+
+    def execute(self, query, params=()):
+        """
+        This function is used to execute a query on the ledger.
+
+        - query (string): The query to execute on the ledger.
+        - params (tuple): Parameters to substitute in the query.
+
+        Returns: List with the query results.
+        """
+        conn = sqlite3.connect(self.ledgerfile, timeout=60)
+        try:
+            with conn:
+                return conn.execute(query, params).fetchall()
+        finally:
+            conn.close()
+
+    def setState(self, identifier, filename, state, size=None, md5=None):
+        """
+        This function is used to record the state of a file. Details that
+        are not given are kept from the previous record of the file.
+
+        - identifier (string): The identifier of the Internet Archive item.
+        - filename (string): The name of the file.
+        - state (string): The new state of the file, one of self.states.
+        - size (int): The size of the file in bytes.
+        - md5 (string): The md5sum of the file.
+        """
+        if state not in self.states:
+            raise ValueError("Unknown ledger state: %s" % (state))
+        previous = self.getState(identifier, filename)
+        if previous is None:
+            previous = {}
+        values = {
+            'size': size,
+            'md5': md5
+        }
+        for key, val in values.items():
+            if val is None:
+                values[key] = previous.get(key)
+        self.execute('INSERT OR REPLACE INTO files (identifier, filename, '
+                     'state, size, md5, updated) VALUES (?, ?, ?, ?, ?, ?)',
+                     (identifier, filename, state, values['size'],
+                      values['md5'], time.time()))
+
+    def getState(self, identifier, filename):
+        """
+        This function is used to get the recorded state of a file.
+
+        - identifier (string): The identifier of the Internet Archive item.
+        - filename (string): The name of the file.
+
+        Returns: Dict with the state and details of the file, None if the
+        file has not been recorded.
+        """
+        results = self.execute('SELECT state, size, md5 FROM files WHERE '
+                               'identifier = ? AND filename = ?',
+                               (identifier, filename))
+        for result in results:
+            return {
+                'state': result[0],
+                'size': result[1],
+                'md5': result[2]
+            }
+        return None
+
+    def getFiles(self, identifier, states=None):
+        """
+        This function is used to get all recorded files of an item.
+
+        - identifier (string): The identifier of the Internet Archive item.
+        - states (list): Only return files in these states, None for all.
+
+        Returns: Dict with the file names and their states and details, in
+        the same format as self.getState.
+        """
+        output = {}
+        results = self.execute('SELECT filename, state, size, md5 FROM files '
+                               'WHERE identifier = ?', (identifier,))
+        for result in results:
+            if (states is None or result[1] in states):
+                output[result[0]] = {
+                    'state': result[1],
+                    'size': result[2],
+                    'md5': result[3]
+                }
+        return output
+
+    def isUploaded(self, identifier, filename):
+        """
+        This function is used to check whether a file has been recorded as
+        uploaded.
+
+        - identifier (string): The identifier of the Internet Archive item.
+        - filename (string): The name of the file.
+
+        Returns: True if the file does not need to be uploaded again, False
+        if otherwise.
+        """
+        state = self.getState(identifier, filename)
+        return (state is not None and state['state'] in self.donestates)
+
+    def forget(self, identifier):
+        """
+        This function is used to remove all records of an item, such as after
+        it has been checked (whether or not the check has passed).
+
+        - identifier (string): The identifier of the Internet Archive item.
+        """
+        self.execute('DELETE FROM files WHERE identifier = ?', (identifier,))
+
+
+if __name__ == '__main__':
+    BALMessage = message.BALMessage()
+    raise IncorrectUsage(BALMessage.getMessage('exception-incorrectusage'))
@@ -14,6 +14,10 @@
 # You should have received a copy of the GNU General Public License
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
+import datetime
+import json
+import os
+import re
 import subprocess
 import time
 
@@ -23,6 +27,12 @@ import message
 
 
 class BALMaintenance(object):
+    patchdir = os.path.dirname(os.path.realpath(__file__))
+    patchdir += "/../maintenance/database"
+    moduledir = os.path.dirname(os.path.realpath(__file__)) + "/../modules"
+    # The table recording the database patches that have been applied
+    versiontable = "schema_version"
+
     def __init__(self, params={}, sqldb=None):
         """
         This module is used for performing maintenance tasks on the Balchivist
@@ -83,6 +93,256 @@ class BALMaintenance(object):
                    "run \"git pull\" to update the library to the latest "
                    "version!")
 
+    @staticmethod
+    def getSqlStatements(sqlfile):
+        """
+        This function is used for splitting an SQL file into the individual
+        statements, since only one statement can be executed at a time.
+
+        - sqlfile (string): The path to the SQL file.
+
+        Returns: List of SQL statements without comments.
+        """
+        lines = []
+        with open(sqlfile, 'r') as thefile:
+            for line in thefile.read().splitlines():
+                if line.strip().startswith('--'):
+                    continue
+                else:
+                    lines.append(line)
+        statements = []
+        for statement in '\n'.join(lines).split(';'):
+            statement = ' '.join(statement.split())
+            if statement != '':
+                statements.append(statement)
+        return statements
+
+    @staticmethod
+    def getPatchTable(patchfile):
+        """
+        This function is used for getting the table that a database patch
+        works on, as given by the "-- Table:" line in the patch.
+
+        - patchfile (string): The path to the database patch.
+
+        Returns: String with the name of the table, None if not given.
+        """
+        with open(patchfile, 'r') as thefile:
+            m = re.search(r'^-- Table: (?P<table>\w+)$', thefile.read(),
+                          re.MULTILINE)
+        if m is None:
+            return None
+        else:
+            return m.group('table')
+
+    def getPatches(self):
+        """
+        This function is for getting all database patches in the order that
+        they should be applied.
+
+        Returns: List of the file names of the database patches.
+        """
+        patches = []
+        for patch in os.listdir(self.patchdir):
+            if patch.startswith('patch-') and patch.endswith('.sql'):
+                patches.append(patch)
+        return sorted(patches)
+
+    def getAppliedPatches(self):
+        """
+        This function is for getting the database patches that have been
+        recorded, creating the table that records them if necessary.
+
+        Returns: Dict with the file names of the recorded database patches and
+        the time they were applied (None if the patch is still being applied
+        or was interrupted).
+        """
+        self.sqldb.execute('CREATE TABLE IF NOT EXISTS %s (patch '
+                           'VARCHAR(255) NOT NULL PRIMARY KEY, applied_at '
+                           'DATETIME);' % (self.versiontable))
+        results = self.sqldb.select(dbtable=self.versiontable,
+                                    columns=['patch', 'applied_at'])
+        applied = {}
+        if results is not None:
+            for result in results:
+                applied[result[0]] = result[1]
+        return applied
+
+    def isStatementApplied(self, statement):
+        """
+        This function is used for checking whether a statement in a database
+        patch has already taken effect, so that a patch that was interrupted
+        can be applied again safely.
+
+        - statement (string): The SQL statement.
+
+        Returns: True if the statement should be skipped, False if otherwise.
+        """
+        m = re.match(r'CREATE INDEX (?P<index>\w+) ON (?P<table>\w+)',
+                     statement, re.IGNORECASE)
+        if m is not None:
+            return self.sqldb.indexExists(m.group('table'), m.group('index'))
+        m = re.match(r'DROP INDEX (?P<index>\w+) ON (?P<table>\w+)',
+                     statement, re.IGNORECASE)
+        if m is not None:
+            return not self.sqldb.indexExists(m.group('table'),
+                                              m.group('index'))
+        m = re.match(r'ALTER TABLE (?P<table>\w+) ADD COLUMN (?P<column>\w+)',
+                     statement, re.IGNORECASE)
+        if m is not None:
+            return self.sqldb.columnExists(m.group('table'),
+                                           m.group('column'))
+        m = re.match(r'ALTER TABLE (?P<table>\w+) .*ADD PRIMARY KEY',
+                     statement, re.IGNORECASE)
+        if m is not None:
+            return self.sqldb.indexExists(m.group('table'), 'PRIMARY')
+        return False
+
+    def getOnlineStatement(self, statement):
+        """
+        This function is used for making index builds in database patches
+        online-safe, so that the tables can still be read and written while
+        the indexes are being built or dropped. This is only done for database
+        backends that support it.
+
+        - statement (string): The SQL statement.
+
+        Returns: String with the SQL statement to execute.
+        """
+        if not self.sqldb.onlineddl:
+            return statement
+        elif ('ALGORITHM=' in statement.upper()):
+            return statement
+        elif re.match(r'(CREATE|DROP) INDEX ', statement, re.IGNORECASE):
+            return statement + ' ALGORITHM=INPLACE LOCK=NONE'
+        else:
+            return statement
+
+    def claimPatch(self, patch):
+        """
+        This function is for recording that a database patch is being
+        applied, so that other instances of Balchivist starting at the same
+        time do not apply the same patch.
+
+        - patch (string): The file name of the database patch.
+
+        Returns: True if the patch has been claimed, False if otherwise.
+        """
+        values = {
+            'patch': patch,
+            'applied_at': None
+        }
+        return self.sqldb.insert(dbtable=self.versiontable, values=values)
+
+    def applyPatch(self, patch):
+        """
+        This function is for applying a claimed database patch and recording
+        it as applied. Statements that have already taken effect are skipped.
+        Patches for tables that do not exist (such as those for modules that
+        are not in use) are recorded without being executed, as the schema of
+        these tables will be created in full.
+
+        - patch (string): The file name of the database patch.
+
+        Returns: True if the patch is applied, False if an error occurred.
+        """
+        patchfile = "%s/%s" % (self.patchdir, patch)
+        table = self.getPatchTable(patchfile)
+        if (table is not None and not self.sqldb.tableExists(table)):
+            print ("Skipping %s as the %s table does not exist" %
+                   (patch, table))
+        else:
+            print ("Applying %s..." % (patch))
+            try:
+                for statement in self.getSqlStatements(patchfile):
+                    if self.isStatementApplied(statement):
+                        continue
+                    self.sqldb.execute(self.getOnlineStatement(statement))
+            except Exception as exception:
+                print ("ERROR: %s could not be applied: %s" %
+                       (patch, exception))
+                return False
+        values = {
+            'applied_at': datetime.datetime.now()
+        }
+        return self.sqldb.update(dbtable=self.versiontable, values=values,
+                                 conds={'patch': patch}) is not None
+
+    def createTables(self):
+        """
+        This function is for creating the tables of the modules in use that
+        do not exist yet, using the schema in the modules directory.
+
+        Returns: True if all tables exist, False if an error occurred.
+        """
+        for module in json.loads(self.config.get('modules')):
+            if self.sqldb.tableExists(module):
+                continue
+            elif (self.debug):
+                print ("Missing table: %s" % (module))
+                continue
+            print ("Creating the %s table..." % (module))
+            try:
+                for statement in self.getSqlStatements(
+                        "%s/%s.sql" % (self.moduledir, module)):
+                    self.sqldb.execute(statement)
+            except Exception as exception:
+                print ("ERROR: The %s table could not be created: %s" %
+                       (module, exception))
+                return False
+        return True
+
+    def updateDatabase(self, automatic=False):
+        """
+        This maintenance function is used for applying all pending database
+        patches in order and creating the tables of new modules. Interrupted
+        patches are resumed, since the statements that have already taken
+        effect are skipped.
+
+        - automatic (boolean): Whether the update is done automatically when
+        starting Balchivist. Nothing is printed if the database is already
+        up-to-date, and a patch that is blocked (such as one that another
+        instance is still applying) is skipped with a warning together with
+        the patches after it, instead of stopping Balchivist from starting.
+
+        Returns: True if the database is up-to-date (or only has blocked
+        patches left when done automatically), False if a patch could not be
+        applied.
+        """
+        if not automatic:
+            print ("Checking for pending database patches...")
+        applied = self.getAppliedPatches()
+        pending = []
+        for patch in self.getPatches():
+            if patch not in applied:
+                pending.append(patch)
+            elif (applied[patch] is None):
+                print ("Resuming interrupted patch %s" % (patch))
+                pending.append(patch)
+        for patch in pending:
+            if (self.debug):
+                print ("Pending database patch: %s" % (patch))
+                continue
+            elif (patch not in applied and not self.claimPatch(patch)):
+                # Another instance has just claimed this patch
+                print ("WARNING: %s is being applied elsewhere" % (patch))
+            elif self.applyPatch(patch):
+                continue
+            elif (patch not in applied or not automatic):
+                return False
+            else:
+                print ("WARNING: %s could not be resumed, it may still be "
+                       "being applied elsewhere" % (patch))
+            if not automatic:
+                return False
+            # Later patches may depend on this patch, skip them as well
+            print ("WARNING: Skipping %s and the patches after it, run the "
+                   "maintenance mode to apply them" % (patch))
+            break
+        if (pending == [] and not automatic):
+            print ("Great, the database is already up-to-date.")
+        return self.createTables()
+
     def execute(self):
         """
         The main function for executing this module.
@@ -91,6 +351,7 @@ class BALMaintenance(object):
         self.getWarningHeaders()
         # Execute all maintenance tasks in this section
         self.checkVersion()
+        self.updateDatabase()
         # End the maintenance mode
         self.getEnding()
 
@@ -0,0 +1,214 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Copyright (C) 2015-2018 Hydriz Scholz
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import email.utils
+import random
+import socket
+import threading
+import time
+
+import requests
+
+import common
+from exception import IncorrectUsage
+import message
+
+
+class BALRetry(object):
+    """
+    This module is used for retrying requests made to remote servers, such as
+    the Internet Archive, using exponential backoff with jitter. Only errors
+    that are likely to be temporary are retried, everything else is raised
+    back to the caller immediately.
+    """
+    # HTTP status codes that indicate a temporary problem on the server side
+    retriablecodes = [408, 429, 500, 502, 503, 504]
+
+    # The total number of retries allowed for all instances of each client in
+    # this process within the budget window (in seconds), so that a server
+    # that is down does not keep every item retrying for a long time.
+    budget = 100
+    budgetwindow = 60*60
+    # The retries spent and the start of the window for each client, which
+    # are shared by all threads in this process
+    budgets = {}
+    lock = threading.Lock()
+
+    def __init__(self, retries=3, basedelay=2, maxdelay=300, client="ia",
+                 debug=False, verbose=False):
+        """
+        This function is executed when a new instance of BALRetry is
+        initialized.
+
+        - retries (int): The number of times to retry after the first attempt.
+        - basedelay (int): The delay in seconds before the first retry, which
+        is doubled for every subsequent retry.
+        - maxdelay (int): The maximum delay in seconds between two attempts,
+        unless the server asks for a longer delay using Retry-After.
+        - client (string): The name of the retry budget to use, so that the
+        errors from one server do not use up the retries meant for another.
+        - debug (boolean): Whether or not to provide debugging output.
+        - verbose (boolean): Whether or not to provide more verbosity.
+        """
+        self.retries = retries
+        self.basedelay = basedelay
+        self.maxdelay = maxdelay
+        self.client = client
+        self.common = common.BALCommon(debug=debug, verbose=verbose)
+
+    @staticmethod
+    def getResponse(exception):
+        """
+        This function is used for getting the HTTP response attached to an
+        exception, if there is any.
+
+        - exception (object): The exception object caught.
+
+        Returns: The response object, or None if there is none.
+        """
+        return getattr(exception, 'response', None)
+
+    def isRetriable(self, exception):
+        """
+        This function is used for classifying an exception as either a
+        temporary error that is worth retrying or a fatal error.
+
+        - exception (object): The exception object caught.
+
+        Returns: True if the request should be retried, False if otherwise.
+        """
+        response = self.getResponse(exception)
+        if response is not None:
+            return response.status_code in self.retriablecodes
+        elif isinstance(exception, (requests.exceptions.ConnectionError,
+                                    requests.exceptions.Timeout,
+                                    socket.timeout, socket.error)):
+            return True
+        else:
+            return False
+
+    def getRetryAfter(self, exception):
+        """
+        This function is used for getting the delay requested by the server
+        through the Retry-After header, which can either be given in seconds
+        or as a HTTP date.
+
+        - exception (object): The exception object caught.
+
+        Returns: Float with the number of seconds to wait, None if the server
+        did not request for a delay.
+        """
+        response = self.getResponse(exception)
+        if response is None:
+            return None
+        retryafter = response.headers.get('Retry-After')
+        if retryafter is None:
+            return None
+        try:
+            return max(0.0, float(retryafter))
+        except ValueError:
+            pass
+        parsed = email.utils.parsedate_tz(retryafter)
+        if parsed is None:
+            return None
+        return max(0.0, email.utils.mktime_tz(parsed) - time.time())
+
+    def getDelay(self, attempt, exception=None):
+        """
+        This function is used for calculating the delay before the next
+        attempt using exponential backoff with full jitter.
+
+        - attempt (int): The number of attempts made so far.
+        - exception (object): The exception object caught.
+
+        Returns: Float with the number of seconds to wait.
+        """
+        ceiling = min(self.maxdelay, self.basedelay * (2 ** attempt))
+        delay = random.uniform(self.basedelay / 2.0, ceiling)
+        retryafter = None
+        if exception is not None:
+            retryafter = self.getRetryAfter(exception)
+        if retryafter is not None:
+            return max(delay, retryafter)
+        else:
+            return delay
+
+    def useBudget(self):
+        """
+        This function is used for taking one retry from the retry budget of
+        the client.
+
+        Returns: True if a retry is still allowed, False if the budget for the
+        current window has been exhausted.
+        """
+        now = time.time()
+        with self.lock:
+            state = self.budgets.setdefault(self.client, {
+                'spent': 0,
+                'windowstart': now
+            })
+            if (now - state['windowstart'] > self.budgetwindow):
+                state['windowstart'] = now
+                state['spent'] = 0
+            if (state['spent'] >= self.budget):
+                return False
+            state['spent'] += 1
+            return True
+
+    def call(self, function, *args, **kwargs):
+        """
+        This function is used for calling the given function and retrying it
+        when a temporary error is raised.
+
+        - function (function): The function to call.
+        - args (list): The positional arguments to give to the function.
+        - kwargs (dict): The keyword arguments to give to the function.
+
+        Returns: The return value of the given function. The last exception
+        raised is raised again if the error is fatal or if all retries have
+        been used up.
+        """
+        attempt = 0
+        while True:
+            try:
+                return function(*args, **kwargs)
+            except Exception as exception:
+                name = type(exception).__name__
+                if not self.isRetriable(exception):
+                    self.common.giveDebugMessage("%s is not retriable" %
+                                                 (name))
+                    raise
+                elif (attempt >= self.retries):
+                    self.common.giveDebugMessage("%s was caught, no retries "
+                                                 "left" % (name))
+                    raise
+                elif not self.useBudget():
+                    self.common.giveDebugMessage("%s was caught, but the "
+                                                 "retry budget is exhausted" %
+                                                 (name))
+                    raise
+                delay = self.getDelay(attempt, exception)
+                attempt += 1
+                self.common.giveDebugMessage("%s was caught, retrying in %.1f "
+                                             "seconds (attempt %d of %d)" %
+                                             (name, delay, attempt,
+                                              self.retries))
+                time.sleep(delay)
+
+
+if __name__ == '__main__':
+    BALMessage = message.BALMessage()
+    raise IncorrectUsage(BALMessage.getMessage('exception-incorrectusage'))
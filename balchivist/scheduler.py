@@ -0,0 +1,196 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Copyright (C) 2015-2018 Hydriz Scholz
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import fcntl
+import json
+import os
+import random
+import tempfile
+import time
+
+import internetarchive
+
+import common
+from exception import IncorrectUsage
+import message
+
+
+class BALScheduler(object):
+    """
+    This module is used for scheduling uploads to the Internet Archive
+    according to the rate limits of its S3-like API. Before each file is
+    uploaded, the limit-check endpoint is queried and the upload is held back
+    while the task queue for the bucket or the user is overloaded.
+
+    The throttling state is kept in a file shared by all Balchivist processes
+    on the host, so that concurrently running modules back off together
+    instead of hammering the server one after another.
+    """
+    statefile = os.path.join(tempfile.gettempdir(), 'balchivist-s3.json')
+
+    # The number of seconds a successful limit check is trusted for
+    cacheperiod = 15
+    # The delays (in seconds) between two limit checks when overloaded
+    basedelay = 30
+    maxdelay = 60*15
+    # The maximum number of seconds to hold back an upload
+    maxwait = 60*60*6
+
+    def __init__(self, debug=False, verbose=False):
+        """
+        This function is executed when a new instance of BALScheduler is
+        initialized.
+
+        - debug (boolean): Whether or not to provide debugging output.
+        - verbose (boolean): Whether or not to provide more verbosity.
+        """
+        self.common = common.BALCommon(debug=debug, verbose=verbose)
+
+    def isOverloaded(self, identifier):
+        """
+        This function is used for querying the limit-check endpoint of the
+        Internet Archive.
+
+        - identifier (string): The identifier of the item to upload into.
+
+        Returns: True if the bucket or user is over the limit, False if
+        otherwise. Errors are treated as not overloaded, since the upload will
+        be retried anyway.
+        """
+        try:
+            session = internetarchive.get_session()
+            return session.s3_is_overloaded(identifier=identifier,
+                                            access_key=session.access_key)
+        except Exception as exception:
+            self.common.giveDebugMessage("%s was caught when checking the "
+                                         "upload limit" %
+                                         (type(exception).__name__))
+            return False
+
+    def readState(self, statefile):
+        """
+        This function is used for reading the shared throttling state.
+
+        - statefile (file): The opened (and locked) state file.
+
+        Returns: Dict with the throttling state.
+        """
+        statefile.seek(0)
+        try:
+            state = json.load(statefile)
+        except ValueError:
+            state = {}
+        state.setdefault('blockeduntil', 0)
+        state.setdefault('lastok', 0)
+        state.setdefault('overloaded', 0)
+        return state
+
+    def writeState(self, statefile, state):
+        """
+        This function is used for writing the shared throttling state.
+
+        - statefile (file): The opened (and locked) state file.
+        - state (dict): The throttling state.
+        """
+        statefile.seek(0)
+        statefile.truncate()
+        json.dump(state, statefile)
+        statefile.flush()
+
+    def getDelay(self, identifier):
+        """
+        This function is used for determining how long an upload should be
+        held back. The limit-check endpoint is only queried by one process at
+        a time, and not at all if another process has recently done so.
+
+        - identifier (string): The identifier of the item to upload into.
+
+        Returns: Float with the number of seconds to wait, 0 if the upload can
+        proceed right away.
+        """
+        with open(self.statefile, 'a+') as statefile:
+            fcntl.flock(statefile, fcntl.LOCK_EX)
+            try:
+                state = self.readState(statefile)
+                now = time.time()
+                if (state['blockeduntil'] > now):
+                    return state['blockeduntil'] - now
+                elif (now - state['lastok'] < self.cacheperiod):
+                    return 0
+                elif self.isOverloaded(identifier):
+                    state['overloaded'] += 1
+                    ceiling = min(self.maxdelay, self.basedelay *
+                                  (2 ** (state['overloaded'] - 1)))
+                    delay = random.uniform(self.basedelay, max(self.basedelay,
+                                                               ceiling))
+                    state['blockeduntil'] = now + delay
+                    self.writeState(statefile, state)
+                    return delay
+                else:
+                    state['overloaded'] = 0
+                    state['lastok'] = now
+                    self.writeState(statefile, state)
+                    return 0
+            finally:
+                fcntl.flock(statefile, fcntl.LOCK_UN)
+
+    def markOverloaded(self, identifier):
+        """
+        This function is used for telling all processes on the host that the
+        Internet Archive has rejected an upload for being over the limit, so
+        that the next limit check is not skipped.
+
+        - identifier (string): The identifier of the item uploaded into.
+        """
+        with open(self.statefile, 'a+') as statefile:
+            fcntl.flock(statefile, fcntl.LOCK_EX)
+            try:
+                state = self.readState(statefile)
+                state['lastok'] = 0
+                self.writeState(statefile, state)
+            finally:
+                fcntl.flock(statefile, fcntl.LOCK_UN)
+        self.common.giveDebugMessage("Upload to %s was throttled" %
+                                     (identifier))
+
+    def wait(self, identifier):
+        """
+        This function is used for holding back an upload until the Internet
+        Archive is ready to accept it.
+
+        - identifier (string): The identifier of the item to upload into.
+
+        Returns: True if the upload can proceed, False if the upload has been
+        held back for too long.
+        """
+        waited = 0
+        while True:
+            delay = self.getDelay(identifier)
+            if (delay <= 0):
+                return True
+            elif (waited >= self.maxwait):
+                return False
+            timenow = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
+            self.common.giveMessage("The Internet Archive is overloaded, "
+                                    "waiting for %d seconds, %s" %
+                                    (delay, timenow))
+            time.sleep(delay)
+            waited += delay
+
+
+if __name__ == '__main__':
+    BALMessage = message.BALMessage()
+    raise IncorrectUsage(BALMessage.getMessage('exception-incorrectusage'))
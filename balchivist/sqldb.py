@@ -14,8 +14,18 @@
 # You should have received a copy of the GNU General Public License
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
-import MySQLdb
+import collections
+import datetime
 import socket
+import time
+import uuid
+
+try:
+    import MySQLdb
+    from MySQLdb.constants import CLIENT
+except ImportError:
+    # MySQLdb is only needed when the MySQL backend is used
+    MySQLdb = None
 
 from config import BALConfig
 from exception import IncorrectUsage
@@ -26,8 +36,20 @@ class BALSqlDb(object):
     """
     This module is used to provide an interface for interacting with an SQL
     database and the regular functions specific to Balchivist.
+
+    The database is stored on a MySQL server by default. Other backends (see
+    BALSqlite) provide the same interface by overriding the functions used to
+    connect to and inspect the database.
     """
     hostname = socket.gethostname()
+    # Whether indexes can be built without locking the table
+    onlineddl = True
+    # The number of seconds the status of the tables is cached for
+    statusttl = 60
+    # The number of seconds a claim lasts if it is not renewed
+    leaseperiod = 60*30
+    # The number of seconds between two renewals of a claim
+    heartbeatperiod = 60*5
 
     def __init__(self, database="balchivist", host="localhost", user="root", passwd=""):
         """
@@ -42,88 +64,535 @@ class BALSqlDb(object):
         self.host = host
         self.user = user
         self.passwd = passwd
+        self.conn = None
+        # The text of the queries built by this instance, keyed by their
+        # shape, which does not depend on the connection
+        self.statements = {}
+        self.rowcount = 0
+        # The status of each table, with the time it was obtained
+        self.status = {}
 
     @classmethod
     def getFromConf(cls):
         """
         This function is used to initialize a BALSqlDb instance based on the
-        configuration stored in settings.conf.
+        configuration stored in settings.conf, using the database backend
+        given by the "backend" variable ("mysql" by default).
         """
         config = BALConfig('main')
-        return cls(database=config.get('database'),
-                   host=config.get('host'),
-                   user=config.get('user'),
-                   passwd=config.get('passwd'))
+        backend = config.get('backend', default='mysql')
+        if (backend == 'mysql'):
+            return cls(database=config.get('database'),
+                       host=config.get('host'),
+                       user=config.get('user'),
+                       passwd=config.get('passwd'))
+        elif (backend == 'sqlite'):
+            from sqlite import BALSqlite
+            dbfile = config.get('sqlitefile', default=BALSqlite.dbfile)
+            mmapsize = config.get('sqlitemmapsize',
+                                  default=str(BALSqlite.mmapsize))
+            return BALSqlite(database=dbfile, mmapsize=int(mmapsize))
+        else:
+            BALMessage = message.BALMessage()
+            raise IncorrectUsage(
+                BALMessage.getMessage('exception-unknownbackend'))
 
-    def getConds(self, params):
+    def getConds(self, conds):
         """
         This function is used for getting the conditions necessary for the
-        SQL query to work.
+        SQL query to work, with the values given as bound parameters.
+
+        The conditions are given as a dictionary of columns and values:
+        - None is matched with "IS NULL".
+        - Lists and tuples are matched with "IN".
+        - The column may be followed by an operator (e.g. "dumpdate <") to
+        use that operator instead of "=".
+        A string is used as it is, for conditions without any values.
+
+        - conds (dict or string): The conditions to transform.
+
+        Returns: Tuple with the string of SQL-like conditions and the tuple of
+        parameters to substitute in them.
+        """
+        if not isinstance(conds, dict):
+            return conds, ()
+        clauses = []
+        params = []
+        for key in sorted(conds):
+            val = conds[key]
+            if val is None:
+                clauses.append('%s IS NULL' % (key))
+            elif isinstance(val, (list, tuple)):
+                placeholders = ', '.join(['%s'] * len(val))
+                clauses.append('%s IN (%s)' % (key, placeholders))
+                params.extend(val)
+            elif ' ' in key:
+                clauses.append('%s %%s' % (key))
+                params.append(val)
+            else:
+                clauses.append('%s = %%s' % (key))
+                params.append(val)
+        return ' AND '.join(clauses), tuple(params)
+
+    def getCondsKey(self, conds):
+        """
+        This function is used for getting the shape of the given conditions,
+        which is used to look up queries that have been built before.
+
+        - conds (dict or string): The conditions of the query.
+
+        Returns: Tuple describing the conditions without their values.
+        """
+        if not isinstance(conds, dict):
+            return (conds,)
+        key = []
+        for column in sorted(conds):
+            val = conds[column]
+            if val is None:
+                key.append((column, None))
+            elif isinstance(val, (list, tuple)):
+                key.append((column, len(val)))
+            else:
+                key.append((column, ''))
+        return tuple(key)
+
+    def getStatement(self, shape, builder):
+        """
+        This function is used for getting the text of a query that has the
+        given shape, building it only if it has not been built before by this
+        instance. Only the text is kept, the query is still sent to the
+        database server every time it is executed.
+
+        - shape (tuple): The shape of the query.
+        - builder (function): The function that builds the query.
+
+        Returns: String with the query.
+        """
+        if shape not in self.statements:
+            self.statements[shape] = builder()
+        return self.statements[shape]
+
+    def getCopy(self):
+        """
+        This function is used to get a new instance with the same settings,
+        for use in another thread since connections cannot be shared.
 
-        - params (dict): A dictionary of the conditions to transform.
+        Returns: BALSqlDb instance.
+        """
+        return BALSqlDb(database=self.database, host=self.host,
+                        user=self.user, passwd=self.passwd)
+
+    @staticmethod
+    def getTime():
+        """
+        This function is used to get the time used for claims, which is in
+        UTC so that hosts in different time zones agree on it.
 
-        Returns: String with the SQL-like conditions.
+        Returns: Datetime object with the current time.
         """
-        conds = []
-        for cond in params:
-            conds.append('%s="%s"' % (cond, params[cond]))
-        return ' AND '.join(conds)
+        return datetime.datetime.utcnow().replace(microsecond=0)
 
     def claimItem(self, params, dbtable=None):
         """
         This function is used to claim an item from the database to prevent
         other instances of Balchivist from operating on the same item.
 
+        The claim is a lease that expires after self.leaseperiod seconds
+        unless it is renewed using self.renewClaim, so that items claimed by
+        instances that have died are released by self.releaseExpiredClaims.
+
         Note: This function will only work if the module supports claiming of
-        items and that all claims are tracked under the "claimed_by" column,
-        which should be the case for most modules.
+        items and that all claims are tracked under the "claimed_by",
+        "claim_token" and "claimed_at" columns, which should be the case for
+        most modules.
 
         - params (dict): Information about the item to claim, must be as
         unique as possible.
         - dbtable (string): The name of the database table.
 
-        Returns: True if the operation is successful, False if an error has
-        occurred.
+        Returns: String with the token of the claim if the item is claimed,
+        None if the item has already been claimed or an error has occurred.
         """
+        token = uuid.uuid4().hex
         vals = {
-            'claimed_by': '"%s"' % (self.hostname)
+            'claimed_by': self.hostname,
+            'claim_token': token,
+            'claimed_at': self.getTime()
         }
-        return self.update(dbtable=dbtable, values=vals,
-                           conds=self.getConds(params=params))
+        conds = dict(params)
+        conds['claimed_by'] = None
+        if self.update(dbtable=dbtable, values=vals, conds=conds):
+            return token
+        else:
+            return None
+
+    def renewClaim(self, dbtable, token):
+        """
+        This function is used to renew the lease of a claim.
+
+        - dbtable (string): The name of the database table.
+        - token (string): The token of the claim given by self.claimItem.
+
+        Returns: True if the claim is renewed, False if it has expired and
+        has been released or an error has occurred.
+        """
+        vals = {
+            'claimed_at': self.getTime()
+        }
+        conds = {
+            'claim_token': token
+        }
+        return bool(self.update(dbtable=dbtable, values=vals, conds=conds))
+
+    def releaseClaim(self, dbtable, token):
+        """
+        This function is used to release a claim without changing the status
+        of the item, such as when the job has been deferred.
+
+        - dbtable (string): The name of the database table.
+        - token (string): The token of the claim given by self.claimItem.
+
+        Returns: True if update is successful, False if an error occurred.
+        """
+        vals = {
+            'claimed_by': None,
+            'claim_token': None,
+            'claimed_at': None
+        }
+        conds = {
+            'claim_token': token
+        }
+        return (self.update(dbtable=dbtable, values=vals, conds=conds) is
+                not None)
+
+    def releaseExpiredClaims(self, dbtable):
+        """
+        This function is used to release the claims that have not been
+        renewed in time, so that the items can be worked on again.
+
+        - dbtable (string): The name of the database table.
+
+        Returns: Int with the number of claims released.
+        """
+        cutoff = self.getTime()
+        cutoff -= datetime.timedelta(seconds=self.leaseperiod)
+        vals = {
+            'claimed_by': None,
+            'claim_token': None,
+            'claimed_at': None
+        }
+        conds = {
+            'claimed_at <': cutoff
+        }
+        released = self.update(dbtable=dbtable, values=vals, conds=conds)
+        if not released:
+            return 0
+        # The cached status no longer has the released items
+        self.status.pop(dbtable, None)
+        return released
+
+    def connect(self):
+        """
+        This function is used to get the connection to the database, which is
+        kept open and reused for all queries made by this instance.
+
+        Returns: The database connection.
+        """
+        if (MySQLdb is None):
+            raise ImportError("MySQLdb is required for the MySQL backend")
+        elif self.conn is None:
+            # Count the rows matched by an update instead of the rows that
+            # were changed, which is what SQLite does
+            self.conn = MySQLdb.connect(host=self.host, db=self.database,
+                                        user=self.user, passwd=self.passwd,
+                                        client_flag=CLIENT.FOUND_ROWS)
+        return self.conn
+
+    def close(self):
+        """
+        This function is used to close the connection to the database.
+        """
+        if self.conn is not None:
+            try:
+                self.conn.close()
+            except Exception:
+                pass
+        self.conn = None
+
+    def isDisconnected(self, exception):
+        """
+        This function is used to check whether an error was caused by the
+        database server closing the connection.
+
+        - exception (object): The exception object caught.
+
+        Returns: True if the query can be executed again on a new connection,
+        False if otherwise.
+        """
+        # 2006: MySQL server has gone away, 2013: Lost connection
+        return (MySQLdb is not None and
+                isinstance(exception, MySQLdb.OperationalError) and
+                exception.args[0] in (2006, 2013))
+
+    def getQuery(self, query):
+        """
+        This function is used to get the query in the form expected by the
+        database backend. All queries are built with "%s" placeholders.
+
+        - query (string): The query to execute on the database.
+
+        Returns: String with the query.
+        """
+        return query
 
     def execute(self, query, params=()):
         """
         This function is used to execute a query on the database given when
-        initializing the module.
+        initializing the module. The query is executed again on a new
+        connection if the database server has closed the connection.
 
         - query (string): The query to execute on the database.
         - params (tuple): Parameters to substitute in query to prevent SQL
         injection attacks.
 
-        Returns: Tuple with the MySQL query results, else None if empty set.
+        Returns: Tuple with the query results, else None if empty set.
         """
-        result = ()
-        conn = MySQLdb.connect(host=self.host, db=self.database, user=self.user, passwd=self.passwd)
-        cursor = conn.cursor()
-        cursor.execute(query, params)
-        result = cursor.fetchall()
-        conn.commit()
-        cursor.close()
-        conn.close()
-        if result is None or result is ():
+        try:
+            result = self.executeQuery(query, params)
+        except Exception as exception:
+            if self.isDisconnected(exception):
+                self.close()
+                result = self.executeQuery(query, params)
+            else:
+                raise
+        if result is None or result == ():
             return None
         else:
             return result
 
+    def executeQuery(self, query, params=()):
+        """
+        This function is used to execute a query on the current connection.
+
+        - query (string): The query to execute on the database.
+        - params (tuple): Parameters to substitute in the query.
+
+        Returns: Tuple with the query results.
+        """
+        conn = self.connect()
+        cursor = conn.cursor()
+        try:
+            cursor.execute(self.getQuery(query), params)
+            result = tuple(cursor.fetchall())
+            self.rowcount = cursor.rowcount
+            conn.commit()
+        except Exception as exception:
+            if not self.isDisconnected(exception):
+                conn.rollback()
+            raise
+        finally:
+            cursor.close()
+        return result
+
+    def executeMany(self, batch):
+        """
+        This function is used to execute many queries on the database in a
+        single transaction, so that either all or none of them are applied.
+        The batch is executed again on a new connection if the database server
+        has closed the connection.
+
+        - batch (list): Tuples with a query and the list of parameters to
+        execute the query with, once for each item in the list.
+
+        Returns: Int with the number of rows affected.
+        """
+        try:
+            return self.executeBatch(batch)
+        except Exception as exception:
+            if self.isDisconnected(exception):
+                self.close()
+                return self.executeBatch(batch)
+            else:
+                raise
+
+    def executeBatch(self, batch):
+        """
+        This function is used to execute many queries in a single transaction
+        on the current connection.
+
+        - batch (list): Tuples with a query and the list of parameters to
+        execute the query with, once for each item in the list.
+
+        Returns: Int with the number of rows affected.
+        """
+        conn = self.connect()
+        cursor = conn.cursor()
+        rowcount = 0
+        try:
+            for query, paramslist in batch:
+                cursor.executemany(self.getQuery(query), paramslist)
+                rowcount += max(0, cursor.rowcount)
+            conn.commit()
+        except Exception as exception:
+            if not self.isDisconnected(exception):
+                conn.rollback()
+            raise
+        finally:
+            cursor.close()
+        self.rowcount = rowcount
+        return rowcount
+
+    def tableExists(self, dbtable):
+        """
+        This function is used to check whether a table exists in the
+        database.
+
+        - dbtable (string): The name of the database table.
+
+        Returns: True if the table exists, False if otherwise.
+        """
+        query = [
+            'SELECT', 'COUNT(*)',
+            'FROM', 'information_schema.tables',
+            'WHERE', 'table_schema = %s AND table_name = %s'
+        ]
+        results = self.execute(' '.join(query) + ';',
+                               (self.database, dbtable))
+        return results is not None and results[0][0] > 0
+
+    def columnExists(self, dbtable, column):
+        """
+        This function is used to check whether a column exists in a table.
+
+        - dbtable (string): The name of the database table.
+        - column (string): The name of the column.
+
+        Returns: True if the column exists, False if otherwise.
+        """
+        query = [
+            'SELECT', 'COUNT(*)',
+            'FROM', 'information_schema.columns',
+            'WHERE', 'table_schema = %s AND table_name = %s AND',
+            'column_name = %s'
+        ]
+        results = self.execute(' '.join(query) + ';',
+                               (self.database, dbtable, column))
+        return results is not None and results[0][0] > 0
+
+    def indexExists(self, dbtable, index):
+        """
+        This function is used to check whether an index exists on a table.
+
+        - dbtable (string): The name of the database table.
+        - index (string): The name of the index ("PRIMARY" for the primary
+        key).
+
+        Returns: True if the index exists, False if otherwise.
+        """
+        query = [
+            'SELECT', 'COUNT(*)',
+            'FROM', 'information_schema.statistics',
+            'WHERE', 'table_schema = %s AND table_name = %s AND',
+            'index_name = %s'
+        ]
+        results = self.execute(' '.join(query) + ';',
+                               (self.database, dbtable, index))
+        return results is not None and results[0][0] > 0
+
+    def getStatus(self, tables, maxage=None):
+        """
+        This function is used to get the number of items in each state for
+        the given tables. The status of all tables that are not cached is
+        obtained with a single grouped query, so that the counts for all jobs
+        of all modules only need one round-trip to the database.
+
+        - tables (dict): The database tables and the list of status columns
+        (e.g. "is_archived") that each of them has.
+        - maxage (int): The number of seconds a cached status can be used
+        for, self.statusttl will be used by default.
+
+        Returns: Dict with the database tables and a list of dicts for each
+        of them, with the value of every status column, whether the items are
+        "unclaimed" and the "count" of items.
+        """
+        if maxage is None:
+            maxage = self.statusttl
+        now = time.time()
+        missing = []
+        for dbtable in sorted(tables):
+            if (dbtable in self.status and
+                    now - self.status[dbtable][0] <= maxage):
+                continue
+            missing.append(dbtable)
+
+        if missing:
+            columns = sorted(set(column for dbtable in missing
+                                 for column in tables[dbtable]))
+            queries = []
+            for dbtable in missing:
+                fields = ["'%s'" % (dbtable)]
+                groupby = []
+                for column in columns:
+                    if column in tables[dbtable]:
+                        fields.append(column)
+                        groupby.append(column)
+                    else:
+                        fields.append('NULL AS %s' % (column))
+                fields.extend(['claimed_by IS NULL', 'COUNT(*)'])
+                groupby.append('claimed_by IS NULL')
+                query = [
+                    'SELECT', ', '.join(fields),
+                    'FROM', dbtable,
+                    'GROUP BY', ', '.join(groupby)
+                ]
+                queries.append(' '.join(query))
+            results = self.execute(' UNION ALL '.join(queries) + ';')
+            for dbtable in missing:
+                self.status[dbtable] = (now, [])
+            if results is not None:
+                for result in results:
+                    row = dict(zip(columns, result[1:-2]))
+                    row['unclaimed'] = bool(result[-2])
+                    row['count'] = int(result[-1])
+                    self.status[result[0]][1].append(row)
+
+        output = {}
+        for dbtable in tables:
+            output[dbtable] = self.status[dbtable][1]
+        return output
+
+    def getItemCount(self, dbtable, columns, conds={}):
+        """
+        This function is used to get the number of unclaimed items in a table
+        with the given status, using the cached status where possible.
+
+        - dbtable (string): The database table to count from.
+        - columns (list): The status columns that the table has.
+        - conds (dict): The status columns and the values to match.
+
+        Returns: Int with the number of unclaimed items.
+        """
+        output = 0
+        for row in self.getStatus({dbtable: columns})[dbtable]:
+            if not row['unclaimed']:
+                continue
+            for column, val in conds.iteritems():
+                if row.get(column) != val:
+                    break
+            else:
+                output += row['count']
+        return output
+
     def count(self, dbtable=None, conds='', options='', params=()):
         """
         This function is used to get a count of the number of rows in the
         database depending on the given conditions.
 
         - dbtable (string): The database table to query from.
-        - conds (string): Conditions (WHERE clauses) to add.
+        - conds (dict or string): Conditions (WHERE clauses) to add, see
+        getConds for the format.
         - options (string): Query options.
-        - params (tuple): Parameters to substitute in the query.
+        - params (tuple): Parameters to substitute in string conditions.
 
         Returns: Int with the number of rows for a given query, None if the
         dbtable parameter is missing (which is required).
@@ -132,17 +601,23 @@ class BALSqlDb(object):
             return None
         else:
             output = 0
-            query = [
-                'SELECT', 'COUNT(*)',
-                'FROM', dbtable
-            ]
-            if (conds != ''):
-                extra = ['WHERE', conds, options]
-            else:
-                extra = [options]
-            query.extend(extra)
-            execute = ' '.join(query) + ';'
-            results = self.execute(execute, params)
+            where, condparams = self.getConds(conds)
+
+            def builder():
+                query = [
+                    'SELECT', 'COUNT(*)',
+                    'FROM', dbtable
+                ]
+                if (where != ''):
+                    extra = ['WHERE', where, options]
+                else:
+                    extra = [options]
+                query.extend(extra)
+                return ' '.join(query) + ';'
+
+            shape = ('count', dbtable, self.getCondsKey(conds), options)
+            execute = self.getStatement(shape, builder)
+            results = self.execute(execute, condparams + tuple(params))
             if results is None:
                 output = 0
             else:
@@ -150,33 +625,33 @@ class BALSqlDb(object):
                     output = result[0]
             return output
 
-    def insert(self, dbtable=None, values={}, params=()):
+    def insert(self, dbtable=None, values={}):
         """
         This function is used for inserting new rows into the database.
 
         - dbtable (string): The database table to query from.
-        - values (dict): A dictionary with key and value pairs to insert.
-        - params (tuple): Parameters to substitute in the query.
+        - values (dict): A dictionary of columns and values to insert, with
+        None being inserted as NULL.
 
         Returns: True if insert is successful, False if an error occurred.
         """
         if (dbtable is None):
             return False
         else:
-            keys = []
-            vals = []
-            for key, val in values.iteritems():
-                keys.append(key)
-                vals.append(val)
-
-            query = [
-                'INSERT INTO', dbtable,
-                '(' + ', '.join(keys) + ')',
-                'VALUES', '(' + ', '.join(vals) + ')'
-            ]
-            execute = ' '.join(query) + ';'
+            keys = sorted(values)
+
+            def builder():
+                query = [
+                    'INSERT INTO', dbtable,
+                    '(' + ', '.join(keys) + ')',
+                    'VALUES', '(' + ', '.join(['%s'] * len(keys)) + ')'
+                ]
+                return ' '.join(query) + ';'
+
+            shape = ('insert', dbtable, tuple(keys))
+            execute = self.getStatement(shape, builder)
             try:
-                self.execute(execute, params)
+                self.execute(execute, tuple(values[key] for key in keys))
                 return True
             except:
                 return False
@@ -188,9 +663,10 @@ class BALSqlDb(object):
 
         - dbtable (string): The database table to query from.
         - columns (dict): The column(s) to retrieve from the database.
-        - conds (string): Conditions (WHERE clauses) to add.
+        - conds (dict or string): Conditions (WHERE clauses) to add, see
+        getConds for the format.
         - options (string): Query options.
-        - params (tuple): Parameters to substitute in the query.
+        - params (tuple): Parameters to substitute in string conditions.
 
         Note: options should contain a LIMIT clause to prevent retrieving an
         excessive amount of data from the database.
@@ -200,18 +676,25 @@ class BALSqlDb(object):
         if (dbtable is None):
             return None
         else:
-            query = [
-                'SELECT', ', '.join(columns),
-                'FROM', dbtable
-            ]
-            if (conds != ''):
-                extra = ['WHERE', conds, options]
-            else:
-                extra = [options]
-            query.extend(extra)
-            execute = ' '.join(query) + ';'
+            where, condparams = self.getConds(conds)
+
+            def builder():
+                query = [
+                    'SELECT', ', '.join(columns),
+                    'FROM', dbtable
+                ]
+                if (where != ''):
+                    extra = ['WHERE', where, options]
+                else:
+                    extra = [options]
+                query.extend(extra)
+                return ' '.join(query) + ';'
+
+            shape = ('select', dbtable, tuple(columns),
+                     self.getCondsKey(conds), options)
+            execute = self.getStatement(shape, builder)
             try:
-                return self.execute(execute, params)
+                return self.execute(execute, condparams + tuple(params))
             except:
                 return None
 
@@ -221,34 +704,153 @@ class BALSqlDb(object):
         is different from INSERT (see self.insert instead).
 
         - dbtable (string): The database table to query from.
-        - values (dict): A dictionary of columns and values to update.
-        - conds (string): Conditions (WHERE clauses) to add.
-        - params (tuple): Parameters to substitute in the query.
+        - values (dict): A dictionary of columns and values to update, with
+        None being updated to NULL.
+        - conds (dict or string): Conditions (WHERE clauses) to add, see
+        getConds for the format.
+        - params (tuple): Parameters to substitute in string conditions.
 
-        Returns: True if update is successful, False if an error occurred.
+        Returns: Int with the number of rows updated, None if an error
+        occurred.
         """
         if (dbtable is None):
-            return False
+            return None
         else:
-            vals = []
-            for key, val in values.iteritems():
-                vals.append('%s=%s' % (key, val))
-
-            query = [
-                'UPDATE', dbtable,
-                'SET', ', '.join(vals)
-            ]
-            if (conds != ''):
-                extra = ['WHERE', conds]
-            else:
-                extra = []
-            query.extend(extra)
-            execute = ' '.join(query) + ';'
+            keys = sorted(values)
+            where, condparams = self.getConds(conds)
+
+            def builder():
+                query = [
+                    'UPDATE', dbtable,
+                    'SET', ', '.join(['%s = %%s' % (key) for key in keys])
+                ]
+                if (where != ''):
+                    extra = ['WHERE', where]
+                else:
+                    extra = []
+                query.extend(extra)
+                return ' '.join(query) + ';'
+
+            shape = ('update', dbtable, tuple(keys), self.getCondsKey(conds))
+            execute = self.getStatement(shape, builder)
+            vals = tuple(values[key] for key in keys)
             try:
-                self.execute(execute, params)
-                return True
+                self.execute(execute, vals + condparams + tuple(params))
+                return self.rowcount
             except:
-                return False
+                return None
+
+    def getInsertBatch(self, dbtable, rows):
+        """
+        This function is used for building the queries that insert many new
+        rows, with queries of the same shape grouped together.
+
+        - dbtable (string): The database table to query from.
+        - rows (list): Dicts of columns and values to insert, see self.insert.
+
+        Returns: List of tuples with a query and its list of parameters, for
+        use with self.executeMany.
+        """
+        batch = collections.OrderedDict()
+        for values in rows:
+            keys = sorted(values)
+
+            def builder():
+                query = [
+                    'INSERT INTO', dbtable,
+                    '(' + ', '.join(keys) + ')',
+                    'VALUES', '(' + ', '.join(['%s'] * len(keys)) + ')'
+                ]
+                return ' '.join(query) + ';'
+
+            shape = ('insert', dbtable, tuple(keys))
+            execute = self.getStatement(shape, builder)
+            batch.setdefault(execute, []).append(
+                tuple(values[key] for key in keys))
+        return batch.items()
+
+    def getUpdateBatch(self, dbtable, rows):
+        """
+        This function is used for building the queries that update many rows,
+        with queries of the same shape grouped together.
+
+        - dbtable (string): The database table to query from.
+        - rows (list): Tuples with the dict of columns and values to update and
+        the dict of conditions (see getConds) for each update.
+
+        Returns: List of tuples with a query and its list of parameters, for
+        use with self.executeMany.
+        """
+        batch = collections.OrderedDict()
+        for values, conds in rows:
+            keys = sorted(values)
+            where, condparams = self.getConds(conds)
+
+            def builder():
+                query = [
+                    'UPDATE', dbtable,
+                    'SET', ', '.join(['%s = %%s' % (key) for key in keys])
+                ]
+                if (where != ''):
+                    query.extend(['WHERE', where])
+                return ' '.join(query) + ';'
+
+            shape = ('update', dbtable, tuple(keys), self.getCondsKey(conds))
+            execute = self.getStatement(shape, builder)
+            vals = tuple(values[key] for key in keys)
+            batch.setdefault(execute, []).append(vals + condparams)
+        return batch.items()
+
+    def writeMany(self, dbtable=None, inserts=[], updates=[]):
+        """
+        This function is used for inserting and updating many rows in the
+        database in a single transaction, so that either all or none of the
+        changes are applied.
+
+        - dbtable (string): The database table to query from.
+        - inserts (list): Dicts of columns and values to insert, see
+        self.insertMany.
+        - updates (list): Tuples with the values and conditions of each
+        update, see self.updateMany.
+
+        Returns: True if the changes are written, False if an error occurred.
+        """
+        if (dbtable is None):
+            return False
+        batch = self.getInsertBatch(dbtable, inserts)
+        batch += self.getUpdateBatch(dbtable, updates)
+        if not batch:
+            return True
+        try:
+            self.executeMany(batch)
+            return True
+        except:
+            return False
+
+    def insertMany(self, dbtable=None, rows=[]):
+        """
+        This function is used for inserting many new rows into the database in
+        a single transaction.
+
+        - dbtable (string): The database table to query from.
+        - rows (list): Dicts of columns and values to insert, see self.insert.
+
+        Returns: True if insert is successful, False if an error occurred.
+        """
+        return self.writeMany(dbtable=dbtable, inserts=rows)
+
+    def updateMany(self, dbtable=None, rows=[]):
+        """
+        This function is used for updating many rows in the database in a
+        single transaction, with queries of the same shape sent together.
+
+        - dbtable (string): The database table to query from.
+        - rows (list): Tuples with the dict of columns and values to update and
+        the dict of conditions (see getConds) for each update.
+
+        Returns: True if update is successful, False if an error occurred.
+        """
+        return self.writeMany(dbtable=dbtable, updates=rows)
 
 
 if __name__ == "__main__":
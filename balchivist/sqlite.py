@@ -0,0 +1,177 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Copyright (C) 2015-2018 Hydriz Scholz
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import random
+import sqlite3
+
+from exception import IncorrectUsage
+import message
+from sqldb import BALSqlDb
+
+# Give DATETIME columns back as datetime objects, like MySQLdb does
+sqlite3.register_converter('DATETIME', sqlite3.converters['TIMESTAMP'])
+
+
+class BALSqlite(BALSqlDb):
+    """
+    This module is used to provide the same interface as BALSqlDb, but with
+    the data stored in an embedded SQLite database instead of on a MySQL
+    server. This is meant for deployments where Balchivist runs on a single
+    host, so that no network round-trip is needed for every query.
+
+    The database is opened in write-ahead logging mode so that the database
+    can be read while another instance of Balchivist on the host is writing
+    to it, and is memory-mapped to avoid copying pages on every read.
+    """
+    dbfile = os.path.dirname(os.path.realpath(__file__))
+    dbfile += "/../balchivist.sqlite"
+    # The number of bytes of the database file to memory-map
+    mmapsize = 256*1024*1024
+    onlineddl = False
+
+    def __init__(self, database=None, mmapsize=None):
+        """
+        This function is executed when a new instance of BALSqlite is
+        initialized.
+
+        - database (string): The path to the SQLite database file. The file
+        "balchivist.sqlite" in the root directory will be used by default.
+        - mmapsize (int): The number of bytes of the database file to
+        memory-map, 0 to disable memory-mapped I/O.
+        """
+        if database is None:
+            database = self.dbfile
+        super(BALSqlite, self).__init__(database=os.path.expanduser(database))
+        if mmapsize is not None:
+            self.mmapsize = mmapsize
+
+    def getCopy(self):
+        """
+        This function is used to get a new instance with the same settings,
+        for use in another thread since connections cannot be shared.
+
+        Returns: BALSqlite instance.
+        """
+        return BALSqlite(database=self.database, mmapsize=self.mmapsize)
+
+    def connect(self):
+        """
+        This function is used to get the connection to the database, which is
+        kept open and reused for all queries made by this instance.
+
+        Returns: The database connection.
+        """
+        if self.conn is None:
+            conn = sqlite3.connect(self.database, timeout=60,
+                                   detect_types=sqlite3.PARSE_DECLTYPES,
+                                   check_same_thread=False)
+            # Allow queries written for MySQL to pick random rows
+            conn.create_function('RAND', 0, random.random)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA mmap_size=%d' % (self.mmapsize))
+            self.conn = conn
+        return self.conn
+
+    def isDisconnected(self, exception):
+        """
+        This function is used to check whether an error was caused by the
+        database server closing the connection, which cannot happen with an
+        embedded database.
+
+        - exception (object): The exception object caught.
+
+        Returns: False, always.
+        """
+        return False
+
+    def getQuery(self, query):
+        """
+        This function is used to get the query in the form expected by the
+        sqlite3 module, which uses "?" as the placeholder.
+
+        - query (string): The query to execute on the database.
+
+        Returns: String with the query.
+        """
+        return query.replace('%s', '?')
+
+    def tableExists(self, dbtable):
+        """
+        This function is used to check whether a table exists in the
+        database.
+
+        - dbtable (string): The name of the database table.
+
+        Returns: True if the table exists, False if otherwise.
+        """
+        query = [
+            'SELECT', 'COUNT(*)',
+            'FROM', 'sqlite_master',
+            'WHERE', "type = 'table' AND name = %s"
+        ]
+        results = self.execute(' '.join(query) + ';', (dbtable,))
+        return results is not None and results[0][0] > 0
+
+    def columnExists(self, dbtable, column):
+        """
+        This function is used to check whether a column exists in a table.
+
+        - dbtable (string): The name of the database table.
+        - column (string): The name of the column.
+
+        Returns: True if the column exists, False if otherwise.
+        """
+        query = [
+            'SELECT', 'COUNT(*)',
+            'FROM', 'pragma_table_info(%s)',
+            'WHERE', 'name = %s'
+        ]
+        results = self.execute(' '.join(query) + ';', (dbtable, column))
+        return results is not None and results[0][0] > 0
+
+    def indexExists(self, dbtable, index):
+        """
+        This function is used to check whether an index exists on a table.
+
+        - dbtable (string): The name of the database table.
+        - index (string): The name of the index ("PRIMARY" for the primary
+        key).
+
+        Returns: True if the index exists, False if otherwise.
+        """
+        if (index == 'PRIMARY'):
+            query = [
+                'SELECT', 'COUNT(*)',
+                'FROM', 'pragma_table_info(%s)',
+                'WHERE', 'pk > 0'
+            ]
+            params = (dbtable,)
+        else:
+            query = [
+                'SELECT', 'COUNT(*)',
+                'FROM', 'sqlite_master',
+                'WHERE', "type = 'index' AND tbl_name = %s AND name = %s"
+            ]
+            params = (dbtable, index)
+        results = self.execute(' '.join(query) + ';', params)
+        return results is not None and results[0][0] > 0
+
+
+if __name__ == "__main__":
+    BALMessage = message.BALMessage()
+    raise IncorrectUsage(BALMessage.getMessage('exception-incorrectusage'))
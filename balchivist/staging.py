@@ -0,0 +1,408 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Copyright (C) 2015-2018 Hydriz Scholz
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import errno
+import fcntl
+import json
+import os
+import shutil
+import tempfile
+import time
+import uuid
+
+import common
+import config
+from exception import IncorrectUsage
+import message
+
+
+class BALStaging(object):
+    """
+    This module is used for managing the disk space used for staging items
+    before they are uploaded to the Internet Archive. Jobs reserve the space
+    that they need before downloading anything, and wait (or are deferred)
+    while there is not enough space left, instead of filling up the disk and
+    leaving corrupted partial files behind.
+
+    The reservations are kept in a file shared by all Balchivist processes on
+    the host, and reservations of processes that have died are dropped.
+    """
+    statefile = os.path.join(tempfile.gettempdir(), 'balchivist-staging.json')
+    # The file that lists the staging directories created on the host, so
+    # that they can be cleaned up without walking through the whole root
+    dirsfile = os.path.join(tempfile.gettempdir(),
+                            'balchivist-staging-dirs.json')
+    # The file that marks a directory as created by Balchivist for staging
+    marker = '.balchivist-staging'
+
+    # The number of seconds between two checks when waiting for space
+    pollperiod = 60
+    # The maximum number of seconds to wait for space
+    maxwait = 60*60
+    # The number of seconds after which a staging directory that is not
+    # reserved is removed. Recent directories are kept so that interrupted
+    # jobs can resume with the files that have already been downloaded.
+    orphanage = 60*60*24*2
+
+    def __init__(self, root, debug=False, verbose=False):
+        """
+        This function is executed when a new instance of BALStaging is
+        initialized.
+
+        - root (string): The directory where items are staged.
+        - debug (boolean): Whether or not to provide debugging output.
+        - verbose (boolean): Whether or not to provide more verbosity.
+        """
+        self.root = os.path.realpath(root)
+        self.common = common.BALCommon(debug=debug, verbose=verbose)
+        BALConfig = config.BALConfig('main')
+        budget = float(BALConfig.get('stagingbudget', default='0'))
+        self.budget = int(budget * 1024 * 1024 * 1024)
+
+    @staticmethod
+    def isAlive(pid):
+        """
+        This function is used for checking whether a process is still
+        running on this host.
+
+        - pid (int): The process ID.
+
+        Returns: True if the process is running, False if otherwise.
+        """
+        try:
+            os.kill(pid, 0)
+        except OSError as exception:
+            return exception.errno == errno.EPERM
+        return True
+
+    @staticmethod
+    def getUsage(path):
+        """
+        This function is used for getting the disk space used by the files in
+        a directory.
+
+        - path (string): The path to the directory.
+
+        Returns: Int with the number of bytes used.
+        """
+        usage = 0
+        for dirpath, dirnames, filenames in os.walk(path):
+            for filename in filenames:
+                try:
+                    usage += os.path.getsize(os.path.join(dirpath, filename))
+                except OSError:
+                    continue
+        return usage
+
+    def getFreeSpace(self):
+        """
+        This function is used for getting the free disk space for staging.
+
+        Returns: Int with the number of bytes free.
+        """
+        path = self.root
+        # Use the closest existing directory for the free disk space
+        while not os.path.exists(path) and path != os.path.dirname(path):
+            path = os.path.dirname(path)
+        stat = os.statvfs(path)
+        return stat.f_bavail * stat.f_frsize
+
+    def readState(self, statefile):
+        """
+        This function is used for reading the reservations, leaving out
+        those of processes that are no longer running.
+
+        - statefile (file): The opened (and locked) state file.
+
+        Returns: Dict with the tokens of the reservations and their details.
+        """
+        statefile.seek(0)
+        try:
+            state = json.load(statefile)
+        except ValueError:
+            state = {}
+        for token in list(state):
+            if not self.isAlive(state[token]['pid']):
+                del state[token]
+        return state
+
+    def writeState(self, statefile, state):
+        """
+        This function is used for writing the reservations.
+
+        - statefile (file): The opened (and locked) state file.
+        - state (dict): The reservations.
+        """
+        statefile.seek(0)
+        statefile.truncate()
+        json.dump(state, statefile)
+        statefile.flush()
+
+    def readDirectories(self):
+        """
+        This function is used for reading the list of staging directories.
+        The state file should be locked while doing so.
+
+        Returns: Dict with the paths of the staging directories and the
+        staging roots that they are in.
+        """
+        try:
+            with open(self.dirsfile, 'r') as dirsfile:
+                return json.load(dirsfile)
+        except (IOError, ValueError):
+            return {}
+
+    def writeDirectories(self, dirs):
+        """
+        This function is used for writing the list of staging directories.
+        The state file should be locked while doing so.
+
+        - dirs (dict): The paths of the staging directories and the staging
+        roots that they are in.
+        """
+        temppath = '%s.%d' % (self.dirsfile, os.getpid())
+        with open(temppath, 'w') as dirsfile:
+            json.dump(dirs, dirsfile)
+        os.rename(temppath, self.dirsfile)
+
+    def updateDirectories(self, added=[], removed=[]):
+        """
+        This function is used for adding and removing staging directories
+        from the list of staging directories.
+
+        - added (list): The paths of the directories to add.
+        - removed (list): The paths of the directories to remove.
+        """
+        with open(self.statefile, 'a+') as statefile:
+            fcntl.flock(statefile, fcntl.LOCK_EX)
+            try:
+                dirs = self.readDirectories()
+                for path in added:
+                    dirs[os.path.realpath(path)] = self.root
+                for path in removed:
+                    dirs.pop(path, None)
+                self.writeDirectories(dirs)
+            finally:
+                fcntl.flock(statefile, fcntl.LOCK_UN)
+
+    def getReservations(self, state):
+        """
+        This function is used for getting the reservations in this staging
+        directory.
+
+        - state (dict): The reservations of all staging directories.
+
+        Returns: List of dicts with the details of the reservations.
+        """
+        return [reservation for reservation in state.values()
+                if reservation['root'] == self.root]
+
+    def getAvailable(self, state=None):
+        """
+        This function is used for getting the space that can still be
+        reserved. The space that reserved jobs have yet to download is taken
+        away from the free disk space, and all reservations are taken away
+        from the staging budget of the host.
+
+        - state (dict): The reservations of all staging directories, which
+        are read from the state file if not given.
+
+        Returns: Int with the number of bytes available.
+        """
+        if state is None:
+            with open(self.statefile, 'a+') as statefile:
+                fcntl.flock(statefile, fcntl.LOCK_SH)
+                try:
+                    state = self.readState(statefile)
+                finally:
+                    fcntl.flock(statefile, fcntl.LOCK_UN)
+        reservations = self.getReservations(state)
+        outstanding = 0
+        for reservation in reservations:
+            used = self.getUsage(reservation['path'])
+            outstanding += max(0, reservation['bytes'] - used)
+        available = self.getFreeSpace() - outstanding
+        if (self.budget > 0):
+            reserved = sum([reservation['bytes']
+                            for reservation in reservations])
+            available = min(available, self.budget - reserved)
+        return max(0, available)
+
+    def tryReserve(self, path, size):
+        """
+        This function is used for reserving space if there is enough of it.
+
+        - path (string): The directory where the item will be staged.
+        - size (int): The number of bytes to reserve.
+
+        Returns: Tuple with the token of the reservation (None if the space
+        could not be reserved) and whether other jobs hold reservations.
+        """
+        with open(self.statefile, 'a+') as statefile:
+            fcntl.flock(statefile, fcntl.LOCK_EX)
+            try:
+                state = self.readState(statefile)
+                others = self.getReservations(state) != []
+                if (size > self.getAvailable(state)):
+                    self.writeState(statefile, state)
+                    return None, others
+                token = uuid.uuid4().hex
+                state[token] = {
+                    'root': self.root,
+                    'path': os.path.realpath(path),
+                    'bytes': int(size),
+                    'pid': os.getpid(),
+                    'created': time.time()
+                }
+                self.writeState(statefile, state)
+                return token, others
+            finally:
+                fcntl.flock(statefile, fcntl.LOCK_UN)
+
+    def reserve(self, path, size, wait=True):
+        """
+        This function is used for reserving space for staging an item. The
+        directory is created and marked as a staging directory.
+
+        - path (string): The directory where the item will be staged.
+        - size (int): The number of bytes to reserve.
+        - wait (boolean): Whether to wait for other jobs to free up space.
+
+        Returns: String with the token of the reservation, None if there is
+        not enough space and the job should be deferred.
+        """
+        waited = 0
+        while True:
+            token, others = self.tryReserve(path, size)
+            if token is not None:
+                if not os.path.exists(path):
+                    os.makedirs(path)
+                if (os.path.realpath(path) != self.root):
+                    with open(os.path.join(path, self.marker), 'w'):
+                        pass
+                    self.updateDirectories(added=[path])
+                return token
+            elif (not wait or not others or waited >= self.maxwait):
+                # Waiting does not help if no other job is using the space
+                self.common.giveMessage("Not enough staging space for %s "
+                                        "(%d bytes needed)" % (path, size))
+                return None
+            timenow = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
+            self.common.giveMessage("Waiting for staging space for %s, %s" %
+                                    (path, timenow))
+            time.sleep(self.pollperiod)
+            waited += self.pollperiod
+
+    def release(self, token):
+        """
+        This function is used for releasing a reservation after the item has
+        been uploaded or the job has ended.
+
+        - token (string): The token of the reservation.
+        """
+        if token is None:
+            return
+        with open(self.statefile, 'a+') as statefile:
+            fcntl.flock(statefile, fcntl.LOCK_EX)
+            try:
+                state = self.readState(statefile)
+                state.pop(token, None)
+                self.writeState(statefile, state)
+            finally:
+                fcntl.flock(statefile, fcntl.LOCK_UN)
+
+    def cleanOrphans(self):
+        """
+        This function is used for removing the staging directories that are
+        no longer reserved by any job and have not been used for a while,
+        such as those left behind by jobs that have crashed. Only the
+        directories in the list of staging directories that are still marked
+        as staging directories are looked at, so that the rest of the root is
+        never walked through.
+
+        Returns: Int with the number of directories removed.
+        """
+        with open(self.statefile, 'a+') as statefile:
+            fcntl.flock(statefile, fcntl.LOCK_EX)
+            try:
+                state = self.readState(statefile)
+                self.writeState(statefile, state)
+                dirs = self.readDirectories()
+            finally:
+                fcntl.flock(statefile, fcntl.LOCK_UN)
+        reserved = [reservation['path']
+                    for reservation in self.getReservations(state)]
+        removed = 0
+        gone = []
+        now = time.time()
+        for dirpath, root in dirs.items():
+            if (root != self.root or dirpath in reserved):
+                continue
+            elif not os.path.isfile(os.path.join(dirpath, self.marker)):
+                # The directory has been removed by the job that used it
+                gone.append(dirpath)
+                continue
+            lastused = os.path.getmtime(dirpath)
+            for filename in os.listdir(dirpath):
+                try:
+                    lastused = max(lastused, os.path.getmtime(
+                        os.path.join(dirpath, filename)))
+                except OSError:
+                    continue
+            if (now - lastused < self.orphanage):
+                continue
+            self.common.giveMessage("Removing orphaned staging directory %s" %
+                                    (dirpath))
+            shutil.rmtree(dirpath, ignore_errors=True)
+            gone.append(dirpath)
+            removed += 1
+        if gone:
+            self.updateDirectories(removed=gone)
+        return removed
+
+    def getReport(self):
+        """
+        This function is used for reporting the utilization of the staging
+        directory.
+
+        Returns: Dict with the "root" directory, the "free" disk space, the
+        staging "budget" (0 if there is none), the space "reserved" and
+        "used" by jobs, the space "available" for new jobs and the number of
+        "jobs" holding reservations.
+        """
+        with open(self.statefile, 'a+') as statefile:
+            fcntl.flock(statefile, fcntl.LOCK_EX)
+            try:
+                state = self.readState(statefile)
+                reservations = self.getReservations(state)
+                return {
+                    'root': self.root,
+                    'free': self.getFreeSpace(),
+                    'budget': self.budget,
+                    'reserved': sum([reservation['bytes']
+                                     for reservation in reservations]),
+                    'used': sum([self.getUsage(reservation['path'])
+                                 for reservation in reservations]),
+                    'available': self.getAvailable(state),
+                    'jobs': len(reservations)
+                }
+            finally:
+                fcntl.flock(statefile, fcntl.LOCK_UN)
+
+
+if __name__ == '__main__':
+    BALMessage = message.BALMessage()
+    raise IncorrectUsage(BALMessage.getMessage('exception-incorrectusage'))
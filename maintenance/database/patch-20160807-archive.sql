@@ -2,6 +2,7 @@
 -- changing the "subject" column to "wiki" for clarity.
 -- The "type" column is also dropped as it is no longer needed.
 -- Used for upgrading from version 1.1.0.
+-- Table: archive
 
 ALTER TABLE archive
     RENAME TO dumps,
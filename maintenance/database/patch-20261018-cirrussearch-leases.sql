@@ -0,0 +1,14 @@
+-- Patch for turning claims on the "cirrussearch" table into leases. The time
+-- of the claim is renewed while an item is being worked on, and claims that
+-- have not been renewed for a while are released so that items claimed by
+-- workers that have died are worked on again.
+-- Existing claims are given the current time so that they expire as well.
+-- Table: cirrussearch
+
+ALTER TABLE cirrussearch ADD COLUMN claim_token VARCHAR(255) AFTER claimed_by, ALGORITHM=INPLACE, LOCK=NONE;
+ALTER TABLE cirrussearch ADD COLUMN claimed_at DATETIME AFTER claim_token, ALGORITHM=INPLACE, LOCK=NONE;
+
+UPDATE cirrussearch SET claimed_at = UTC_TIMESTAMP() WHERE claimed_by IS NOT NULL AND claimed_at IS NULL;
+
+CREATE INDEX cirrussearch_claim ON cirrussearch (claim_token);
+CREATE INDEX cirrussearch_lease ON cirrussearch (claimed_at);
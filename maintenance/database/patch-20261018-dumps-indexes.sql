@@ -0,0 +1,21 @@
+-- Patch for adding a primary key and composite indexes to the "dumps" table.
+-- The primary key serves the per-wiki lookups (wiki=... ORDER BY dumpdate),
+-- while the composite indexes match the conditions used when counting and
+-- picking items to archive or check. Since InnoDB appends the primary key to
+-- every secondary index, these indexes also cover the selected columns.
+-- The single-column indexes are dropped as they are prefixes of the new ones.
+-- Note: Duplicate (wiki, dumpdate) rows must be removed before applying.
+-- Table: dumps
+
+ALTER TABLE dumps
+    MODIFY COLUMN wiki VARCHAR(255) NOT NULL,
+    MODIFY COLUMN dumpdate DATE NOT NULL,
+    ADD PRIMARY KEY (wiki, dumpdate),
+    ALGORITHM=INPLACE, LOCK=NONE;
+
+CREATE INDEX dumps_archive ON dumps (is_archived, can_archive, progress, claimed_by);
+CREATE INDEX dumps_check ON dumps (is_archived, is_checked, claimed_by);
+
+DROP INDEX progress ON dumps;
+DROP INDEX is_archived ON dumps;
+DROP INDEX is_checked ON dumps;
@@ -0,0 +1,14 @@
+-- Patch for turning claims on the "dumps" table into leases. The time of the
+-- claim is renewed while an item is being worked on, and claims that have
+-- not been renewed for a while are released so that items claimed by
+-- workers that have died are worked on again.
+-- Existing claims are given the current time so that they expire as well.
+-- Table: dumps
+
+ALTER TABLE dumps ADD COLUMN claim_token VARCHAR(255) AFTER claimed_by, ALGORITHM=INPLACE, LOCK=NONE;
+ALTER TABLE dumps ADD COLUMN claimed_at DATETIME AFTER claim_token, ALGORITHM=INPLACE, LOCK=NONE;
+
+UPDATE dumps SET claimed_at = UTC_TIMESTAMP() WHERE claimed_by IS NOT NULL AND claimed_at IS NULL;
+
+CREATE INDEX dumps_claim ON dumps (claim_token);
+CREATE INDEX dumps_lease ON dumps (claimed_at);
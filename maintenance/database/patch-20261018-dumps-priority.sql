@@ -0,0 +1,11 @@
+-- Patch for adding the priority of dumps to the "dumps" table, so that the
+-- dumps to archive can be picked in order of priority instead of at random.
+-- The new index extends "dumps_archive" with the priority, which is dropped
+-- as it is a prefix of the new index.
+-- Table: dumps
+
+ALTER TABLE dumps ADD COLUMN priority INT NOT NULL DEFAULT 0 AFTER progress, ALGORITHM=INPLACE, LOCK=NONE;
+
+CREATE INDEX dumps_queue ON dumps (is_archived, can_archive, progress, claimed_by, priority);
+
+DROP INDEX dumps_archive ON dumps;
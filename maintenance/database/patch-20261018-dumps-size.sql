@@ -0,0 +1,6 @@
+-- Patch for adding the total size of the files of each dump (in bytes) to
+-- the "dumps" table, so that hosts only pick the dumps that they have the
+-- space for. The sizes are filled in by the next "update" job.
+-- Table: dumps
+
+ALTER TABLE dumps ADD COLUMN size BIGINT AFTER priority, ALGORITHM=INPLACE, LOCK=NONE;
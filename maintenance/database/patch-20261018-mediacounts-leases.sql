@@ -0,0 +1,14 @@
+-- Patch for turning claims on the "mediacounts" table into leases. The time of
+-- the claim is renewed while an item is being worked on, and claims that have
+-- not been renewed for a while are released so that items claimed by workers
+-- that have died are worked on again.
+-- Existing claims are given the current time so that they expire as well.
+-- Table: mediacounts
+
+ALTER TABLE mediacounts ADD COLUMN claim_token VARCHAR(255) AFTER claimed_by, ALGORITHM=INPLACE, LOCK=NONE;
+ALTER TABLE mediacounts ADD COLUMN claimed_at DATETIME AFTER claim_token, ALGORITHM=INPLACE, LOCK=NONE;
+
+UPDATE mediacounts SET claimed_at = UTC_TIMESTAMP() WHERE claimed_by IS NOT NULL AND claimed_at IS NULL;
+
+CREATE INDEX mediacounts_claim ON mediacounts (claim_token);
+CREATE INDEX mediacounts_lease ON mediacounts (claimed_at);
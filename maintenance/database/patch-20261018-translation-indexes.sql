@@ -0,0 +1,18 @@
+-- Patch for adding a primary key and composite indexes to the "translation"
+-- table.
+-- The composite indexes match the conditions used when counting and picking
+-- items to archive or check, and cover the dump date through the primary key.
+-- The single-column indexes are dropped as they are prefixes of the new ones.
+-- Note: Duplicate dumpdate rows must be removed before applying.
+-- Table: translation
+
+ALTER TABLE translation
+    MODIFY COLUMN dumpdate DATE NOT NULL,
+    ADD PRIMARY KEY (dumpdate),
+    ALGORITHM=INPLACE, LOCK=NONE;
+
+CREATE INDEX translation_archive ON translation (is_archived, can_archive, claimed_by);
+CREATE INDEX translation_check ON translation (is_archived, is_checked, claimed_by);
+
+DROP INDEX is_archived ON translation;
+DROP INDEX is_checked ON translation;
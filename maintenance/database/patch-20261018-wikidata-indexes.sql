@@ -0,0 +1,19 @@
+-- Patch for adding a primary key and composite indexes to the "wikidata"
+-- table. The primary key serves the per-wiki lookups (wiki=... ORDER BY
+-- dumpdate), while the composite indexes match the conditions used when
+-- counting and picking items to archive or check.
+-- The single-column indexes are dropped as they are prefixes of the new ones.
+-- Note: Duplicate (wiki, dumpdate) rows must be removed before applying.
+-- Table: wikidata
+
+ALTER TABLE wikidata
+    MODIFY COLUMN wiki VARCHAR(255) NOT NULL,
+    MODIFY COLUMN dumpdate DATE NOT NULL,
+    ADD PRIMARY KEY (wiki, dumpdate),
+    ALGORITHM=INPLACE, LOCK=NONE;
+
+CREATE INDEX wikidata_archive ON wikidata (is_archived, can_archive, claimed_by);
+CREATE INDEX wikidata_check ON wikidata (is_archived, is_checked, claimed_by);
+
+DROP INDEX is_archived ON wikidata;
+DROP INDEX is_checked ON wikidata;
@@ -0,0 +1,7 @@
+-- Patch for adding the staging space needed by each dump (in bytes) to the
+-- "dumps" table, which is the size of the largest file for dumps that are
+-- staged one file at a time and the total size for the others. Dumps without
+-- it can be picked by any host. It is filled in by the next "update" job.
+-- Table: dumps
+
+ALTER TABLE dumps ADD COLUMN stagesize BIGINT AFTER size, ALGORITHM=INPLACE, LOCK=NONE;
@@ -1,13 +1,18 @@
 -- Tables for the CirrusSearch dumps module
 
 CREATE TABLE cirrussearch (
-    dumpdate DATE,
+    dumpdate DATE NOT NULL,
     claimed_by VARCHAR(255),
+    claim_token VARCHAR(255),
+    claimed_at DATETIME,
     can_archive INT,
     is_archived INT,
     is_checked INT,
-    comments VARCHAR(255)
+    comments VARCHAR(255),
+    PRIMARY KEY (dumpdate)
 );
 
-CREATE INDEX is_archived ON cirrussearch (is_archived);
-CREATE INDEX is_checked ON cirrussearch (is_checked);
+CREATE INDEX cirrussearch_archive ON cirrussearch (is_archived, can_archive, claimed_by);
+CREATE INDEX cirrussearch_check ON cirrussearch (is_archived, is_checked, claimed_by);
+CREATE INDEX cirrussearch_claim ON cirrussearch (claim_token);
+CREATE INDEX cirrussearch_lease ON cirrussearch (claimed_at);
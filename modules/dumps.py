@@ -14,17 +14,175 @@
 # You should have received a copy of the GNU General Public License
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
+import collections
 import datetime
 import json
 import os
+import random
 import re
 import shutil
+import threading
 import time
-import urllib
 
 import balchivist
 
 
+class BALMDumpManifest(object):
+    """
+    This class holds the parsed JSON status file (dumpstatus.json) of a
+    single dump, which gives the files, sizes, checksums and the status of
+    each job of the dump. It is retrieved once and shared by everything that
+    works on the dump, instead of each of them retrieving it again.
+    """
+
+    def __init__(self, report):
+        """
+        This function is executed when a new instance of BALMDumpManifest is
+        initialized.
+
+        - report (dict): The contents of the JSON status file, or False if it
+        could not be retrieved.
+        """
+        self.retrieved = time.time()
+        try:
+            self.jobs = report["jobs"]
+        except (TypeError, KeyError):
+            # The status file is missing, likely because the dump is gone
+            self.jobs = None
+
+    def exists(self):
+        """
+        This function is used to check if the dump exists on the dumps
+        server.
+
+        Returns: True if the dump exists, False if otherwise.
+        """
+        return self.jobs is not None
+
+    def getFiles(self):
+        """
+        This function is used to get the files of the jobs of the dump.
+
+        Returns: List of files, or None if the dump does not exist or is
+        incomplete.
+        """
+        dumpfiles = []
+        if self.jobs is None:
+            return None
+
+        for job in self.jobs:
+            try:
+                jobstatus = self.jobs[job]["status"]
+
+                if jobstatus == "done":
+                    try:
+                        dumpfiles += self.jobs[job]["files"]
+                    except KeyError:
+                        return None
+                elif (jobstatus == "skipped"):
+                    # Continue since the job is skipped and does not affect
+                    # our overall process
+                    continue
+                else:
+                    # This happens when the dump that we are working on is
+                    # incomplete, which should not be the case
+                    return None
+            except KeyError:
+                return None
+        return dumpfiles
+
+    def getMd5Sums(self):
+        """
+        This function is used to get the files and their md5sums.
+
+        Returns: Dict with the files and their respective md5sums, False if
+        the dump does not exist or is incomplete.
+        """
+        output = dict()
+        if self.jobs is None:
+            return False
+
+        for job in self.jobs:
+            try:
+                dumpfiles = self.jobs[job]["files"]
+                for thefile in dumpfiles:
+                    output[thefile] = dumpfiles[thefile]["md5"]
+            except KeyError:
+                # This happens when the dump that we are working on is
+                # incomplete, which should not be the case
+                return False
+        return output
+
+    def getSizes(self):
+        """
+        This function is used to get the files and their sizes.
+
+        Returns: Dict with the files and their respective sizes in bytes.
+        """
+        output = dict()
+        if self.jobs is None:
+            return output
+
+        for job in self.jobs:
+            dumpfiles = self.jobs[job].get("files", {})
+            for thefile in dumpfiles:
+                output[thefile] = int(dumpfiles[thefile].get("size", 0))
+        return output
+
+    def getSize(self):
+        """
+        This function is used to get the total size of the files of the jobs
+        that are done.
+
+        Returns: Int with the size of the dump in bytes, None if the dump
+        does not exist.
+        """
+        if self.jobs is None:
+            return None
+
+        size = 0
+        for job in self.jobs:
+            if (self.jobs[job].get("status") != "done"):
+                continue
+            for details in self.jobs[job].get("files", {}).values():
+                size += int(details.get("size", 0))
+        return size
+
+    def getProgress(self):
+        """
+        This function is used to get the progress of the dump from the
+        statuses of its jobs.
+
+        Returns: String of either "progress", "done", "error" or "unknown"
+        (see BALMDumps.getDumpProgress).
+        """
+        progress = 0
+        done = 0
+        if self.jobs is None:
+            return "unknown"
+
+        for job in self.jobs:
+            status = self.jobs[job].get("status")
+            if (status == "failed"):
+                # The dump has 1 failed file, forget about archiving this dump
+                return "error"
+            elif (status == "in-progress" or status == "waiting"):
+                progress += 1
+            elif (status == "done" or status == "skipped"):
+                done += 1
+            else:
+                # Return output in case a new status appears.
+                # We do not want to corrupt our database with false entries.
+                return "unknown"
+
+        if (progress > 0):
+            return "progress"
+        elif (progress == 0 and done > 0):
+            return "done"
+        else:
+            return "unknown"
+
+
 class BALMDumps(object):
     """
     This module is for archiving the main database dumps provided by the
@@ -43,11 +201,44 @@ class BALMDumps(object):
 
     resume = False
     dbtable = "dumps"
+    # The number of manifests of dumps to keep and the number of seconds to
+    # keep each of them for (see self.getManifest)
+    manifestcache = 32
+    manifestttl = 60*10
+    # The number of days before and after the end of the retention period
+    # during which a dump may or may not have been removed upstream
+    retentionmargin = 3
+    # The largest number of days between two dump runs of a wiki
+    runinterval = 20
+    # The number of the highest priority items to pick an item to archive
+    # from, so that hosts do not all go after the same item
+    queuewidth = 10
+    # The columns that describe the status of an item
+    statuscolumns = [
+        'is_archived',
+        'is_checked',
+        'can_archive',
+        'progress'
+    ]
     jobs = [
         "archive",
         "check",
+        "metadata",
         "update"
     ]
+    # The metadata fields that are refreshed by the "metadata" job
+    metadatafields = [
+        'creator',
+        'contributor',
+        'rights',
+        'subject',
+        'date',
+        'licenseurl',
+        'title',
+        'description'
+    ]
+    # The number of items to refresh the metadata for at the same time
+    metadataworkers = 4
     # Additional files in each dump
     additional = [
         'dumpruninfo.json',
@@ -80,6 +271,23 @@ class BALMDumps(object):
         self.sqldb = sqldb
         self.common = balchivist.BALCommon(verbose=self.verbose,
                                            debug=self.debug)
+        self.ledger = balchivist.BALLedger()
+        self.manifests = collections.OrderedDict()
+        self.manifestlock = threading.Lock()
+        # The parsed dblist files and the md5sums of their contents
+        self.dblists = {}
+        self.staging = balchivist.BALStaging(self.config.get('dumpdir'),
+                                             debug=self.debug,
+                                             verbose=self.verbose)
+        # The number of days that dumps are kept upstream and the priority of
+        # each wiki over the others when archiving
+        self.retention = int(self.config.get('retention', default='90'))
+        self.priorities = json.loads(self.config.get('priorities',
+                                                     default='{}'))
+        # The total size of a dump (in bytes) from which its files are
+        # downloaded, uploaded and removed one at a time
+        self.perfilethreshold = int(self.config.get('perfilethreshold',
+                                                    default='10737418240'))
 
     @classmethod
     def argparse(cls, parser=None):
@@ -152,25 +360,50 @@ class BALMDumps(object):
 
         Returns: Dict with the files and their respective md5sums.
         """
-        output = dict()
+        return self.getManifest(wiki, dumpdate).getMd5Sums()
 
-        try:
-            report = self.getDumpJson(wiki, dumpdate,
-                                      report="dumpstatus")["jobs"]
-        except TypeError:
-            # self.getDumpJson returned a boolean, likely due to missing report
-            return False
+    def getFileSizes(self, wiki, dumpdate):
+        """
+        This function is used for obtaining a list of files and the
+        corresponding sizes for those files.
 
-        for job in report:
-            try:
-                dumpfiles = report[job]["files"]
-                for thefile in dumpfiles:
-                    output[thefile] = dumpfiles[thefile]["md5"]
-            except KeyError:
-                # This happens when the dump that we are working on is
-                # incomplete, which should not be the case
-                return False
-        return output
+        - wiki (string): The wiki database to check.
+        - dumpdate (string in %Y%m%d format): The date of the dump.
+
+        Returns: Dict with the files and their respective sizes in bytes.
+        """
+        return self.getManifest(wiki, dumpdate).getSizes()
+
+    def getManifest(self, wiki, date):
+        """
+        This function is used to get the manifest of a dump, which is
+        retrieved once and kept for a while for everything else that works
+        on the same dump.
+
+        - wiki (string): The wiki database to check.
+        - date (string): The date of the dump in %Y%m%d format.
+
+        Returns: BALMDumpManifest instance.
+        """
+        key = (wiki, date)
+        with self.manifestlock:
+            manifest = self.manifests.pop(key, None)
+            if (manifest is not None and
+                    time.time() - manifest.retrieved < self.manifestttl):
+                self.manifests[key] = manifest
+                return manifest
+
+        manifest = BALMDumpManifest(self.getDumpJson(wiki, date,
+                                                     report="dumpstatus"))
+        if not manifest.exists():
+            # Do not keep the result of a failed request
+            return manifest
+        with self.manifestlock:
+            self.manifests[key] = manifest
+            while (len(self.manifests) > self.manifestcache):
+                # Forget the manifest that has not been used for the longest
+                self.manifests.popitem(last=False)
+        return manifest
 
     def getDumpJson(self, wiki, date, report="dumpruninfo"):
         """
@@ -194,15 +427,23 @@ class BALMDumps(object):
             return False
         reporturl = "%s/%s/%s/%s" % (self.config.get('dumps'), wiki, date,
                                      report)
-        f = urllib.urlopen(reporturl)
-
-        raw = f.read()
-        f.close()
-        try:
-            return json.loads(raw)
-        except ValueError:
-            self.common.giveDebugMessage("The report is not in JSON format")
+        output = self.common.getHttp().getJson(reporturl)
+        if output is None:
             return False
+        return output
+
+    def getDumpSize(self, wiki, date):
+        """
+        This function is used to get the total size of the files of a dump,
+        as given in the JSON status file of the dump.
+
+        - wiki (string): The wiki database to check.
+        - date (string): The date of the dump in %Y%m%d format.
+
+        Returns: Int with the size of the dump in bytes, None if the status
+        file could not be retrieved.
+        """
+        return self.getManifest(wiki, date).getSize()
 
     def getDumpProgress(self, wiki, date):
         """
@@ -219,74 +460,42 @@ class BALMDumps(object):
         - "unknown": Unknown status. It is likely that such a dump does not
         exist.
         """
-        progress = 0
-        done = 0
-
-        try:
-            report = self.getDumpJson(wiki, date, "dumpruninfo")["jobs"]
-        except TypeError:
-            # self.getDumpJson returned a boolean, likely due to missing report
-            return "unknown"
+        return self.getManifest(wiki, date).getProgress()
 
-        for job in report:
-            status = report[job]["status"]
-            if (status == "failed"):
-                # The dump has 1 failed file, forget about archiving this dump
-                return "error"
-            elif (status == "in-progress" or status == "waiting"):
-                progress += 1
-            elif (status == "done" or status == "skipped"):
-                done += 1
-            else:
-                # Return output in case a new status appears.
-                # We do not want to corrupt our database with false entries.
-                return "unknown"
-
-        if (progress > 0):
-            return "progress"
-        elif (progress == 0 and done > 0):
-            return "done"
-        else:
-            return "unknown"
-
-    def getDBList(self, dblist):
+    def getDatabases(self, dblist):
         """
-        This function is used for getting an updated copy of the database
-        list from the configuration files website.
+        This function is used to get the databases in a dblist file from the
+        configuration files website. The file is kept in the cache directory
+        and is only downloaded again if it has changed, and it is only parsed
+        again if its contents have changed.
 
         - dblist (string): The name of the dblist file.
 
-        Returns: True if process is successful, False if otherwise.
+        Returns: Frozenset with the databases, empty if the dblist file could
+        not be retrieved.
         """
         dblisturl = self.config.get(dblist.replace(".", ""))
-        try:
-            urllib.urlretrieve(dblisturl, dblist)
-            return True
-        except:
-            return False
+        raw, md5 = self.common.getHttp().getCached(dblisturl, dblist)
+        if raw is None:
+            return frozenset()
+        cached = self.dblists.get(dblist)
+        if (cached is not None and cached[0] == md5):
+            return cached[1]
+        databases = frozenset(line.strip() for line in raw.splitlines()
+                              if line.strip() != '' and
+                              not line.startswith('#'))
+        self.dblists[dblist] = (md5, databases)
+        return databases
 
-    def getDatabases(self, dblist):
+    def getPublicDatabases(self):
         """
-        This function is used to get a list of databases from a dblist file.
-        It will also check if the local cache of the dblist file is up-to-date.
-
-        - dblist (string): The name of the dblist file.
+        This function is used to get the databases of all wikis except the
+        private wikis, whose dumps are not public.
 
-        Returns: True if process is successful, False if otherwise.
+        Returns: List of the databases, sorted.
         """
-        if not os.path.exists(dblist):
-            self.getDBList(dblist)
-        else:
-            lastchange = os.path.getctime(dblist)
-            now = time.time()
-            dayago = now - 60*60*24*1
-            if (lastchange < dayago):
-                # The dblist cache is more than a day old, update it
-                self.getDBList(dblist)
-            else:
-                pass
-        databases = open(dblist, 'r').read().splitlines()
-        return sorted(databases)
+        return sorted(self.getDatabases('all.dblist') -
+                      self.getDatabases('private.dblist'))
 
     def getDumpFiles(self, wiki, date):
         """
@@ -298,33 +507,9 @@ class BALMDumps(object):
 
         Returns: List of files, or an empty list if an error has occurred.
         """
-        dumpfiles = []
-
-        try:
-            report = self.getDumpJson(wiki, date, report="dumpstatus")["jobs"]
-        except TypeError:
-            # self.getDumpJson returned a boolean, likely due to missing report
+        dumpfiles = self.getManifest(wiki, date).getFiles()
+        if dumpfiles is None:
             return []
-
-        for job in report:
-            try:
-                jobstatus = report[job]["status"]
-
-                if jobstatus == "done":
-                    try:
-                        dumpfiles += report[job]["files"]
-                    except KeyError:
-                        return []
-                elif (jobstatus == "skipped"):
-                    # Continue since the job is skipped and does not affect
-                    # our overall process
-                    continue
-                else:
-                    # This happens when the dump that we are working on is
-                    # incomplete, which should not be the case
-                    return []
-            except KeyError:
-                return []
         return sorted(dumpfiles + self.additional)
 
     def checkDumpExists(self, wiki, date):
@@ -337,13 +522,15 @@ class BALMDumps(object):
 
         Returns: True if the dump still exists, False if otherwise.
         """
+        with self.manifestlock:
+            manifest = self.manifests.get((wiki, date))
+        if (manifest is not None and
+                time.time() - manifest.retrieved < self.manifestttl):
+            # The status file has just been retrieved
+            return True
         dumpurl = "%s/%s/%s/dumpstatus.json" % (self.config.get('dumps'), wiki,
                                                 date)
-        f = urllib.urlopen(dumpurl)
-        if f.getcode() == 200:
-            return True
-        else:
-            return False
+        return self.common.getHttp().exists(dumpurl)
 
     def getAllDumps(self, wiki):
         """
@@ -352,13 +539,14 @@ class BALMDumps(object):
 
         - wiki (string): The wiki database to get a list of files for.
 
-        Returns: List of all dumps.
+        Returns: List of all dumps, None if the directory could not be
+        retrieved.
         """
         dumps = []
         url = "%s/%s" % (self.config.get('dumps'), wiki)
-        f = urllib.urlopen(url)
-        raw = f.read()
-        f.close()
+        raw = self.common.getHttp().getText(url)
+        if raw is None:
+            return None
 
         regex = r'<a href="(?P<dump>[^>]+)/">'
         m = re.compile(regex).finditer(raw)
@@ -385,12 +573,12 @@ class BALMDumps(object):
             'progress': 'done'
         }
         if (job is None or job == "archive"):
-            conds['is_archived'] = "0"
-            conds['can_archive'] = "1"
+            conds['is_archived'] = 0
+            conds['can_archive'] = 1
             return self.getNumberOfItems(params=conds)
         elif (job == "check"):
-            conds['is_archived'] = "1"
-            conds['is_checked'] = "0"
+            conds['is_archived'] = 1
+            conds['is_checked'] = 0
             return self.getNumberOfItems(params=conds)
         else:
             return 0
@@ -426,20 +614,25 @@ class BALMDumps(object):
     def getNumberOfItems(self, params={}):
         """
         This function is used to get the number of items left to work with.
+        The counts come from the cached status of the table, so calling this
+        function often does not cost a query every time.
 
-        - params (dict): The conditions to put in the WHERE clause.
+        - params (dict): The status of the items to count.
 
         Returns: Int with number of items left to work with.
         """
-        conds = ['claimed_by IS NULL']
-        for key, val in params.iteritems():
-            conds.append('%s="%s"' % (key, val))
-        return self.sqldb.count(dbtable=self.dbtable,
-                                conds=' AND '.join(conds))
+        return self.sqldb.getItemCount(dbtable=self.dbtable,
+                                       columns=self.statuscolumns,
+                                       conds=params)
 
     def getRandomItemSql(self, archived=False):
         """
-        This function is used to get a random item to work on.
+        This function is used to get a random item to work on. Items to
+        archive are picked from those with the highest priority (see
+        self.getPriority) whose staging need (see self.getStagingSize) fits in
+        the staging capacity of this host, with larger items going first so
+        that smaller hosts are left with the items that they can take on.
+        Items with an unknown staging need can be picked by any host.
 
         - archived (boolean): Whether or not to obtain a random item that is
         already archived.
@@ -448,37 +641,46 @@ class BALMDumps(object):
         """
         output = {}
         columns = ['wiki', 'dumpdate']
-        options = 'ORDER BY RAND() LIMIT 1'
-        conds = ['claimed_by IS NULL']
+        if (archived):
+            options = 'ORDER BY RAND() LIMIT 1'
+        else:
+            options = 'ORDER BY priority DESC, size DESC LIMIT %d' % (
+                self.queuewidth)
+        conds = {
+            'claimed_by': None
+        }
 
         if (archived):
-            extra = [
-                'is_archived="1"',
-                'is_checked="0"'
-            ]
+            extra = {
+                'is_archived': 1,
+                'is_checked': 0
+            }
         else:
-            extra = [
-                'progress="done"',
-                'is_archived="0"',
-                'can_archive="1"'
-            ]
-        conds.extend(extra)
+            extra = {
+                'progress': 'done',
+                'is_archived': 0,
+                'can_archive': 1,
+                'COALESCE(stagesize, 0) <=': min(
+                    self.common.getStagingCapacity(self.config.get('dumpdir')),
+                    self.staging.getAvailable())
+            }
+        conds.update(extra)
 
         results = self.sqldb.select(dbtable=self.dbtable, columns=columns,
-                                    conds=' AND '.join(conds), options=options)
+                                    conds=conds, options=options)
         if results is None:
-            # This should not be triggered at all. Use self.getItemsLeft()
-            # to verify first before running this function.
+            # This is only triggered when the cached count given by
+            # self.getItemsLeft() is out of date.
             output = {
                 'wiki': None,
                 'date': None
             }
         else:
-            for result in results:
-                output = {
-                    'wiki': result[0],
-                    'date': result[1].strftime("%Y%m%d")
-                }
+            result = random.choice(results)
+            output = {
+                'wiki': result[0],
+                'date': result[1].strftime("%Y%m%d")
+            }
 
         return output
 
@@ -494,74 +696,117 @@ class BALMDumps(object):
         Returns: True if update is successful, False if an error occurred.
         """
         vals = {
-            'can_archive': '"%s"' % (can_archive)
+            'can_archive': can_archive
         }
         return self.sqldb.update(dbtable=self.dbtable, values=vals,
-                                 conds=self.sqldb.getConds(params=params))
+                                 conds=params)
+
+    def updateClaimed(self, values, conds):
+        """
+        This function is used to update a claimed item, which is only done
+        while the claim on the item is still held.
+
+        - values (dict): The columns and values to update.
+        - conds (dict): The conditions that select the item, including the
+        token of the claim.
+
+        Returns: True if the item is updated, False if the claim has been
+        lost or an error occurred.
+        """
+        updated = self.sqldb.update(dbtable=self.dbtable, values=values,
+                                    conds=conds)
+        if (updated == 0):
+            self.common.giveMessage("The claim on the item has been lost, "
+                                    "leaving it unchanged")
+        return bool(updated)
 
-    def markArchived(self, params):
+    def markArchived(self, params, token):
         """
         This function is used to mark an item as archived after doing so.
 
         - params (dict): Information about the item with the keys "wiki" and
         "dumpdate".
+        - token (string): The token of the claim given by claimItem, the item
+        is only updated while the claim is still held.
 
-        Returns: True if update is successful, False if an error occurred.
+        Returns: True if the item is updated, False if the claim has been
+        lost or an error occurred.
         """
         vals = {
-            'is_archived': '"1"',
-            'claimed_by': 'NULL'
+            'is_archived': 1,
+            'claimed_by': None,
+            'claim_token': None,
+            'claimed_at': None
         }
-        return self.sqldb.update(dbtable=self.dbtable, values=vals,
-                                 conds=self.sqldb.getConds(params=params))
+        conds = dict(params)
+        conds['claim_token'] = token
+        return self.updateClaimed(values=vals, conds=conds)
 
-    def markChecked(self, params):
+    def markChecked(self, params, token):
         """
         This function is used to mark an item as checked after doing so.
 
         - params (dict): Information about the item with the keys "wiki" and
         "dumpdate".
+        - token (string): The token of the claim given by claimItem, the item
+        is only updated while the claim is still held.
 
-        Returns: True if update is successful, False if an error occurred.
+        Returns: True if the item is updated, False if the claim has been
+        lost or an error occurred.
         """
         vals = {
-            'is_checked': '"1"',
-            'claimed_by': 'NULL'
+            'is_checked': 1,
+            'claimed_by': None,
+            'claim_token': None,
+            'claimed_at': None
         }
-        return self.sqldb.update(dbtable=self.dbtable, values=vals,
-                                 conds=self.sqldb.getConds(params=params))
+        conds = dict(params)
+        conds['claim_token'] = token
+        return self.updateClaimed(values=vals, conds=conds)
 
-    def markFailedArchive(self, params):
+    def markFailedArchive(self, params, token):
         """
         This function is used to mark an item as failed when archiving it.
 
         - params (dict): Information about the item with the keys "wiki" and
         "dumpdate".
+        - token (string): The token of the claim given by claimItem, the item
+        is only updated while the claim is still held.
 
-        Returns: True if update is successful, False if an error occurred.
+        Returns: True if the item is updated, False if the claim has been
+        lost or an error occurred.
         """
         vals = {
-            'is_archived': '"2"',
-            'claimed_by': 'NULL'
+            'is_archived': 2,
+            'claimed_by': None,
+            'claim_token': None,
+            'claimed_at': None
         }
-        return self.sqldb.update(dbtable=self.dbtable, values=vals,
-                                 conds=self.sqldb.getConds(params=params))
+        conds = dict(params)
+        conds['claim_token'] = token
+        return self.updateClaimed(values=vals, conds=conds)
 
-    def markFailedCheck(self, params):
+    def markFailedCheck(self, params, token):
         """
         This function is used to mark an item as failed when checking it.
 
         - params (dict): Information about the item with the keys "wiki" and
         "dumpdate".
+        - token (string): The token of the claim given by claimItem, the item
+        is only updated while the claim is still held.
 
-        Returns: True if update is successful, False if an error occurred.
+        Returns: True if the item is updated, False if the claim has been
+        lost or an error occurred.
         """
         vals = {
-            'is_checked': '"2"',
-            'claimed_by': 'NULL'
+            'is_checked': 2,
+            'claimed_by': None,
+            'claim_token': None,
+            'claimed_at': None
         }
-        return self.sqldb.update(dbtable=self.dbtable, values=vals,
-                                 conds=self.sqldb.getConds(params=params))
+        conds = dict(params)
+        conds['claim_token'] = token
+        return self.updateClaimed(values=vals, conds=conds)
 
     def updateProgress(self, params, progress):
         """
@@ -574,10 +819,10 @@ class BALMDumps(object):
         Returns: True if update is successful, False if an error occurred.
         """
         vals = {
-            'progress': '"%s"' % (progress)
+            'progress': progress
         }
         return self.sqldb.update(dbtable=self.dbtable, values=vals,
-                                 conds=self.sqldb.getConds(params=params))
+                                 conds=params)
 
     def addNewItem(self, params):
         """
@@ -591,19 +836,20 @@ class BALMDumps(object):
         arcdate = self.conv.getDateFromWiki(params['date'],
                                             archivedate=True)
         values = {
-            'wiki': '"%s"' % (params['wiki']),
-            'dumpdate': '"%s"' % (arcdate),
-            'progress': '"%s"' % (params['progress']),
-            'claimed_by': 'NULL',
-            'can_archive': '"0"',
-            'is_archived': '"0"',
-            'is_checked': '"0"',
-            'comments': 'NULL'
+            'wiki': params['wiki'],
+            'dumpdate': arcdate,
+            'progress': params['progress'],
+            'priority': 0,
+            'claimed_by': None,
+            'can_archive': 0,
+            'is_archived': 0,
+            'is_checked': 0,
+            'comments': None
         }
         return self.sqldb.insert(dbtable=self.dbtable, values=values)
 
     def getStoredDumps(self, wikidb=None, progress="all", can_archive="all",
-                       is_archived="all", is_checked="all"):
+                       is_archived="all", is_checked="all", size="all"):
         """
         This function is used to get all dumps of a specific wiki (up to 30).
 
@@ -617,13 +863,17 @@ class BALMDumps(object):
         returned, "all" for all is_archived statuses.
         - is_checked (string): Dumps with this is_checked status will be
         returned, "all" for all is_checked statuses.
+        - size (int): Dumps with this size will be returned, None for dumps
+        without a known size and "all" for all sizes.
 
         Returns: Dict with all dumps of a wiki.
         """
         arguments = locals()
         dumps = []
         if (wikidb is not None):
-            conds = ['wiki="%s"' % wikidb]
+            conds = {
+                'wiki': wikidb
+            }
         else:
             return dumps
 
@@ -634,151 +884,289 @@ class BALMDumps(object):
             if (val == "all"):
                 continue
             else:
-                conds.append('%s="%s"' % (key, val))
+                conds[key] = val
 
         options = 'ORDER BY dumpdate DESC LIMIT 30'
         results = self.sqldb.select(dbtable=self.dbtable,
                                     columns=['dumpdate'],
-                                    conds=' AND '.join(conds), options=options)
+                                    conds=conds, options=options)
         if results is not None:
             for result in results:
                 dumps.append(result[0].strftime("%Y%m%d"))
         return dumps
 
-    def updateNewDumps(self, db):
+    def getPriority(self, wiki, dumpdate):
         """
-        This function is used to check if all new dumps have been registered
-        and update the database accordingly for new dumps. This function is
-        called during the "update" job.
+        This function is used to get the priority of a dump when archiving.
+        Dumps that are closer to being removed upstream are archived first,
+        with the priority of the wiki given in the configuration added on
+        top so that important wikis do not wait behind smaller ones.
 
-        - db (string): The database to work on.
+        - wiki (string): The wiki database of the dump.
+        - dumpdate (string): The date of the dump in %Y%m%d format.
+
+        Returns: Int with the priority, higher is archived earlier.
         """
-        alldumps = self.getAllDumps(db)
-        stored = self.getStoredDumps(db)
-        for dump in alldumps:
-            if (dump in stored):
-                self.common.giveMessage("Dump of %s on %s already in the "
-                                        "database, skipping" % (db, dump))
-                continue
-            else:
-                self.common.giveMessage("Adding new item %s on "
-                                        "%s" % (db, dump))
-                progress = self.getDumpProgress(db, dump)
-                params = {
-                    'wiki': db,
-                    'date': dump,
-                    'progress': progress
-                }
-                self.addNewItem(params=params)
+        date = datetime.datetime.strptime(dumpdate, '%Y%m%d').date()
+        age = max(0, (datetime.date.today() - date).days)
+        risk = min(100, age * 100 // max(1, self.retention))
+        return risk + int(self.priorities.get(wiki, 0))
 
-    def updateDumpStatuses(self, db):
+    def getDumpIndex(self):
         """
-        This function is used for checking the dumps that are registered as
-        "in progress" and update the status if those dumps have changed their
-        progress status. This function is called during the "update" job.
+        This function is used to get the latest dump of every wiki from the
+        index of the dumps server (index.json), which holds the JSON status
+        files of the latest dump of all wikis.
 
-        - db (string): The database to work on.
+        Returns: Dict with the wiki databases and a tuple with the date of
+        their latest dump in %Y%m%d format and its BALMDumpManifest, empty if
+        the index could not be retrieved.
         """
-        inprogress = self.getStoredDumps(db, progress="progress")
-        for dump in inprogress:
-            progress = self.getDumpProgress(db, dump)
-            if (progress != 'progress'):
-                self.common.giveMessage("Updating dump progress for %s "
-                                        "on %s" % (db, dump))
-                params = {
-                    'wiki': db,
-                    'dumpdate': self.conv.getDateFromWiki(dump,
-                                                          archivedate=True)
-                }
-                self.updateProgress(params=params, progress=progress)
-            else:
+        output = {}
+        indexurl = "%s/index.json" % (self.config.get('dumps'))
+        report = self.common.getHttp().getJson(indexurl)
+        if report is None:
+            self.common.giveMessage("Unable to retrieve the index of the "
+                                    "dumps server")
+            return output
+
+        for wiki, details in report.get("wikis", {}).items():
+            # The date of the dump is only given in the paths of the files
+            regex = re.compile(r'/%s/(?P<date>[0-9]{8})/' % (re.escape(wiki)))
+            dates = set()
+            for job in details.get("jobs", {}).values():
+                for thefile in job.get("files", {}).values():
+                    m = regex.search(thefile.get("url", ""))
+                    if m is not None:
+                        dates.add(m.group('date'))
+            if (len(dates) == 1):
+                output[wiki] = (dates.pop(), BALMDumpManifest(details))
+        return output
+
+    def getIndexedDumps(self, latest, rows):
+        """
+        This function is used to get the dumps of a wiki that exist on the
+        dumps server without listing the wiki directory. The latest dump is
+        given by the index of the dumps server, and the stored dumps are taken
+        to exist until the end of the retention period.
+
+        - latest (tuple): The date of the latest dump and its manifest, as
+        given by self.getDumpIndex.
+        - rows (dict): The stored dumps of the wiki and their details.
+
+        Returns: List of the dumps that exist, None if this cannot be told
+        without listing the wiki directory.
+        """
+        date, manifest = latest
+        today = datetime.date.today()
+        dumps = [date]
+        stored = [dump for dump in list(rows)[:30] if dump != date]
+        if (rows == {}):
+            # The earlier dumps of a new wiki are not in the index
+            return None
+        elif (stored != [] and date not in rows):
+            newest = datetime.datetime.strptime(stored[0], '%Y%m%d').date()
+            latestdate = datetime.datetime.strptime(date, '%Y%m%d').date()
+            if ((latestdate - newest).days > self.runinterval):
+                # A dump in between may have been missed
+                return None
+        for dump in stored:
+            dumpdate = datetime.datetime.strptime(dump, '%Y%m%d').date()
+            age = (today - dumpdate).days
+            if (age < self.retention - self.retentionmargin):
+                dumps.append(dump)
+            elif (age > self.retention + self.retentionmargin):
                 continue
+            elif (rows[dump]['is_archived'] == 0):
+                # The dump may or may not have been removed already
+                return None
+        return sorted(dumps)
 
-    def updateCanArchiveStatus(self, db):
+    def reconcile(self, db, latest=None):
         """
-        This function is used for checking existing dumps that have been
-        completed and updates the database if these dumps are ready to be
-        archived. This function is called during the "update" job.
+        This function is used for bringing the stored dumps of a wiki up to
+        date with the dumps server in a single pass. The stored dumps and the
+        listing of the wiki directory are retrieved once, the manifests of
+        the dumps that need them are retrieved at the same time, and all the
+        changes are written back together. This function is called during
+        the "update" job.
 
-        - db (string): The database to work on.
-        """
-        cannotarc = self.getStoredDumps(db, progress="done", can_archive=0)
-        for dump in cannotarc:
-            if not self.checkDumpExists(db, dump):
-                continue
-            else:
-#
-#            dumpdir = "%s/%s/%s" % (self.config.get('dumpdir'), db, dump)
-#            allfiles = self.getDumpFiles(db, dump)
-#            if (self.common.checkDumpDir(dumpdir, allfiles)):
-                # The dump is now suitable to be archived
-                self.common.giveMessage("Updating can_archive for %s "
-                                        "on %s" % (db, dump))
-                params = {
-                    'wiki': db,
-                    'dumpdate': self.conv.getDateFromWiki(dump,
-                                                          archivedate=True)
-                }
-                self.updateCanArchive(params=params, can_archive=1)
-#            else:
-#                continue
-
-    def updateFailedDumps(self, db):
-        """
-        This function is used for checking whether the dumps that have been
-        marked as failed really did fail or have been restarted. This function
-        is called during the "update" job.
+        The following changes are made, in order:
+        1. New dumps are registered.
+        2. The progress of dumps in progress is updated.
+        3. Completed dumps that still exist can be archived.
+        4. The sizes of dumps that can be archived are stored.
+        5. The progress of failed dumps that have been restarted is updated.
+        6. Dumps that no longer exist can no longer be archived.
+        7. The priorities of dumps waiting to be archived are updated.
 
         - db (string): The database to work on.
+        - latest (tuple): The date of the latest dump and its manifest, as
+        given by self.getDumpIndex. The wiki directory is only listed if this
+        is not given or if it is not enough to tell which dumps exist.
+
+        Returns: True if the changes are written, False if an error occurred
+        or the listing of the wiki directory could not be retrieved.
         """
-        failed = self.getStoredDumps(db, progress="error")
-        for dump in failed:
-            if not self.checkDumpExists(db, dump):
-                continue
+        columns = ['dumpdate', 'progress', 'can_archive', 'is_archived',
+                   'size', 'stagesize', 'priority']
+        results = self.sqldb.select(dbtable=self.dbtable, columns=columns,
+                                    conds={'wiki': db},
+                                    options='ORDER BY dumpdate DESC')
+        rows = collections.OrderedDict()
+        for result in results or ():
+            rows[result[0].strftime("%Y%m%d")] = dict(zip(columns[1:],
+                                                          result[1:]))
+
+        alldumps = None
+        manifests = {}
+        if latest is not None:
+            alldumps = self.getIndexedDumps(latest, rows)
+        if alldumps is None:
+            alldumps = self.getAllDumps(db)
+        else:
+            manifests[latest[0]] = latest[1]
+        if alldumps is None:
+            self.common.giveMessage("Unable to list the dumps of %s, "
+                                    "skipping" % (db))
+            return False
 
-            progress = self.getDumpProgress(db, dump)
-            if (progress != 'error' and progress != 'unknown'):
-                self.common.giveMessage("Updating dump progress for %s "
-                                        "on %s" % (db, dump))
-                params = {
-                    'wiki': db,
-                    'dumpdate': self.conv.getDateFromWiki(dump,
-                                                          archivedate=True)
-                }
-                self.updateProgress(params=params, progress=progress)
-            else:
+        # Only the most recent dumps are brought up to date
+        dumps = list(rows)[:30]
+        newdumps = [dump for dump in alldumps if dump not in rows]
+
+        # Retrieve the manifests needed by the changes below
+        needed = [dump for dump in newdumps if dump not in manifests]
+        for dump in dumps:
+            row = rows[dump]
+            if (dump not in alldumps or dump in manifests):
                 continue
+            elif row['progress'] in ['progress', 'error']:
+                needed.append(dump)
+            elif (row['progress'] == 'done' and row['is_archived'] == 0 and
+                    (row['size'] is None or row['stagesize'] is None)):
+                needed.append(dump)
+        manifests.update(zip(needed, self.common.getHttp().map(
+            lambda dump: self.getManifest(db, dump), needed)))
+
+        def getProgress(dump):
+            if dump not in manifests:
+                # The dump has been removed from the dumps server
+                return "unknown"
+            return manifests[dump].getProgress()
+
+        changes = collections.OrderedDict()
+
+        def change(dump, column, value):
+            rows[dump][column] = value
+            changes.setdefault(dump, {})[column] = value
+
+        # Step 1: Register the new dumps
+        for dump in newdumps:
+            self.common.giveMessage("Adding new item %s on %s" % (db, dump))
+            rows[dump] = {
+                'progress': getProgress(dump),
+                'can_archive': 0,
+                'is_archived': 0,
+                'size': None,
+                'stagesize': None,
+                'priority': 0
+            }
+            dumps.append(dump)
+        for dump in rows:
+            if dump not in newdumps:
+                self.common.giveDebugMessage("Dump of %s on %s already in "
+                                             "the database" % (db, dump))
+
+        # Step 2: Check if the status of dumps in progress have changed
+        for dump in dumps:
+            if (rows[dump]['progress'] != 'progress'):
+                continue
+            progress = getProgress(dump)
+            if (progress != 'progress'):
+                self.common.giveMessage("Updating dump progress for %s on "
+                                        "%s" % (db, dump))
+                change(dump, 'progress', progress)
 
-    def updateOldCanArchiveStatus(self, db):
-        """
-        This function is used for checking whether the dumps marked as "can
-        archive" is really able to be archived or has been deleted. This
-        function is called during the "update" job.
+        # Step 3: Check if the dump is available for archiving
+        for dump in dumps:
+            row = rows[dump]
+            if (row['progress'] == 'done' and row['can_archive'] == 0 and
+                    dump in alldumps):
+                self.common.giveMessage("Updating can_archive for %s on "
+                                        "%s" % (db, dump))
+                change(dump, 'can_archive', 1)
 
-        - db (string): The database to work on.
-        """
-        canarc = self.getStoredDumps(db, can_archive=1)
-        for dump in canarc:
-#            dumpdir = "%s/%s/%s" % (self.config.get('dumpdir'), db, dump)
-#            allfiles = self.getDumpFiles(db, dump)
-#            if (self.common.checkDumpDir(dumpdir, allfiles)):
-            if (self.checkDumpExists(db, dump)):
+        # Step 4: Store the sizes of the dumps available for archiving
+        for dump in dumps:
+            row = rows[dump]
+            if (row['progress'] != 'done' or row['can_archive'] != 1 or
+                    row['is_archived'] != 0 or dump not in manifests):
                 continue
-            else:
-                # The dump is now unable to be archived automatically
+            if row['size'] is None:
+                size = manifests[dump].getSize()
+                if size is not None:
+                    change(dump, 'size', size)
+            if row['stagesize'] is None:
+                stagesize = self.getStagingSize(manifests[dump].getSizes())
+                if stagesize is not None:
+                    change(dump, 'stagesize', stagesize)
+
+        # Step 5: Check if failed dumps really did fail or was restarted
+        for dump in dumps:
+            if (rows[dump]['progress'] != 'error' or dump not in alldumps):
+                continue
+            progress = getProgress(dump)
+            if (progress != 'error' and progress != 'unknown'):
+                self.common.giveMessage("Updating dump progress for %s on "
+                                        "%s" % (db, dump))
+                change(dump, 'progress', progress)
+
+        # Step 6: Reset the can_archive statuses of old dumps
+        for dump in dumps:
+            if (rows[dump]['can_archive'] == 1 and dump not in alldumps):
                 self.common.giveMessage("Updating can_archive for %s on "
                                         "%s" % (db, dump))
-                params = {
-                    'wiki': db,
-                    'dumpdate': self.conv.getDateFromWiki(dump,
-                                                          archivedate=True)
-                }
-                self.updateCanArchive(params=params, can_archive=0)
+                change(dump, 'can_archive', 0)
+
+        # Step 7: Update the priorities of dumps waiting to be archived
+        for dump in dumps:
+            row = rows[dump]
+            if (row['progress'] == 'done' and row['can_archive'] == 1 and
+                    row['is_archived'] == 0):
+                priority = self.getPriority(db, dump)
+                if (priority != row['priority']):
+                    change(dump, 'priority', priority)
+
+        # Write back all the changes together
+        inserts = []
+        for dump in newdumps:
+            values = {
+                'wiki': db,
+                'dumpdate': self.conv.getDateFromWiki(dump, archivedate=True),
+                'claimed_by': None,
+                'is_checked': 0,
+                'comments': None
+            }
+            values.update(rows[dump])
+            inserts.append(values)
+            changes.pop(dump, None)
+        updates = []
+        for dump, vals in changes.items():
+            params = {
+                'wiki': db,
+                'dumpdate': self.conv.getDateFromWiki(dump, archivedate=True)
+            }
+            updates.append((vals, params))
+        return self.sqldb.writeMany(dbtable=self.dbtable, inserts=inserts,
+                                    updates=updates)
 
     def getFilesToUpload(self, wiki, dumpdate, path=None):
         """
         This function is used to generate the list of files to upload given
-        the circumstances.
+        the circumstances. Files that the local ledger records as uploaded
+        (and that the Internet Archive has) are left out, so that an
+        interrupted upload resumes automatically.
 
         - wiki (string): The wiki database to work on.
         - dumpdate (string): The date of the dump in %Y%m%d format.
@@ -786,35 +1174,134 @@ class BALMDumps(object):
 
         Returns: List of files to upload.
         """
-        iaitem = balchivist.BALArchiver('%s-%s' % (wiki, dumpdate),
-                                        verbose=self.verbose, debug=self.debug)
+        identifier = '%s-%s' % (wiki, dumpdate)
+        iaitem = balchivist.BALArchiver(identifier, verbose=self.verbose,
+                                        debug=self.debug)
         allfiles = self.getDumpFiles(wiki, dumpdate)
         # Check which files are missing in order to resume upload
+        iafiles = False
         if self.resume:
-            items = []
             iafiles = iaitem.getFileList()
-            for dumpfile in allfiles:
-                if dumpfile in iafiles:
-                    continue
-                else:
-                    # The file does not exist in the Internet Archive item
-                    items.append(dumpfile)
-            if items == []:
-                self.common.giveMessage("All files have already been uploaded")
-                return items
-        else:
-            items = allfiles
+        if iafiles is False:
+            iafiles = iaitem.getDoneFiles()
+        items = []
+        for dumpfile in allfiles:
+            if dumpfile in iafiles:
+                continue
+            else:
+                # The file does not exist in the Internet Archive item
+                items.append(dumpfile)
+        if items == [] and allfiles != []:
+            self.common.giveMessage("All files have already been uploaded")
+            return items
 
         # Check if checksums are available and add them if they do
         for checksum in self.checksums:
             filename = "%s-%s-%s" % (wiki, dumpdate, checksum)
             filepath = "%s/%s" % (path, filename)
-            if os.path.exists(filepath):
+            if (filename in iafiles):
+                continue
+            elif os.path.exists(filepath):
                 items.append(filename)
             else:
                 continue
         return items
 
+    def isStaged(self, identifier, directory, dumpfile):
+        """
+        This function is used to check whether a dump file has already been
+        downloaded and verified in an earlier run, according to the local
+        ledger.
+
+        - identifier (string): The identifier of the Internet Archive item.
+        - directory (string): The path to the dump directory.
+        - dumpfile (string): The name of the dump file.
+
+        Returns: True if the file does not need to be downloaded again, False
+        if otherwise.
+        """
+        state = self.ledger.getState(identifier, dumpfile)
+        filepath = "%s/%s" % (directory, dumpfile)
+        if state is None or state['state'] == "downloaded":
+            return False
+        elif not os.path.isfile(filepath):
+            return False
+        else:
+            return os.path.getsize(filepath) == state['size']
+
+    def verifyFiles(self, identifier, directory, filelist, md5sums):
+        """
+        This function is used to verify the downloaded dump files against the
+        md5sums given upstream and record the result in the local ledger.
+        Files that fail verification are removed.
+
+        - identifier (string): The identifier of the Internet Archive item.
+        - directory (string): The path to the dump directory.
+        - filelist (list): The list of dump files to verify.
+        - md5sums (dict): The dump files and their md5sums.
+
+        Returns: True if all files are verified, False if otherwise.
+        """
+        if self.debug:
+            return True
+        for dumpfile in filelist:
+            if self.isStaged(identifier, directory, dumpfile):
+                continue
+            filepath = "%s/%s" % (directory, dumpfile)
+            size = os.path.getsize(filepath)
+            if (not md5sums or dumpfile not in md5sums):
+                # Files such as the status files do not have md5sums
+                self.ledger.setState(identifier, dumpfile, "downloaded",
+                                     size=size)
+                continue
+            md5 = self.common.getFileMd5(filepath)
+            if (md5 == md5sums[dumpfile]):
+                self.ledger.setState(identifier, dumpfile, "hashed",
+                                     size=size, md5=md5)
+            else:
+                self.common.giveError("Error: The md5sum of %s does not "
+                                      "match!" % (dumpfile))
+                os.remove(filepath)
+                return False
+        return True
+
+    def isPerFile(self, sizes):
+        """
+        This function is used to decide whether the files of a dump should be
+        staged one at a time (downloaded, uploaded and removed before moving
+        on to the next file) instead of staging the whole dump at once.
+
+        - sizes (dict): The files of the dump and their sizes in bytes, as
+        given by self.getFileSizes.
+
+        Returns: True if the files should be staged one at a time, False if
+        otherwise.
+        """
+        if (sizes == {}):
+            # The size of the dump is unknown, so keep the staging space used
+            # to a minimum
+            return True
+        return sum(sizes.values()) >= self.perfilethreshold
+
+    def getStagingSize(self, sizes):
+        """
+        This function is used to get the staging space needed to archive a
+        dump, which is the size of the largest file if the files are staged
+        one at a time (see self.isPerFile) and the total size otherwise.
+
+        - sizes (dict): The files of the dump and their sizes in bytes, as
+        given by self.getFileSizes.
+
+        Returns: Int with the number of bytes needed, None if the sizes of
+        the files are unknown.
+        """
+        if (sizes == {}):
+            return None
+        elif self.isPerFile(sizes):
+            return max(sizes.values())
+        else:
+            return sum(sizes.values())
+
     def archive(self, wiki, date, path=None):
         """
         This function is for doing the actual archiving process.
@@ -823,17 +1310,19 @@ class BALMDumps(object):
         - date (string): The date of the dump in %Y%m%d format.
         - path (string): The path to the dump directory.
 
-        Returns: True if process is successful, False if otherwise.
+        Returns: True if process is successful, False if otherwise, None if
+        there is not enough staging space and the dump should be archived
+        later.
         """
-        largewikis = ['enwiki', 'wikidatawiki', 'dewiki', 'commonswiki']
         md = self.getItemMetadata(wiki=wiki, dumpdate=date)
         headers = {
             'x-archive-size-hint': self.sizehint
         }
-        allfiles = self.getDumpFiles(wiki, date)
-        iaitem = balchivist.BALArchiver('%s-%s' % (wiki, date),
-                                        verbose=self.verbose, debug=self.debug)
+        identifier = '%s-%s' % (wiki, date)
+        iaitem = balchivist.BALArchiver(identifier, verbose=self.verbose,
+                                        debug=self.debug)
         items = self.getFilesToUpload(wiki=wiki, dumpdate=date, path=path)
+        md5sums = self.getMd5Sums(wiki, date)
         dumps = "%s/%s/%s" % (self.config.get('dumpdir'), wiki, date)
 
         # Test availability of rsync first
@@ -843,46 +1332,84 @@ class BALMDumps(object):
             # Rsync not available
             useRsync = False
 
-        if wiki in largewikis:
-            for thefile in items:
-                templist = [thefile]
+        # Reserve the staging space for the files before downloading them
+        sizes = self.getFileSizes(wiki, date)
+        perfile = self.isPerFile(sizes)
+        if perfile:
+            # Only one file is staged at a time
+            needed = max([sizes.get(thefile, 0) for thefile in items] + [0])
+        elif useRsync:
+            # The whole dump directory is copied
+            needed = sum(sizes.values())
+        else:
+            needed = sum([sizes.get(thefile, 0) for thefile in items])
+        reservation = self.staging.reserve(dumps, needed)
+        if reservation is None:
+            return None
+
+        try:
+            if perfile:
+                for thefile in items:
+                    templist = [thefile]
+                    if self.isStaged(identifier, dumps, thefile):
+                        pass
+                    elif useRsync:
+                        os.system("mkdir -p %s && cd %s && rsync -avzP rsync://ftpmirror.your.org/wikimedia-dumps/%s/%s/%s ." % (dumps, dumps, wiki, date, thefile))
+                    else:
+                        os.system("mkdir -p %s && cd %s && wget -q --show-progress http://dumps.wikimedia.your.org/%s/%s/%s" % (dumps, dumps, wiki, date, thefile))
+
+                    if (self.common.checkDumpDir(path=dumps,
+                                                 filelist=templist)):
+                        pass
+                    else:
+                        # The dump directory is not suitable to be used, exit
+                        # the function
+                        return False
+
+                    if not self.verifyFiles(identifier, dumps, templist,
+                                            md5sums):
+                        return False
+
+                    os.chdir(dumps)
+                    upload = iaitem.upload(body=templist, metadata=md,
+                                           headers=headers)
+                    if not upload:
+                        # Keep the file for the next attempt
+                        return False
+                    # Free up the staging space for the next file
+                    os.remove("%s/%s" % (dumps, thefile))
+            else:
                 if useRsync:
-                    os.system("mkdir -p %s && cd %s && rsync -avzP rsync://ftpmirror.your.org/wikimedia-dumps/%s/%s/%s ." % (dumps, dumps, wiki, date, thefile))
+                    os.system("mkdir -p %s && cd %s && rsync -avzP rsync://ftpmirror.your.org/wikimedia-dumps/%s/%s/ ." % (dumps, dumps, wiki, date))
                 else:
-                    os.system("mkdir -p %s && cd %s && wget -q --show-progress http://dumps.wikimedia.your.org/%s/%s/%s" % (dumps, dumps, wiki, date, thefile))
-
-                if (self.common.checkDumpDir(path=dumps, filelist=templist)):
+                    os.system("mkdir -p %s" % (dumps))
+                    for thedumpfile in items:
+                        if self.isStaged(identifier, dumps, thedumpfile):
+                            continue
+                        os.system("cd %s && wget -q --show-progress http://dumps.wikimedia.your.org/%s/%s/%s" % (dumps, wiki, date, thedumpfile))
+                        time.sleep(0.1) # For Ctrl+C
+
+                if (self.common.checkDumpDir(path=dumps, filelist=items)):
                     pass
                 else:
-                    # The dump directory is not suitable to be used, exit the function
+                    # The dump directory is not suitable to be used, exit
+                    # the function
                     return False
 
-                os.chdir(dumps)
-                upload = iaitem.upload(body=templist, metadata=md, headers=headers)
-                if upload:
-                    shutil.rmtree(dumps)
-        else:
-            if useRsync:
-                os.system("mkdir -p %s && cd %s && rsync -avzP rsync://ftpmirror.your.org/wikimedia-dumps/%s/%s/ ." % (dumps, dumps, wiki, date))
-            else:
-                os.system("mkdir -p %s" % (dumps))
-                for thedumpfile in items:
-                    os.system("cd %s && wget -q --show-progress http://dumps.wikimedia.your.org/%s/%s/%s" % (dumps, wiki, date, thedumpfile))
-                    time.sleep(0.1) # For Ctrl+C
-
-            if (self.common.checkDumpDir(path=dumps, filelist=items)):
-                pass
-            else:
-                # The dump directory is not suitable to be used, exit the function
-                return False
+                if not self.verifyFiles(identifier, dumps, items, md5sums):
+                    return False
 
-            os.chdir(dumps)
-            upload = iaitem.upload(body=items, metadata=md, headers=headers)
-            if upload:
+                os.chdir(dumps)
+                upload = iaitem.upload(body=items, metadata=md,
+                                       headers=headers)
+                if not upload:
+                    return False
                 shutil.rmtree(dumps)
 
-        os.chdir(self.config.get('dumpdir'))
-        os.system("rm -rf %s/%s" % (self.config.get('dumpdir'), wiki))
+            os.chdir(self.config.get('dumpdir'))
+            os.system("rm -rf %s/%s" % (self.config.get('dumpdir'), wiki))
+        finally:
+            self.staging.release(reservation)
 
         #if (path is None):
         #    dumps = "%s/%s/%s" % (self.config.get('dumpdir'), wiki, date)
@@ -920,6 +1447,62 @@ class BALMDumps(object):
                 complete = False
         return complete
 
+    def getArchivedDumps(self, wikidb=None):
+        """
+        This function is used to get all dumps that have been archived.
+
+        - wikidb (string): The database name of the wiki to get a list of
+        dumps for, None for all wikis.
+
+        Returns: List of tuples with the wiki and the date of each dump.
+        """
+        dumps = []
+        conds = {
+            'is_archived': 1
+        }
+        if (wikidb is not None):
+            conds['wiki'] = wikidb
+        options = 'ORDER BY wiki, dumpdate'
+        results = self.sqldb.select(dbtable=self.dbtable,
+                                    columns=['wiki', 'dumpdate'],
+                                    conds=conds, options=options)
+        if results is not None:
+            for result in results:
+                dumps.append((result[0], result[1].strftime("%Y%m%d")))
+        return dumps
+
+    def updateMetadata(self, wikidb=None):
+        """
+        This function refreshes the metadata of archived items on the
+        Internet Archive, such as after the naming in BALConverter has
+        changed. Only the fields that have changed are sent.
+
+        - wikidb (string): The database name of the wiki to work on, None for
+        all wikis.
+
+        Returns: True if all items are up-to-date, False if otherwise.
+        """
+        items = {}
+        for wiki, dumpdate in self.getArchivedDumps(wikidb=wikidb):
+            md = self.getItemMetadata(wiki=wiki, dumpdate=dumpdate)
+            identifier = '%s-%s' % (wiki, dumpdate)
+            items[identifier] = dict((key, md[key]) for key in
+                                     self.metadatafields)
+
+        if self.debug:
+            self.common.giveMessage("Metadata of %d items would be "
+                                    "refreshed" % (len(items)))
+            return True
+
+        failed = balchivist.BALArchiver.bulkUpdateMetadata(
+            items=items, workers=self.metadataworkers, debug=self.debug,
+            verbose=self.verbose
+        )
+        for identifier in failed:
+            self.common.giveError("Error: Failed to update the metadata of "
+                                  "%s" % (identifier))
+        return failed == []
+
     def update(self):
         """
         This function checks for new dumps and add new entries into the
@@ -927,28 +1510,21 @@ class BALMDumps(object):
 
         Returns: True if complete, Exception if an error occurred.
         """
-        alldb = self.getDatabases('all.dblist')
-        privatedb = self.getDatabases('private.dblist')
-        # Remove all instances of private wikis
-        for private in privatedb:
-            alldb.remove(private)
+        alldb = self.getPublicDatabases()
+        # The latest dumps of all wikis are retrieved at once, so that most
+        # wikis do not need their directory to be listed
+        index = self.getDumpIndex()
         for db in alldb:
-            # Step 1: Check if all new dumps are registered
-            self.updateNewDumps(db)
-            # Step 2: Check if the status of dumps in progress have changed
-            self.updateDumpStatuses(db)
-            # Step 3: Check if the dump is available for archiving
-            self.updateCanArchiveStatus(db)
-            # Step 4: Check if failed dumps really did fail or was restarted
-            self.updateFailedDumps(db)
-            # Step 5: Reset the can_archive statuses of old dumps
-            self.updateOldCanArchiveStatus(db)
+            self.reconcile(db, index.get(db))
 
         return True
 
     def dispatch(self, job, wiki, date, path):
         """
         This function is for dispatching an item to the various functions.
+
+        Returns: None if the item has been deferred as there is not enough
+        staging space, True or False if otherwise.
         """
         updatedetails = {
             'wiki': wiki,
@@ -957,37 +1533,57 @@ class BALMDumps(object):
 
         # Claim the item from the database server if not in debug mode
         if self.debug:
-            pass
+            token = None
         else:
-            self.sqldb.claimItem(params=updatedetails, dbtable=self.dbtable)
+            token = self.sqldb.claimItem(params=updatedetails,
+                                         dbtable=self.dbtable)
+            if token is None:
+                self.common.giveMessage("%s on %s has already been claimed" %
+                                        (wiki, date))
+                return False
 
         msg = "Running %s on the main Wikimedia database " % (job)
         msg += "dump of %s on %s" % (wiki, date)
         self.common.giveMessage(msg)
+        # Keep the claim alive while the job is running
+        lease = balchivist.BALLease(sqldb=self.sqldb, dbtable=self.dbtable,
+                                    token=token, debug=self.debug,
+                                    verbose=self.verbose)
         if (job == "archive"):
-            status = self.archive(wiki=wiki, date=date, path=path)
+            with lease:
+                status = self.archive(wiki=wiki, date=date, path=path)
             if (self.debug):
                 return status
+            elif (status is None):
+                self.common.giveMessage("Deferring %s on %s until there is "
+                                        "enough staging space" % (wiki, date))
+                self.sqldb.releaseClaim(dbtable=self.dbtable, token=token)
+                return None
             elif (self.debug is False and status):
                 self.common.giveMessage("Marking %s on %s as archived" %
                                         (wiki, date))
-                self.markArchived(updatedetails)
+                return self.markArchived(updatedetails, token=token)
             else:
                 self.common.giveMessage("Marking %s on %s as failed"
                                         " archive" % (wiki, date))
-                self.markFailedArchive(updatedetails)
+                return self.markFailedArchive(updatedetails, token=token)
         elif (job == "check"):
-            status = self.check(wiki=wiki, date=date)
+            with lease:
+                status = self.check(wiki=wiki, date=date)
             if (self.debug):
                 return status
-            elif (self.debug is False and status):
+            # The records of the uploaded files are no longer needed, and
+            # the files are uploaded again if the check has failed
+            self.ledger.forget('%s-%s' % (wiki, date))
+            if (status):
                 self.common.giveMessage("Marking %s on %s as checked" %
                                         (wiki, date))
-                self.markChecked(updatedetails)
+                return self.markChecked(updatedetails, token=token)
             else:
                 self.common.giveMessage("Marking %s on %s as failed"
                                         " check" % (wiki, date))
-                self.markFailedCheck(updatedetails)
+                return self.markFailedCheck(updatedetails, token=token)
+        return True
 
     def execute(self, args=None):
         """
@@ -1005,6 +1601,8 @@ class BALMDumps(object):
             continuous = True
         elif (args.dumpsjob == "update"):
             return self.update()
+        elif (args.dumpsjob == "metadata"):
+            return self.updateMetadata(wikidb=args.dumpswiki)
         elif (args.dumpswiki is None and args.dumpsdate is None):
             continuous = True
         elif (args.dumpswiki is None and args.dumpsdate is not None):
@@ -1027,10 +1625,17 @@ class BALMDumps(object):
 
             while self.getItemsLeft(job=dumpsjob) > 0:
                 itemdetails = self.getRandomItem(job=dumpsjob)
+                if itemdetails['wiki'] is None:
+                    # The cached count is out of date, nothing is left
+                    break
                 wiki = itemdetails['wiki']
                 date = itemdetails['date']
-                self.dispatch(job=dumpsjob, wiki=wiki, date=date,
-                              path=dumpspath)
+                status = self.dispatch(job=dumpsjob, wiki=wiki, date=date,
+                                       path=dumpspath)
+                if status is None:
+                    # The staging space is used up, leave the other dumps
+                    # for later instead of deferring them one after another
+                    break
         else:
             self.resume = args.dumpsresume
             self.dispatch(job=args.dumpsjob, wiki=args.dumpswiki,
@@ -1,16 +1,23 @@
 -- Tables for the main Wikimedia dumps module
 
 CREATE TABLE dumps (
-	wiki VARCHAR(255),
-	dumpdate DATE,
+	wiki VARCHAR(255) NOT NULL,
+	dumpdate DATE NOT NULL,
 	progress VARCHAR(255),
+	priority INT NOT NULL DEFAULT 0,
+	size BIGINT,
+	stagesize BIGINT,
 	claimed_by VARCHAR(255),
+	claim_token VARCHAR(255),
+	claimed_at DATETIME,
 	can_archive INT,
 	is_archived INT,
 	is_checked INT,
-	comments VARCHAR(255)
+	comments VARCHAR(255),
+	PRIMARY KEY (wiki, dumpdate)
 );
 
-CREATE INDEX progress ON dumps (progress);
-CREATE INDEX is_archived ON dumps (is_archived);
-CREATE INDEX is_checked ON dumps (is_checked);
+CREATE INDEX dumps_queue ON dumps (is_archived, can_archive, progress, claimed_by, priority);
+CREATE INDEX dumps_check ON dumps (is_archived, is_checked, claimed_by);
+CREATE INDEX dumps_claim ON dumps (claim_token);
+CREATE INDEX dumps_lease ON dumps (claimed_at);
@@ -15,7 +15,10 @@
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
 import datetime
+import multiprocessing.pool
 import os
+import re
+import shutil
 
 import balchivist
 
@@ -33,6 +36,12 @@ class BALMMediacounts(object):
 
     config = balchivist.BALConfig("mediacounts")
     dbtable = "mediacounts"
+    # The columns that describe the status of an item
+    statuscolumns = [
+        'is_archived',
+        'is_checked',
+        'can_archive'
+    ]
     conv = balchivist.BALConverter()
     tempdir = config.get('dumpdir')
     filelist = [
@@ -41,9 +50,14 @@ class BALMMediacounts(object):
     extrafilelist = [
         "mediacounts.top1000.%s.v00.csv.zip"
     ]
+    # The pattern of the names of the files in the year listings
+    filepattern = re.compile(r'^mediacounts\..*?(\d{4}-\d{2}-\d{2})\.')
+    # The number of seconds after which the year listings are revalidated
+    listingage = 60*60
 
     jobs = [
         "archive",
+        "backfill",
         "check",
         "update"
     ]
@@ -65,6 +79,10 @@ class BALMMediacounts(object):
         self.debug = params['debug']
         self.common = balchivist.BALCommon(verbose=self.verbose,
                                            debug=self.debug)
+        # The number of days to work on at the same time
+        self.window = max(1, int(self.config.get('window', default='1')))
+        self.staging = balchivist.BALStaging(self.tempdir, debug=self.debug,
+                                             verbose=self.verbose)
 
     @classmethod
     def argparse(cls, parser=None):
@@ -132,59 +150,83 @@ class BALMMediacounts(object):
         output = []
         for dumpfile in self.filelist:
             output.append(dumpfile % (arcdate))
-        for dumpfile in self.extrafilelist:
-            thefile = dumpfile % (arcdate)
-            fileurl = "%s/%s/%s" % (self.config.get('baseurl'),
-                                    d.strftime('%Y'), thefile)
-            if self.common.checkDownloadFileExistence(fileurl):
+        extrafiles = [dumpfile % (arcdate) for dumpfile in self.extrafilelist]
+        fileurls = ["%s/%s/%s" % (self.config.get('baseurl'), d.strftime('%Y'),
+                                  thefile) for thefile in extrafiles]
+        exists = self.common.getHttp().existsMany(fileurls)
+        for thefile, fileurl in zip(extrafiles, fileurls):
+            if exists[fileurl]:
                 output.append(thefile)
             else:
                 # File does not exist in the extra file list, continue
                 continue
         return output
 
-    def removeFiles(self, filelist):
+    def getStoredDates(self):
         """
-        This function is used for removing all the downloaded files for a
-        particular dump.
-
-        - filelist (list): The list of dump files.
+        This function is used for getting the dates of all the dumps stored
+        in the database using a single query.
 
-        Returns: True if the operation is successful, False if an error has
-        occured.
+        Returns: Dict with the dump dates in %Y%m%d format and their
+        can_archive status, None if an error has occurred.
         """
-        for dumpfile in filelist:
-            filepath = "%s/%s" % (self.tempdir, dumpfile)
-            try:
-                os.remove(filepath)
-            except:
-                return False
-        return True
+        # The table is counted first since select gives None for both an
+        # empty table and an error
+        try:
+            total = self.sqldb.count(dbtable=self.dbtable)
+        except Exception:
+            return None
+        if (total == 0):
+            return {}
+        results = self.sqldb.select(dbtable=self.dbtable,
+                                    columns=['dumpdate', 'can_archive'])
+        if results is None:
+            return None
+        return dict([(result[0].strftime("%Y%m%d"), result[1])
+                     for result in results])
 
-    def getDumpDates(self, can_archive="all"):
+    def getYears(self):
         """
-        This function is for getting all the date of dumps presently stored in
-        the database.
+        This function is used for getting the years that have a listing on
+        the dumps server.
 
-        - can_archive (string): Dumps with this can_archive status will be
-        returned, "all" for all can_archive statuses.
+        Returns: List of years as strings.
+        """
+        links = self.common.extractLinks(self.config.get('baseurl'))
+        years = []
+        for link in links:
+            year = link.strip('/')
+            if (len(year) == 4 and year.isdigit()):
+                years.append(year)
+        return sorted(set(years))
 
-        Returns: List of dump dates.
+    def getAvailableDates(self, year):
         """
-        dumps = []
-        if (can_archive == "all"):
-            conds = ''
-        else:
-            conds = 'can_archive="%s"' % (can_archive)
+        This function is used for getting the dumps available for a year from
+        its listing on the dumps server. The listing is kept in the cache and
+        only downloaded again when it has changed.
 
-        options = 'ORDER BY dumpdate DESC LIMIT 30'
-        results = self.sqldb.select(dbtable=self.dbtable,
-                                    columns=['dumpdate'],
-                                    conds=conds, options=options)
-        if results is not None:
-            for result in results:
-                dumps.append(result[0].strftime("%Y%m%d"))
-        return dumps
+        - year (string): The year to look at.
+
+        Returns: Dict with the dump dates in %Y%m%d format and whether all the
+        files in self.filelist are available for each, None if the listing
+        could not be retrieved.
+        """
+        url = "%s/%s/" % (self.config.get('baseurl'), year)
+        raw, md5 = self.common.getHttp().getCached(
+            url, "mediacounts-%s.html" % (year), maxage=self.listingage)
+        if raw is None:
+            return None
+        files = set(self.common.parseLinks(raw))
+        dates = {}
+        for thefile in files:
+            match = self.filepattern.match(thefile)
+            if match is None:
+                continue
+            arcdate = match.group(1)
+            dates[arcdate.replace('-', '')] = all(
+                [dumpfile % (arcdate) in files for dumpfile in self.filelist])
+        return dates
 
     def getItemsLeft(self, job=None):
         """
@@ -199,12 +241,12 @@ class BALMMediacounts(object):
         """
         conds = {}
         if (job is None or job == "archive"):
-            conds['is_archived'] = "0"
-            conds['can_archive'] = "1"
+            conds['is_archived'] = 0
+            conds['can_archive'] = 1
             return self.getNumberOfItems(params=conds)
         elif (job == "check"):
-            conds['is_archived'] = "1"
-            conds['is_checked'] = "0"
+            conds['is_archived'] = 1
+            conds['is_checked'] = 0
             return self.getNumberOfItems(params=conds)
         else:
             return 0
@@ -212,16 +254,16 @@ class BALMMediacounts(object):
     def getNumberOfItems(self, params={}):
         """
         This function is used to get the number of items left to work with.
+        The counts come from the cached status of the table, so calling this
+        function often does not cost a query every time.
 
-        - params (dict): The conditions to put in the WHERE clause.
+        - params (dict): The status of the items to count.
 
         Returns: Int with number of items left to work with.
         """
-        conds = ['claimed_by IS NULL']
-        for key, val in params.iteritems():
-            conds.append('%s="%s"' % (key, val))
-        return self.sqldb.count(dbtable=self.dbtable,
-                                conds=' AND '.join(conds))
+        return self.sqldb.getItemCount(dbtable=self.dbtable,
+                                       columns=self.statuscolumns,
+                                       conds=params)
 
     def getRandomItem(self, job=None):
         """
@@ -250,25 +292,27 @@ class BALMMediacounts(object):
         output = {}
         columns = ['dumpdate']
         options = 'ORDER BY RAND() LIMIT 1'
-        conds = ['claimed_by IS NULL']
+        conds = {
+            'claimed_by': None
+        }
 
         if (archived):
-            extra = [
-                'is_archived="1"',
-                'is_checked="0"'
-            ]
+            extra = {
+                'is_archived': 1,
+                'is_checked': 0
+            }
         else:
-            extra = [
-                'is_archived="0"',
-                'can_archive="1"'
-            ]
-        conds.extend(extra)
+            extra = {
+                'is_archived': 0,
+                'can_archive': 1
+            }
+        conds.update(extra)
 
         results = self.sqldb.select(dbtable=self.dbtable, columns=columns,
-                                    conds=' AND '.join(conds), options=options)
+                                    conds=conds, options=options)
         if results is None:
-            # This should not be triggered at all. Use self.getItemsLeft()
-            # to verify first before running this function.
+            # This is only triggered when the cached count given by
+            # self.getItemsLeft() is out of date.
             output = None
         else:
             for result in results:
@@ -276,118 +320,134 @@ class BALMMediacounts(object):
 
         return output
 
-    def addNewItem(self, dumpdate):
-        """
-        This function is used for adding new dumps into the database.
-
-        - dumpdate (string in %Y%m%d format): The date of the dump to add.
-
-        Returns: True if the update is successful, False if an error occured.
-        """
-        try:
-            arcdate = self.conv.getDateFromWiki(dumpdate, archivedate=True)
-        except ValueError:
-            return False
-
-        values = {
-            'dumpdate': '"%s"' % (arcdate),
-            'claimed_by': 'NULL',
-            'can_archive': '"0"',
-            'is_archived': '"0"',
-            'is_checked': '"0"',
-            'comments': 'NULL'
-        }
-        return self.sqldb.insert(dbtable=self.dbtable, values=values)
-
-    def updateCanArchive(self, dumpdate, can_archive):
+    def updateClaimed(self, values, conds):
         """
-        This function is used to update the status of whether a dump can be
-        archived.
+        This function is used to update a claimed item, which is only done
+        while the claim on the item is still held.
 
-        - dumpdate (string in %Y%m%d format): The date of the dump to work on.
-        - can_archive (string): The can_archive status of the dump.
+        - values (dict): The columns and values to update.
+        - conds (dict): The conditions that select the item, including the
+        token of the claim.
 
-        Returns: True if update is successful, False if an error occurred.
+        Returns: True if the item is updated, False if the claim has been
+        lost or an error occurred.
         """
-        vals = {
-            'can_archive': '"%s"' % (can_archive)
-        }
-        arcdate = self.conv.getDateFromWiki(dumpdate, archivedate=True)
-        return self.sqldb.update(dbtable=self.dbtable, values=vals,
-                                 conds="dumpdate=\"%s\"" % (arcdate))
+        updated = self.sqldb.update(dbtable=self.dbtable, values=values,
+                                    conds=conds)
+        if (updated == 0):
+            self.common.giveMessage("The claim on the item has been lost, "
+                                    "leaving it unchanged")
+        return bool(updated)
 
-    def markArchived(self, dumpdate):
+    def markArchived(self, dumpdate, token):
         """
         This function is used to mark an item as archived after doing so.
 
         - dumpdate (string in %Y%m%d format): The date of the dump to work on.
+        - token (string): The token of the claim given by claimItem, the item
+        is only updated while the claim is still held.
 
-        Returns: True if update is successful, False if an error occurred.
+        Returns: True if the item is updated, False if the claim has been
+        lost or an error occurred.
         """
         vals = {
-            'is_archived': '"1"',
-            'claimed_by': 'NULL'
+            'is_archived': 1,
+            'claimed_by': None,
+            'claim_token': None,
+            'claimed_at': None
         }
         arcdate = self.conv.getDateFromWiki(dumpdate, archivedate=True)
-        return self.sqldb.update(dbtable=self.dbtable, values=vals,
-                                 conds="dumpdate=\"%s\"" % (arcdate))
+        conds = {
+            'dumpdate': arcdate,
+            'claim_token': token
+        }
+        return self.updateClaimed(values=vals, conds=conds)
 
-    def markChecked(self, dumpdate):
+    def markChecked(self, dumpdate, token):
         """
         This function is used to mark an item as checked after doing so.
 
         - dumpdate (string in %Y%m%d format): The date of the dump to work on.
+        - token (string): The token of the claim given by claimItem, the item
+        is only updated while the claim is still held.
 
-        Returns: True if update is successful, False if an error occurred.
+        Returns: True if the item is updated, False if the claim has been
+        lost or an error occurred.
         """
         vals = {
-            'is_checked': '"1"',
-            'claimed_by': 'NULL'
+            'is_checked': 1,
+            'claimed_by': None,
+            'claim_token': None,
+            'claimed_at': None
         }
         arcdate = self.conv.getDateFromWiki(dumpdate, archivedate=True)
-        return self.sqldb.update(dbtable=self.dbtable, values=vals,
-                                 conds="dumpdate=\"%s\"" % (arcdate))
+        conds = {
+            'dumpdate': arcdate,
+            'claim_token': token
+        }
+        return self.updateClaimed(values=vals, conds=conds)
 
-    def markFailedArchive(self, dumpdate):
+    def markFailedArchive(self, dumpdate, token):
         """
         This function is used to mark an item as failed when archiving it.
 
         - dumpdate (string in %Y%m%d format): The date of the dump to work on.
+        - token (string): The token of the claim given by claimItem, the item
+        is only updated while the claim is still held.
 
-        Returns: True if update is successful, False if an error occurred.
+        Returns: True if the item is updated, False if the claim has been
+        lost or an error occurred.
         """
         vals = {
-            'is_archived': '"2"',
-            'claimed_by': 'NULL'
+            'is_archived': 2,
+            'claimed_by': None,
+            'claim_token': None,
+            'claimed_at': None
         }
         arcdate = self.conv.getDateFromWiki(dumpdate, archivedate=True)
-        return self.sqldb.update(dbtable=self.dbtable, values=vals,
-                                 conds="dumpdate=\"%s\"" % (arcdate))
+        conds = {
+            'dumpdate': arcdate,
+            'claim_token': token
+        }
+        return self.updateClaimed(values=vals, conds=conds)
 
-    def markFailedCheck(self, dumpdate):
+    def markFailedCheck(self, dumpdate, token):
         """
         This function is used to mark an item as failed when checking it.
 
         - dumpdate (string in %Y%m%d format): The date of the dump to work on.
+        - token (string): The token of the claim given by claimItem, the item
+        is only updated while the claim is still held.
 
-        Returns: True if update is successful, False if an error occurred.
+        Returns: True if the item is updated, False if the claim has been
+        lost or an error occurred.
         """
         vals = {
-            'is_checked': '"2"',
-            'claimed_by': 'NULL'
+            'is_checked': 2,
+            'claimed_by': None,
+            'claim_token': None,
+            'claimed_at': None
         }
         arcdate = self.conv.getDateFromWiki(dumpdate, archivedate=True)
-        return self.sqldb.update(dbtable=self.dbtable, values=vals,
-                                 conds="dumpdate=\"%s\"" % (arcdate))
+        conds = {
+            'dumpdate': arcdate,
+            'claim_token': token
+        }
+        return self.updateClaimed(values=vals, conds=conds)
 
     def archive(self, dumpdate, path=None):
         """
-        This function is for doing the actual archiving process.
+        This function is for doing the actual archiving process. The files
+        are downloaded into a directory of their own, after reserving the
+        staging space for them so that the days archived at the same time do
+        not fill up the disk.
 
         - dumpdate (string): The dumpdate of the dump in %Y%m%d format.
         - path (string): The path to the dump directory.
 
-        Returns: True if process is successful, False if otherwise.
+        Returns: True if process is successful, False if otherwise, None if
+        there is not enough staging space and the dump should be archived
+        later.
         """
         identifier = "mediacounts-%s" % (dumpdate)
         iaitem = balchivist.BALArchiver(identifier=identifier,
@@ -398,29 +458,55 @@ class BALMMediacounts(object):
             'x-archive-size-hint': self.sizehint
         }
 
-        if (path is None):
-            dumps = self.tempdir
-            d = datetime.datetime.strptime(dumpdate, '%Y%m%d')
-            baseurl = "%s/%s" % (self.config.get('baseurl'), d.strftime('%Y'))
+        if (path is not None):
+            return self.upload(iaitem, path, allfiles, md, headers)
+
+        dumps = os.path.join(self.tempdir, identifier)
+        d = datetime.datetime.strptime(dumpdate, '%Y%m%d')
+        baseurl = "%s/%s" % (self.config.get('baseurl'), d.strftime('%Y'))
+        sizes = self.common.getHttp().map(
+            lambda thefile: self.common.getHttp().getSize(
+                "%s/%s" % (baseurl, thefile)), allfiles)
+        if None in sizes:
+            self.common.giveMessage("Unable to get the sizes of the files on "
+                                    "%s" % (dumpdate))
+            return False
+        reservation = self.staging.reserve(dumps, sum(sizes))
+        if reservation is None:
+            return None
+        try:
             self.common.downloadFiles(filelist=allfiles, directory=dumps,
-                                      baseurl=baseurl)
-        else:
-            dumps = path
+                                      baseurl=baseurl, reserved=True)
+            upload = self.upload(iaitem, dumps, allfiles, md, headers)
+        finally:
+            self.staging.release(reservation)
+        if upload:
+            shutil.rmtree(dumps, ignore_errors=True)
+        return upload
+
+    def upload(self, iaitem, dumps, allfiles, md, headers):
+        """
+        This function is used for uploading the files of a dump from a local
+        directory.
+
+        - iaitem (object): The BALArchiver object of the item.
+        - dumps (string): The path to the dump directory.
+        - allfiles (list): The files to upload.
+        - md (dict): The metadata for the item.
+        - headers (dict): The headers to send with the upload.
 
+        Returns: True if the files are uploaded, False if otherwise.
+        """
         if (self.common.checkDumpDir(path=dumps, filelist=allfiles)):
             pass
         else:
             # The dump directory is not suitable to be used, exit the function
             return False
 
-        os.chdir(dumps)
-        upload = iaitem.upload(body=allfiles, metadata=md, headers=headers)
-
-        if (upload and path is None):
-            self.removeFiles(allfiles)
-            return True
-        else:
-            return upload
+        # Give the full paths since other days may be archived at the same
+        # time from other threads
+        body = [os.path.join(dumps, dumpfile) for dumpfile in allfiles]
+        return iaitem.upload(body=body, metadata=md, headers=headers)
 
     def check(self, dumpdate):
         """
@@ -446,95 +532,198 @@ class BALMMediacounts(object):
                 complete = False
         return complete
 
-    def update(self):
+    def discover(self, years):
         """
-        This function checks for new dumps and adds new entries into the
-        database.
+        This function is used for adding the dumps listed on the dumps server
+        for the given years that are missing from the database, and allowing
+        the dumps to be archived once all their files are available. The year
+        listings are retrieved at the same time and the database is updated
+        in a single transaction.
+
+        - years (list): The years to look at.
 
-        Returns: True if complete, raises an Exception if an error has
-        occurred.
+        Returns: True if complete, False if an error has occurred.
         """
-        # Variables for getting latest 3 days for updating/checking
-        oneday = datetime.datetime.now() - datetime.timedelta(days=1)
-        twoday = datetime.datetime.now() - datetime.timedelta(days=2)
-        theday = datetime.datetime.now() - datetime.timedelta(days=3)
-        yesterday = oneday.strftime("%Y%m%d")
-        daybefore = twoday.strftime("%Y%m%d")
-        threedays = theday.strftime("%Y%m%d")
+        stored = self.getStoredDates()
+        if stored is None:
+            self.common.giveMessage("Unable to get the dumps stored in the "
+                                    "database")
+            return False
 
-        alldumps = self.getDumpDates()
+        inserts = []
+        updates = []
+        listings = self.common.getHttp().map(self.getAvailableDates, years)
+        for year, dates in zip(years, listings):
+            if dates is None:
+                self.common.giveMessage("Unable to get the dumps for %s, "
+                                        "skipping" % (year))
+                continue
+            for dumpdate in sorted(dates):
+                arcdate = self.conv.getDateFromWiki(dumpdate,
+                                                    archivedate=True)
+                complete = dates[dumpdate]
+                if (dumpdate not in stored):
+                    inserts.append({
+                        'dumpdate': arcdate,
+                        'claimed_by': None,
+                        'can_archive': int(complete),
+                        'is_archived': 0,
+                        'is_checked': 0,
+                        'comments': None
+                    })
+                elif (complete and stored[dumpdate] == 0):
+                    self.common.giveMessage("Updating can_archive for dump "
+                                            "on %s" % (dumpdate))
+                    conds = {
+                        'dumpdate': arcdate
+                    }
+                    updates.append(({'can_archive': 1}, conds))
+
+        self.common.giveMessage("Adding %d new dumps" % (len(inserts)))
+        return self.sqldb.writeMany(dbtable=self.dbtable, inserts=inserts,
+                                    updates=updates)
 
-        # Add yesterday's date into the database
-        if (yesterday in alldumps):
-            self.common.giveMessage("Dump on %s already in the database, "
-                                    "skipping" % (yesterday))
-        else:
-            self.addNewItem(dumpdate=yesterday)
+    def update(self):
+        """
+        This function checks for new dumps in the listings of the recent years
+        on the dumps server and adds new entries into the database.
 
-        # Allow dump for the day before to be archived
-        if (daybefore in alldumps):
-            self.common.giveMessage("Updating can_archive for dump on %s" %
-                                    (daybefore))
-            self.updateCanArchive(dumpdate=daybefore, can_archive=1)
-        else:
-            # The day before was not in the database, which should not happen
-            self.common.giveMessage("Adding dump on %s and updating its "
-                                    "can_archive status" % (daybefore))
-            self.addNewItem(dumpdate=daybefore)
-            self.updateCanArchive(dumpdate=daybefore, can_archive=1)
-
-        # Double-check dump for 3 days ago
-        if (threedays in alldumps):
-            # Ensure that it really can be archived
-            self.updateCanArchive(dumpdate=threedays, can_archive=1)
-        else:
-            # 3 days ago dump was not in the database, which really should not
-            # happen
-            self.common.giveMessage("Adding dump on %s and updating its "
-                                    "can_archive status" % (threedays))
-            self.addNewItem(dumpdate=threedays)
-            self.updateCanArchive(dumpdate=threedays, can_archive=1)
+        Returns: True if complete, False if an error has occurred.
+        """
+        # Also look at the previous year in the first few days of the year
+        now = datetime.datetime.now()
+        years = set([now.strftime("%Y")])
+        years.add((now - datetime.timedelta(days=3)).strftime("%Y"))
+        return self.discover(years=sorted(years))
 
-        return True
+    def backfill(self):
+        """
+        This function is used for adding all the dumps available on the dumps
+        server that are missing from the database, such as after an outage.
+
+        Returns: True if complete, False if an error has occurred.
+        """
+        years = self.getYears()
+        if not years:
+            self.common.giveMessage("Unable to get the list of years")
+            return False
+        return self.discover(years=years)
 
     def dispatch(self, job, date, path):
         """
         This function is for dispatching an item to the various functions.
+
+        Returns: None if the item has been deferred as there is not enough
+        staging space, True or False if otherwise.
         """
         # Claim the item from the database server if not in debug mode
         if self.debug:
-            pass
+            token = None
         else:
             arcdate = self.conv.getDateFromWiki(date, archivedate=True)
             itemdetails = {
                 'dumpdate': arcdate
             }
-            self.sqldb.claimItem(params=itemdetails, dbtable=self.dbtable)
+            # Only claim the item if it still needs the job, since another
+            # worker may have just finished the job and released its claim
+            if (job == "archive"):
+                itemdetails['is_archived'] = 0
+            elif (job == "check"):
+                itemdetails['is_archived'] = 1
+                itemdetails['is_checked'] = 0
+            token = self.sqldb.claimItem(params=itemdetails,
+                                         dbtable=self.dbtable)
+            if token is None:
+                self.common.giveMessage("%s has already been claimed" %
+                                        (date))
+                return False
 
         msg = "Running %s on the Wikimedia media files visit " % (job)
         msg += "statistics on %s" % (date)
         self.common.giveMessage(msg)
+        # Keep the claim alive while the job is running
+        lease = balchivist.BALLease(sqldb=self.sqldb, dbtable=self.dbtable,
+                                    token=token, debug=self.debug,
+                                    verbose=self.verbose)
         if (job == "archive"):
-            status = self.archive(dumpdate=date, path=path)
+            with lease:
+                status = self.archive(dumpdate=date, path=path)
             if (self.debug):
                 return status
-            elif (self.debug is False and status):
+            elif (status is None):
+                self.common.giveMessage("Deferring %s until there is enough "
+                                        "staging space" % (date))
+                self.sqldb.releaseClaim(dbtable=self.dbtable, token=token)
+                return None
+            elif (status):
                 self.common.giveMessage("Marking %s as archived" % (date))
-                self.markArchived(dumpdate=date)
+                return self.markArchived(dumpdate=date, token=token)
             else:
                 self.common.giveMessage("Marking %s as failed archive" %
                                         (date))
-                self.markFailedArchive(dumpdate=date)
+                return self.markFailedArchive(dumpdate=date, token=token)
         elif (job == "check"):
-            status = self.check(dumpdate=date)
+            with lease:
+                status = self.check(dumpdate=date)
             if (self.debug):
                 return status
-            elif (self.debug is False and status):
+            # The records of the uploaded files are no longer needed, and
+            # the files are uploaded again if the check has failed
+            balchivist.BALLedger().forget("mediacounts-%s" % (date))
+            if (status):
                 self.common.giveMessage("Marking %s as checked" % (date))
-                self.markChecked(dumpdate=date)
+                return self.markChecked(dumpdate=date, token=token)
             else:
                 self.common.giveMessage("Marking %s as failed check" % (date))
-                self.markFailedCheck(dumpdate=date)
+                return self.markFailedCheck(dumpdate=date, token=token)
+        return True
+
+    def runWorker(self, job, path):
+        """
+        This function is used for working on items for a job one after
+        another until none are left.
+
+        - job (string): The job to execute.
+        - path (string): The path to the dump directory.
+        """
+        while self.getItemsLeft(job=job) > 0:
+            date = self.getRandomItem(job=job)
+            if date is None:
+                # The cached count is out of date, nothing is left
+                break
+            if self.dispatch(job=job, date=date, path=path) is None:
+                # The staging space is used up, leave the other days for
+                # later instead of deferring them one after another
+                break
+
+    def runWindow(self, job, path):
+        """
+        This function is used for working on as many items for a job at the
+        same time as the window allows (the "window" option in the
+        configuration). Each worker has its own database connection, and the
+        claims on the items keep the workers from working on the same item.
+
+        - job (string): The job to execute.
+        - path (string): The path to the dump directory.
+        """
+        def work(number):
+            params = {
+                'verbose': self.verbose,
+                'debug': self.debug
+            }
+            worker = BALMMediacounts(params=params,
+                                     sqldb=self.sqldb.getCopy())
+            try:
+                worker.runWorker(job=job, path=path)
+            finally:
+                worker.sqldb.close()
+
+        pool = multiprocessing.pool.ThreadPool(processes=self.window)
+        try:
+            pool.map(work, range(self.window))
+        finally:
+            pool.close()
+            pool.join()
 
     def execute(self, args=None):
         """
@@ -550,6 +739,8 @@ class BALMMediacounts(object):
             continuous = True
         elif (args.mediacountsjob == "update"):
             return self.update()
+        elif (args.mediacountsjob == "backfill"):
+            return self.backfill()
         elif (args.mediacountsdate is None):
             continuous = True
         else:
@@ -564,10 +755,10 @@ class BALMMediacounts(object):
                 mediacountsjob = args.mediacountsjob
                 mediacountspath = args.mediacountspath
 
-            while self.getItemsLeft(job=mediacountsjob) > 0:
-                date = self.getRandomItem(job=mediacountsjob)
-                self.dispatch(job=mediacountsjob, date=date,
-                              path=mediacountspath)
+            if (self.window > 1 and not self.debug):
+                self.runWindow(job=mediacountsjob, path=mediacountspath)
+            else:
+                self.runWorker(job=mediacountsjob, path=mediacountspath)
         else:
             self.dispatch(job=args.mediacountsjob, date=args.mediacountsdate,
                           path=args.mediacountspath)
@@ -1,13 +1,18 @@
 -- Tables for the Wikimedia media files visit counts (mediacounts) module
 
 CREATE TABLE mediacounts (
-    dumpdate DATE,
+    dumpdate DATE NOT NULL,
     claimed_by VARCHAR(255),
+    claim_token VARCHAR(255),
+    claimed_at DATETIME,
     can_archive INT,
     is_archived INT,
     is_checked INT,
-    comments VARCHAR(255)
+    comments VARCHAR(255),
+    PRIMARY KEY (dumpdate)
 );
 
-CREATE INDEX is_archived ON mediacounts (is_archived);
-CREATE INDEX is_checked ON mediacounts (is_checked);
+CREATE INDEX mediacounts_archive ON mediacounts (is_archived, can_archive, claimed_by);
+CREATE INDEX mediacounts_check ON mediacounts (is_archived, is_checked, claimed_by);
+CREATE INDEX mediacounts_claim ON mediacounts (claim_token);
+CREATE INDEX mediacounts_lease ON mediacounts (claimed_at);
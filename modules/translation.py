@@ -41,6 +41,12 @@ class BALMTranslation(object):
 
     resume = False
     dbtable = "translation"
+    # The columns that describe the status of an item
+    statuscolumns = [
+        'is_archived',
+        'is_checked',
+        'can_archive'
+    ]
 
     def __init__(self, params={}, sqldb=None):
         """
@@ -180,9 +186,11 @@ class BALMTranslation(object):
         """
         dumps = []
         if (can_archive == "all"):
-            conds = ''
+            conds = {}
         else:
-            conds = 'can_archive="%s"' % (can_archive)
+            conds = {
+                'can_archive': can_archive
+            }
 
         options = 'ORDER BY dumpdate DESC LIMIT 30'
         results = self.sqldb.select(dbtable=self.dbtable,
@@ -206,12 +214,12 @@ class BALMTranslation(object):
         """
         conds = {}
         if (job is None or job == "archive"):
-            conds['is_archived'] = "0"
-            conds['can_archive'] = "1"
+            conds['is_archived'] = 0
+            conds['can_archive'] = 1
             return self.getNumberOfItems(params=conds)
         elif (job == "check"):
-            conds['is_archived'] = "1"
-            conds['is_checked'] = "0"
+            conds['is_archived'] = 1
+            conds['is_checked'] = 0
             return self.getNumberOfItems(params=conds)
         else:
             return 0
@@ -219,16 +227,16 @@ class BALMTranslation(object):
     def getNumberOfItems(self, params={}):
         """
         This function is used to get the number of items left to work with.
+        The counts come from the cached status of the table, so calling this
+        function often does not cost a query every time.
 
-        - params (dict): The conditions to put in the WHERE clause.
+        - params (dict): The status of the items to count.
 
         Returns: Int with number of items left to work with.
         """
-        conds = ['claimed_by IS NULL']
-        for key, val in params.iteritems():
-            conds.append('%s="%s"' % (key, val))
-        return self.sqldb.count(dbtable=self.dbtable,
-                                conds=' AND '.join(conds))
+        return self.sqldb.getItemCount(dbtable=self.dbtable,
+                                       columns=self.statuscolumns,
+                                       conds=params)
 
     def getRandomItem(self, job=None):
         """
@@ -257,25 +265,27 @@ class BALMTranslation(object):
         output = {}
         columns = ['dumpdate']
         options = 'ORDER BY RAND() LIMIT 1'
-        conds = ['claimed_by IS NULL']
+        conds = {
+            'claimed_by': None
+        }
 
         if (archived):
-            extra = [
-                'is_archived="1"',
-                'is_checked="0"'
-            ]
+            extra = {
+                'is_archived': 1,
+                'is_checked': 0
+            }
         else:
-            extra = [
-                'is_archived="0"',
-                'can_archive="1"'
-            ]
-        conds.extend(extra)
+            extra = {
+                'is_archived': 0,
+                'can_archive': 1
+            }
+        conds.update(extra)
 
         results = self.sqldb.select(dbtable=self.dbtable, columns=columns,
-                                    conds=' AND '.join(conds), options=options)
+                                    conds=conds, options=options)
         if results is None:
-            # This should not be triggered at all. Use self.getItemsLeft()
-            # to verify first before running this function.
+            # This is only triggered when the cached count given by
+            # self.getItemsLeft() is out of date.
             output = None
         else:
             for result in results:
@@ -297,12 +307,12 @@ class BALMTranslation(object):
             return False
 
         values = {
-            'dumpdate': '"%s"' % (arcdate),
-            'claimed_by': 'NULL',
-            'can_archive': '"0"',
-            'is_archived': '"0"',
-            'is_checked': '"0"',
-            'comments': 'NULL'
+            'dumpdate': arcdate,
+            'claimed_by': None,
+            'can_archive': 0,
+            'is_archived': 0,
+            'is_checked': 0,
+            'comments': None
         }
         return self.sqldb.insert(dbtable=self.dbtable, values=values)
 
@@ -317,75 +327,126 @@ class BALMTranslation(object):
         Returns: True if update is successful, False if an error occurred.
         """
         vals = {
-            'can_archive': '"%s"' % (can_archive)
+            'can_archive': can_archive
         }
         arcdate = self.conv.getDateFromWiki(dumpdate, archivedate=True)
         return self.sqldb.update(dbtable=self.dbtable, values=vals,
-                                 conds="dumpdate=\"%s\"" % (arcdate))
+                                 conds={'dumpdate': arcdate})
 
-    def markArchived(self, dumpdate):
+    def updateClaimed(self, values, conds):
+        """
+        This function is used to update a claimed item, which is only done
+        while the claim on the item is still held.
+
+        - values (dict): The columns and values to update.
+        - conds (dict): The conditions that select the item, including the
+        token of the claim.
+
+        Returns: True if the item is updated, False if the claim has been
+        lost or an error occurred.
+        """
+        updated = self.sqldb.update(dbtable=self.dbtable, values=values,
+                                    conds=conds)
+        if (updated == 0):
+            self.common.giveMessage("The claim on the item has been lost, "
+                                    "leaving it unchanged")
+        return bool(updated)
+
+    def markArchived(self, dumpdate, token):
         """
         This function is used to mark an item as archived after doing so.
 
         - dumpdate (string in %Y%m%d format): The date of the dump to work on.
+        - token (string): The token of the claim given by claimItem, the item
+        is only updated while the claim is still held.
 
-        Returns: True if update is successful, False if an error occurred.
+        Returns: True if the item is updated, False if the claim has been
+        lost or an error occurred.
         """
         vals = {
-            'is_archived': '"1"',
-            'claimed_by': 'NULL'
+            'is_archived': 1,
+            'claimed_by': None,
+            'claim_token': None,
+            'claimed_at': None
         }
         arcdate = self.conv.getDateFromWiki(dumpdate, archivedate=True)
-        return self.sqldb.update(dbtable=self.dbtable, values=vals,
-                                 conds="dumpdate=\"%s\"" % (arcdate))
+        conds = {
+            'dumpdate': arcdate,
+            'claim_token': token
+        }
+        return self.updateClaimed(values=vals, conds=conds)
 
-    def markChecked(self, dumpdate):
+    def markChecked(self, dumpdate, token):
         """
         This function is used to mark an item as checked after doing so.
 
         - dumpdate (string in %Y%m%d format): The date of the dump to work on.
+        - token (string): The token of the claim given by claimItem, the item
+        is only updated while the claim is still held.
 
-        Returns: True if update is successful, False if an error occurred.
+        Returns: True if the item is updated, False if the claim has been
+        lost or an error occurred.
         """
         vals = {
-            'is_checked': '"1"',
-            'claimed_by': 'NULL'
+            'is_checked': 1,
+            'claimed_by': None,
+            'claim_token': None,
+            'claimed_at': None
         }
         arcdate = self.conv.getDateFromWiki(dumpdate, archivedate=True)
-        return self.sqldb.update(dbtable=self.dbtable, values=vals,
-                                 conds="dumpdate=\"%s\"" % (arcdate))
+        conds = {
+            'dumpdate': arcdate,
+            'claim_token': token
+        }
+        return self.updateClaimed(values=vals, conds=conds)
 
-    def markFailedArchive(self, dumpdate):
+    def markFailedArchive(self, dumpdate, token):
         """
         This function is used to mark an item as failed when archiving it.
 
         - dumpdate (string in %Y%m%d format): The date of the dump to work on.
+        - token (string): The token of the claim given by claimItem, the item
+        is only updated while the claim is still held.
 
-        Returns: True if update is successful, False if an error occurred.
+        Returns: True if the item is updated, False if the claim has been
+        lost or an error occurred.
         """
         vals = {
-            'is_archived': '"2"',
-            'claimed_by': 'NULL'
+            'is_archived': 2,
+            'claimed_by': None,
+            'claim_token': None,
+            'claimed_at': None
         }
         arcdate = self.conv.getDateFromWiki(dumpdate, archivedate=True)
-        return self.sqldb.update(dbtable=self.dbtable, values=vals,
-                                 conds="dumpdate=\"%s\"" % (arcdate))
+        conds = {
+            'dumpdate': arcdate,
+            'claim_token': token
+        }
+        return self.updateClaimed(values=vals, conds=conds)
 
-    def markFailedCheck(self, dumpdate):
+    def markFailedCheck(self, dumpdate, token):
         """
         This function is used to mark an item as failed when checking it.
 
         - dumpdate (string in %Y%m%d format): The date of the dump to work on.
+        - token (string): The token of the claim given by claimItem, the item
+        is only updated while the claim is still held.
 
-        Returns: True if update is successful, False if an error occurred.
+        Returns: True if the item is updated, False if the claim has been
+        lost or an error occurred.
         """
         vals = {
-            'is_checked': '"2"',
-            'claimed_by': 'NULL'
+            'is_checked': 2,
+            'claimed_by': None,
+            'claim_token': None,
+            'claimed_at': None
         }
         arcdate = self.conv.getDateFromWiki(dumpdate, archivedate=True)
-        return self.sqldb.update(dbtable=self.dbtable, values=vals,
-                                 conds="dumpdate=\"%s\"" % (arcdate))
+        conds = {
+            'dumpdate': arcdate,
+            'claim_token': token
+        }
+        return self.updateClaimed(values=vals, conds=conds)
 
     def updateNewDumps(self, alldumps):
         """
@@ -531,38 +592,52 @@ class BALMTranslation(object):
         """
         # Claim the item from the database server if not in debug mode
         if self.debug:
-            pass
+            token = None
         else:
             arcdate = self.conv.getDateFromWiki(date, archivedate=True)
             itemdetails = {
                 'dumpdate': arcdate
             }
-            self.sqldb.claimItem(params=itemdetails, dbtable=self.dbtable)
+            token = self.sqldb.claimItem(params=itemdetails,
+                                         dbtable=self.dbtable)
+            if token is None:
+                self.common.giveMessage("%s has already been claimed" %
+                                        (date))
+                return False
 
         msg = "Running %s on the Wikimedia Content Translation " % (job)
         msg += "Parallel Corpora dumps on %s" % (date)
         self.common.giveMessage(msg)
+        # Keep the claim alive while the job is running
+        lease = balchivist.BALLease(sqldb=self.sqldb, dbtable=self.dbtable,
+                                    token=token, debug=self.debug,
+                                    verbose=self.verbose)
         if (job == "archive"):
-            status = self.archive(dumpdate=date, path=path)
+            with lease:
+                status = self.archive(dumpdate=date, path=path)
             if (self.debug):
                 return status
             elif (self.debug is False and status):
                 self.common.giveMessage("Marking %s as archived" % (date))
-                self.markArchived(dumpdate=date)
+                return self.markArchived(dumpdate=date, token=token)
             else:
                 self.common.giveMessage("Marking %s as failed archive" %
                                         (date))
-                self.markFailedArchive(dumpdate=date)
+                return self.markFailedArchive(dumpdate=date, token=token)
         elif (job == "check"):
-            status = self.check(dumpdate=date)
+            with lease:
+                status = self.check(dumpdate=date)
             if (self.debug):
                 return status
-            elif (self.debug is False and status):
+            # The records of the uploaded files are no longer needed, and
+            # the files are uploaded again if the check has failed
+            balchivist.BALLedger().forget("contenttranslation-%s" % (date))
+            if (status):
                 self.common.giveMessage("Marking %s as checked" % (date))
-                self.markChecked(dumpdate=date)
+                return self.markChecked(dumpdate=date, token=token)
             else:
                 self.common.giveMessage("Marking %s as failed check" % (date))
-                self.markFailedCheck(dumpdate=date)
+                return self.markFailedCheck(dumpdate=date, token=token)
 
     def execute(self, args=None):
         """
@@ -595,6 +670,9 @@ class BALMTranslation(object):
 
             while self.getItemsLeft(job=translationjob) > 0:
                 date = self.getRandomItem(job=translationjob)
+                if date is None:
+                    # The cached count is out of date, nothing is left
+                    break
                 self.dispatch(job=translationjob, date=date,
                               path=translationpath)
         else:
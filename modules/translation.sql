@@ -1,13 +1,18 @@
 -- Tables for the Content Translation dumps module
 
 CREATE TABLE translation (
-    dumpdate DATE,
+    dumpdate DATE NOT NULL,
     claimed_by VARCHAR(255),
+    claim_token VARCHAR(255),
+    claimed_at DATETIME,
     can_archive INT,
     is_archived INT,
     is_checked INT,
-    comments VARCHAR(255)
+    comments VARCHAR(255),
+    PRIMARY KEY (dumpdate)
 );
 
-CREATE INDEX is_archived ON translation (is_archived);
-CREATE INDEX is_checked ON translation (is_checked);
+CREATE INDEX translation_archive ON translation (is_archived, can_archive, claimed_by);
+CREATE INDEX translation_check ON translation (is_archived, is_checked, claimed_by);
+CREATE INDEX translation_claim ON translation (claim_token);
+CREATE INDEX translation_lease ON translation (claimed_at);
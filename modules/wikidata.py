@@ -14,9 +14,12 @@
 # You should have received a copy of the GNU General Public License
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
+import collections
 import datetime
+import multiprocessing.pool
 import os
 import shutil
+import subprocess
 
 import balchivist
 
@@ -36,6 +39,12 @@ class BALMWikidata(object):
 
     config = balchivist.BALConfig('wikidata')
     dbtable = "wikidata"
+    # The columns that describe the status of an item
+    statuscolumns = [
+        'is_archived',
+        'is_checked',
+        'can_archive'
+    ]
     conv = balchivist.BALConverter()
     resume = False
 
@@ -46,6 +55,8 @@ class BALMWikidata(object):
     ]
     # A size hint for the Internet Archive, currently set at 100GB
     sizehint = "107374182400"
+    # The rsync module containing all Wikibase dumps
+    rsyncurl = "rsync://ftpmirror.your.org/wikimedia-dumps/other/wikibase"
 
     def __init__(self, params={}, sqldb=None):
         """
@@ -62,6 +73,11 @@ class BALMWikidata(object):
         self.debug = params['debug']
         self.common = balchivist.BALCommon(verbose=self.verbose,
                                            debug=self.debug)
+        self.staging = balchivist.BALStaging(self.config.get('dumpdir'),
+                                             debug=self.debug,
+                                             verbose=self.verbose)
+        # The number of dump files to download at the same time
+        self.transfers = int(self.config.get('transfers', default='2'))
 
     @classmethod
     def argparse(cls, parser=None):
@@ -106,10 +122,14 @@ class BALMWikidata(object):
 
         - database (string): The database to get all dump dates for.
 
-        Returns list of all dump dates (in %Y%m%d format).
+        Returns list of all dump dates (in %Y%m%d format), None if the
+        directory of the database could not be retrieved.
         """
         url = "%s/%s/" % (self.config.get('baseurl'), database)
-        links = self.common.extractLinks(url)
+        raw = self.common.getHttp().getText(url)
+        if raw is None:
+            return None
+        links = self.common.parseLinks(raw)
         dumps = []
         for link in links:
             if (len(link) == 8):
@@ -125,11 +145,16 @@ class BALMWikidata(object):
         archived for the given wiki.
 
         - database (string): The database to get the dump files for.
+        - dumpdate (string): The date of the dump in %Y%m%d format.
 
-        Returns list of all files.
+        Returns: List of all files, None if the listing of the dump could not
+        be retrieved.
         """
         url = "%s/%s/%s/" % (self.config.get('baseurl'), database, dumpdate)
-        return self.common.extractLinks(url)
+        raw = self.common.getHttp().getText(url)
+        if raw is None:
+            return None
+        return self.common.parseLinks(raw)
 
     def getStoredDumps(self, database, can_archive="all"):
         """
@@ -143,21 +168,41 @@ class BALMWikidata(object):
         Returns list of all dump dates.
         """
         dumps = []
-        conds = ['wiki="%s"' % database]
+        conds = {
+            'wiki': database
+        }
         if (can_archive == "all"):
             pass
         else:
-            conds.append('can_archive="%s"' % (can_archive))
+            conds['can_archive'] = can_archive
 
         options = 'ORDER BY dumpdate DESC LIMIT 30'
         results = self.sqldb.select(dbtable=self.dbtable,
                                     columns=['dumpdate'],
-                                    conds=' AND '.join(conds), options=options)
+                                    conds=conds, options=options)
         if results is not None:
             for result in results:
                 dumps.append(result[0].strftime("%Y%m%d"))
         return dumps
 
+    def getAllStoredDumps(self):
+        """
+        This function is for getting the dumps of all databases that are
+        currently stored in the database, using a single query.
+
+        Returns: Dict with the databases and an ordered dict of their dump
+        dates (newest first) and can_archive statuses.
+        """
+        output = {}
+        results = self.sqldb.select(dbtable=self.dbtable,
+                                    columns=['wiki', 'dumpdate',
+                                             'can_archive'],
+                                    options='ORDER BY wiki, dumpdate DESC')
+        for wiki, dumpdate, can_archive in results or ():
+            dumps = output.setdefault(wiki, collections.OrderedDict())
+            dumps[dumpdate.strftime("%Y%m%d")] = can_archive
+        return output
+
     def getItemMetadata(self, database, dumpdate):
         """
         This function is for obtaining the metadata for the item on the
@@ -204,12 +249,12 @@ class BALMWikidata(object):
         """
         conds = {}
         if (job is None or job == "archive"):
-            conds['is_archived'] = "0"
-            conds['can_archive'] = "1"
+            conds['is_archived'] = 0
+            conds['can_archive'] = 1
             return self.getNumberOfItems(params=conds)
         elif (job == "check"):
-            conds['is_archived'] = "1"
-            conds['is_checked'] = "0"
+            conds['is_archived'] = 1
+            conds['is_checked'] = 0
             return self.getNumberOfItems(params=conds)
         else:
             return 0
@@ -217,16 +262,16 @@ class BALMWikidata(object):
     def getNumberOfItems(self, params={}):
         """
         This function is used to get the number of items left to work with.
+        The counts come from the cached status of the table, so calling this
+        function often does not cost a query every time.
 
-        - params (dict): The conditions to put in the WHERE clause.
+        - params (dict): The status of the items to count.
 
         Returns: Int with number of items left to work with.
         """
-        conds = ['claimed_by IS NULL']
-        for key, val in params.iteritems():
-            conds.append('%s="%s"' % (key, val))
-        return self.sqldb.count(dbtable=self.dbtable,
-                                conds=' AND '.join(conds))
+        return self.sqldb.getItemCount(dbtable=self.dbtable,
+                                       columns=self.statuscolumns,
+                                       conds=params)
 
     def getRandomItem(self, job=None):
         """
@@ -268,25 +313,27 @@ class BALMWikidata(object):
         output = {}
         columns = ['wiki', 'dumpdate']
         options = 'ORDER BY RAND() LIMIT 1'
-        conds = ['claimed_by IS NULL']
+        conds = {
+            'claimed_by': None
+        }
 
         if (archived):
-            extra = [
-                'is_archived="1"',
-                'is_checked="0"'
-            ]
+            extra = {
+                'is_archived': 1,
+                'is_checked': 0
+            }
         else:
-            extra = [
-                'is_archived="0"',
-                'can_archive="1"'
-            ]
-        conds.extend(extra)
+            extra = {
+                'is_archived': 0,
+                'can_archive': 1
+            }
+        conds.update(extra)
 
         results = self.sqldb.select(dbtable=self.dbtable, columns=columns,
-                                    conds=' AND '.join(conds), options=options)
+                                    conds=conds, options=options)
         if results is None:
-            # This should not be triggered at all. Use self.getItemsLeft()
-            # to verify first before running this function.
+            # This is only triggered when the cached count given by
+            # self.getItemsLeft() is out of date.
             output = {
                 'wiki': None,
                 'date': None
@@ -312,74 +359,117 @@ class BALMWikidata(object):
         Returns: True if update is successful, False if an error occurred.
         """
         vals = {
-            'can_archive': '"%s"' % (can_archive)
+            'can_archive': can_archive
         }
         return self.sqldb.update(dbtable=self.dbtable, values=vals,
-                                 conds=self.sqldb.getConds(params=params))
+                                 conds=params)
+
+    def updateClaimed(self, values, conds):
+        """
+        This function is used to update a claimed item, which is only done
+        while the claim on the item is still held.
+
+        - values (dict): The columns and values to update.
+        - conds (dict): The conditions that select the item, including the
+        token of the claim.
 
-    def markArchived(self, params):
+        Returns: True if the item is updated, False if the claim has been
+        lost or an error occurred.
+        """
+        updated = self.sqldb.update(dbtable=self.dbtable, values=values,
+                                    conds=conds)
+        if (updated == 0):
+            self.common.giveMessage("The claim on the item has been lost, "
+                                    "leaving it unchanged")
+        return bool(updated)
+
+    def markArchived(self, params, token):
         """
         This function is used to mark an item as archived after doing so.
 
         - params (dict): Information about the item with the keys "wiki"
         and "dumpdate".
+        - token (string): The token of the claim given by claimItem, the item
+        is only updated while the claim is still held.
 
-        Returns: True if update is successful, False if an error occurred.
+        Returns: True if the item is updated, False if the claim has been
+        lost or an error occurred.
         """
         vals = {
-            'is_archived': '"1"',
-            'claimed_by': 'NULL'
+            'is_archived': 1,
+            'claimed_by': None,
+            'claim_token': None,
+            'claimed_at': None
         }
-        return self.sqldb.update(dbtable=self.dbtable, values=vals,
-                                 conds=self.sqldb.getConds(params=params))
+        conds = dict(params)
+        conds['claim_token'] = token
+        return self.updateClaimed(values=vals, conds=conds)
 
-    def markChecked(self, params):
+    def markChecked(self, params, token):
         """
         This function is used to mark an item as checked after doing so.
 
         - params (dict): Information about the item with the keys "wiki"
         and "dumpdate".
+        - token (string): The token of the claim given by claimItem, the item
+        is only updated while the claim is still held.
 
-        Returns: True if update is successful, False if an error occurred.
+        Returns: True if the item is updated, False if the claim has been
+        lost or an error occurred.
         """
         vals = {
-            'is_checked': '"1"',
-            'claimed_by': 'NULL'
+            'is_checked': 1,
+            'claimed_by': None,
+            'claim_token': None,
+            'claimed_at': None
         }
-        return self.sqldb.update(dbtable=self.dbtable, values=vals,
-                                 conds=self.sqldb.getConds(params=params))
+        conds = dict(params)
+        conds['claim_token'] = token
+        return self.updateClaimed(values=vals, conds=conds)
 
-    def markFailedArchive(self, params):
+    def markFailedArchive(self, params, token):
         """
         This function is used to mark an item as failed when archiving it.
 
         - params (dict): Information about the item with the keys "wiki"
         and "dumpdate".
+        - token (string): The token of the claim given by claimItem, the item
+        is only updated while the claim is still held.
 
-        Returns: True if update is successful, False if an error occurred.
+        Returns: True if the item is updated, False if the claim has been
+        lost or an error occurred.
         """
         vals = {
-            'is_archived': '"2"',
-            'claimed_by': 'NULL'
+            'is_archived': 2,
+            'claimed_by': None,
+            'claim_token': None,
+            'claimed_at': None
         }
-        return self.sqldb.update(dbtable=self.dbtable, values=vals,
-                                 conds=self.sqldb.getConds(params=params))
+        conds = dict(params)
+        conds['claim_token'] = token
+        return self.updateClaimed(values=vals, conds=conds)
 
-    def markFailedCheck(self, params):
+    def markFailedCheck(self, params, token):
         """
         This function is used to mark an item as failed when checking it.
 
         - params (dict): Information about the item with the keys "wiki"
         and "dumpdate".
+        - token (string): The token of the claim given by claimItem, the item
+        is only updated while the claim is still held.
 
-        Returns: True if update is successful, False if an error occurred.
+        Returns: True if the item is updated, False if the claim has been
+        lost or an error occurred.
         """
         vals = {
-            'is_checked': '"2"',
-            'claimed_by': 'NULL'
+            'is_checked': 2,
+            'claimed_by': None,
+            'claim_token': None,
+            'claimed_at': None
         }
-        return self.sqldb.update(dbtable=self.dbtable, values=vals,
-                                 conds=self.sqldb.getConds(params=params))
+        conds = dict(params)
+        conds['claim_token'] = token
+        return self.updateClaimed(values=vals, conds=conds)
 
     def addNewItem(self, params):
         """
@@ -399,126 +489,176 @@ class BALMWikidata(object):
             return False
 
         values = {
-            'wiki': '"%s"' % (params['wiki']),
-            'dumpdate': '"%s"' % (arcdate),
-            'claimed_by': 'NULL',
-            'can_archive': '"0"',
-            'is_archived': '"0"',
-            'is_checked': '"0"',
-            'comments': 'NULL'
+            'wiki': params['wiki'],
+            'dumpdate': arcdate,
+            'claimed_by': None,
+            'can_archive': 0,
+            'is_archived': 0,
+            'is_checked': 0,
+            'comments': None
         }
         return self.sqldb.insert(dbtable=self.dbtable, values=values)
 
-    def updateNewDumps(self, db, alldumps):
+    def reconcile(self, db, alldumps, stored):
         """
-        This function is used to check if all new dumps have been registered
-        and update the database accordingly for new dumps. This function is
-        called during the "update" job.
-
-        - db (string): The database to work on.
-        - alldumps (list): A list of all dumps.
-        """
-        storeddumps = self.getStoredDumps(database=db)
-        for dump in alldumps:
-            if (dump in storeddumps):
-                self.common.giveMessage("Dump of %s on %s already in the "
-                                        "database, skipping" % (db, dump))
-                continue
-            else:
-                self.common.giveMessage("Adding new item %s on "
-                                        "%s" % (db, dump))
-                params = {
-                    'wiki': db,
-                    'dumpdate': dump
-                }
-                self.addNewItem(params=params)
+        This function is used for bringing the stored dumps of a database up
+        to date with the dumps available upstream, writing all the changes
+        back together. This function is called during the "update" job.
 
-    def updateCanArchiveStatus(self, db, alldumps):
-        """
-        This function is used for checking existing dumps that have been
-        completed and updates the database if these dumps are ready to be
-        archived. This function is called during the "update" job.
+        The following changes are made:
+        1. New dumps are registered.
+        2. Dumps that are at least a week old can be archived.
+        3. Dumps that no longer exist can no longer be archived.
 
         - db (string): The database to work on.
-        - alldumps (list): A list of all dumps.
+        - alldumps (list): A list of all dumps available upstream.
+        - stored (dict): The stored dump dates and their can_archive
+        statuses, as given by self.getAllStoredDumps.
+
+        Returns: True if the changes are written, False if an error occurred.
         """
-        cannotarc = self.getStoredDumps(database=db, can_archive=0)
         lastweek = datetime.datetime.now()
         lastweek -= datetime.timedelta(days=7)
-        for dump in cannotarc:
-            if (dump <= lastweek.strftime("%Y%m%d") and dump in alldumps):
-                # The dump is now suitable to be archived
-                self.common.giveMessage("Updating can_archive for %s "
-                                        "on %s" % (db, dump))
-                params = {
-                    'wiki': db,
-                    'dumpdate': dump
-                }
-                self.updateCanArchive(params=params, can_archive=1)
-            else:
-                continue
+        lastweek = lastweek.strftime("%Y%m%d")
+        available = set(alldumps)
+        inserts = []
+        updates = []
 
-    def updateOldCanArchiveStatus(self, db, alldumps):
-        """
-        This function is used for checking whether the dumps marked as "can
-        archive" is really able to be archived or has been deleted. This
-        function is called during the "update" job.
-
-        - db (string): The database to work on.
-        """
-        canarc = self.getStoredDumps(database=db, can_archive=1)
-        for dump in canarc:
-            if (dump in alldumps):
+        # Step 1: Ensure that all new dumps are registered
+        for dump in alldumps:
+            if (dump in stored):
+                self.common.giveDebugMessage("Dump of %s on %s already in "
+                                             "the database" % (db, dump))
                 continue
-            else:
-                # The dump is now unable to be archived
+            try:
+                arcdate = self.conv.getDateFromWiki(dump, archivedate=True)
+            except ValueError:
+                # This case occurs when the dump is not in the %Y%m%d format
+                # (usually for files like "dcatap.rdf")
+                continue
+            self.common.giveMessage("Adding new item %s on %s" % (db, dump))
+            values = {
+                'wiki': db,
+                'dumpdate': arcdate,
+                'claimed_by': None,
+                'can_archive': 0,
+                'is_archived': 0,
+                'is_checked': 0,
+                'comments': None
+            }
+            if (dump <= lastweek):
                 self.common.giveMessage("Updating can_archive for %s on "
                                         "%s" % (db, dump))
-                params = {
-                    'wiki': db,
-                    'dumpdate': dump
-                }
-                self.updateCanArchive(params=params, can_archive=0)
+                values['can_archive'] = 1
+            inserts.append(values)
+
+        for dump in list(stored)[:30]:
+            params = {
+                'wiki': db,
+                'dumpdate': self.conv.getDateFromWiki(dump, archivedate=True)
+            }
+            can_archive = stored[dump]
+            # Step 2: Check if the dump is suitable for archiving
+            if (can_archive == 0 and dump <= lastweek and
+                    dump in available):
+                self.common.giveMessage("Updating can_archive for %s on "
+                                        "%s" % (db, dump))
+                updates.append(({'can_archive': 1}, params))
+            # Step 3: Reset the can_archive statuses of old dumps
+            elif (can_archive == 1 and dump not in available):
+                self.common.giveMessage("Updating can_archive for %s on "
+                                        "%s" % (db, dump))
+                updates.append(({'can_archive': 0}, params))
+
+        return self.sqldb.writeMany(dbtable=self.dbtable, inserts=inserts,
+                                    updates=updates)
 
     def getFilesToUpload(self, database, dumpdate):
         """
         This function is used to generate the list of files to upload given
-        the circumstances.
+        the circumstances. Files that the local ledger records as uploaded
+        (and that the Internet Archive has) are left out, so that they are
+        not downloaded again when an interrupted dump is archived again.
 
         - database (string): The wiki database to work on.
         - dumpdate (string): The date of the dump in %Y%m%d format.
 
-        Returns: List of files to upload.
+        Returns: List of files to upload, None if the listing of the dump
+        could not be retrieved.
         """
         identifier = "wikibase-%s-%s" % (database, dumpdate)
         iaitem = balchivist.BALArchiver(identifier=identifier,
                                         verbose=self.verbose, debug=self.debug)
         allfiles = self.getFiles(database, dumpdate)
+        if allfiles is None:
+            return None
+        iafiles = False
         if self.resume:
-            items = []
             iafiles = iaitem.getFileList()
-            for dumpfile in allfiles:
-                if dumpfile in iafiles:
-                    continue
-                else:
-                    # The file does not exist in the Internet Archive item
-                    items.append(dumpfile)
-            if items == []:
-                self.common.giveMessage("All files have already been uploaded")
-                return items
-        else:
-            items = allfiles
+        if iafiles is False:
+            iafiles = iaitem.getDoneFiles()
+        items = []
+        for dumpfile in allfiles:
+            if dumpfile in iafiles:
+                continue
+            else:
+                # The file does not exist in the Internet Archive item
+                items.append(dumpfile)
+        if items == [] and allfiles != []:
+            self.common.giveMessage("All files have already been uploaded")
         return items
 
+    def fetchFile(self, database, dumpdate, thefile):
+        """
+        This function is used for downloading a single dump file into the
+        staging directory, after reserving the staging space for it.
+
+        - database (string): The wiki database of the dump.
+        - dumpdate (string): The date of the dump in %Y%m%d format.
+        - thefile (string): The name of the dump file.
+
+        Returns: Tuple with the name of the file, whether it was downloaded
+        (None if there is not enough staging space for it) and the token of
+        the staging reservation, which must be released after the file has
+        been uploaded.
+        """
+        dumps = "%s/%s/%s" % (self.config.get('dumpdir'), database, dumpdate)
+        fileurl = "%s/%s/%s/%s" % (self.config.get('baseurl'), database,
+                                   dumpdate, thefile)
+        size = self.common.getHttp().getSize(fileurl)
+        if size is None:
+            self.common.giveMessage("Unable to get the size of %s" % (thefile))
+            return thefile, False, None
+        reservation = self.staging.reserve(dumps, size)
+        if reservation is None:
+            return thefile, None, None
+
+        self.common.giveMessage("Downloading file: %s" % (thefile))
+        rsyncurl = "%s/%s/%s/%s" % (self.rsyncurl, database, dumpdate,
+                                    thefile)
+        exitcode = subprocess.call(['rsync', '-aq', '--partial', rsyncurl,
+                                    dumps + '/'])
+        if (exitcode != 0 or
+                not self.common.checkDumpDir(path=dumps, filelist=[thefile])):
+            self.common.giveError("Error: Unable to download %s!" % (thefile))
+            self.staging.release(reservation)
+            return thefile, False, None
+        return thefile, True, reservation
+
     def archive(self, database, dumpdate, path=None):
         """
-        This function is for doing the actual archiving process.
+        This function is for doing the actual archiving process. The dump
+        files are downloaded by several workers at the same time (see
+        self.transfers), and each file is uploaded and removed as soon as it
+        has been downloaded while the other files are still being downloaded.
 
         - database (string): The wiki database to archive.
         - dumpdate (string): The dumpdate of the dump in %Y%m%d format.
         - path (string): The path to the dump directory.
 
-        Returns: True if process is successful, False if otherwise.
+        Returns: True if process is successful, False if otherwise, None if
+        there is not enough staging space and the dump should be archived
+        later.
         """
         identifier = "wikibase-%s-%s" % (database, dumpdate)
         iaitem = balchivist.BALArchiver(identifier=identifier,
@@ -528,55 +668,53 @@ class BALMWikidata(object):
         headers = {
             'x-archive-size-hint': self.sizehint
         }
+        if items is None:
+            self.common.giveMessage("Unable to list the files of %s on %s" %
+                                    (database, dumpdate))
+            return False
+        elif (items == []):
+            return True
 
         dumps = "%s/%s/%s" % (self.config.get('dumpdir'), database, dumpdate)
-        baseurl = "%s/%s/%s" % (self.config.get('baseurl'), database, dumpdate)
-
-        for thefile in items:
-            templist = [thefile]
-            os.system("mkdir -p %s && cd %s && rsync -avzP rsync://ftpmirror.your.org/wikimedia-dumps/other/wikibase/%s/%s/%s ." % (dumps, dumps, database, dumpdate, thefile))
-            # self.common.downloadFiles(filelist=templist, directory=dumps, baseurl=baseurl)
+        if not os.path.exists(dumps):
+            os.makedirs(dumps)
 
-            if (self.common.checkDumpDir(path=dumps, filelist=templist)):
-                pass
-            else:
-                # The dump directory is not suitable to be used, exit the function
-                return False
+        status = True
+        workers = min(self.transfers, len(items))
+        pool = multiprocessing.pool.ThreadPool(processes=workers)
+        try:
+            fetched = pool.imap_unordered(
+                lambda thefile: self.fetchFile(database, dumpdate, thefile),
+                items)
+            for thefile, downloaded, reservation in fetched:
+                if downloaded is None:
+                    # Try again later, unless another file has failed
+                    if status is True:
+                        status = None
+                    continue
+                elif not downloaded:
+                    status = False
+                    continue
 
-            os.chdir(dumps)
-            upload = iaitem.upload(body=templist, metadata=md, headers=headers)
-            if upload:
-                shutil.rmtree(dumps)
-
-        #if (path is None):
-        #    dumps = "%s/%s/%s" % (self.config.get('dumpdir'), database,
-        #                          dumpdate)
-        #    baseurl = "%s/%s/%s" % (self.config.get('baseurl'), database,
-        #                            dumpdate)
-        #    self.common.downloadFiles(filelist=items, directory=dumps,
-        #                              baseurl=baseurl)
-        #else:
-        #    dumps = path
-        #dumps = "/public/dumps/public/other/wikibase/%s/%s" % (database, dumpdate)
-
-        #if (self.common.checkDumpDir(path=dumps, filelist=items)):
-        #    pass
-        #else:
-            # The dump directory is not suitable to be used, exit the function
-       #     return False
-
-        #if (items == []):
-        #    return True
-        #else:
-        #    os.chdir(dumps)
-        #    upload = iaitem.upload(body=items, metadata=md, headers=headers)
-
-        #if (upload and path is None):
-        #    shutil.rmtree(dumps)
-        #    return True
-        #else:
-        #    return upload
-        return True
+                try:
+                    # Give the full path since the working directory is
+                    # shared with the download workers
+                    upload = iaitem.upload(body=[os.path.join(dumps, thefile)],
+                                           metadata=md, headers=headers)
+                    if upload:
+                        # Free up the staging space for the next file
+                        os.remove("%s/%s" % (dumps, thefile))
+                    else:
+                        status = False
+                finally:
+                    self.staging.release(reservation)
+        finally:
+            pool.close()
+            pool.join()
+
+        if status is True:
+            shutil.rmtree(dumps, ignore_errors=True)
+        return status
 
     def check(self, database, dumpdate):
         """
@@ -589,6 +727,10 @@ class BALMWikidata(object):
         """
         complete = True
         allfiles = self.getFiles(database, dumpdate)
+        if allfiles is None:
+            self.common.giveMessage("Unable to list the files of %s on %s" %
+                                    (database, dumpdate))
+            return False
         identifier = "wikibase-%s-%s" % (database, dumpdate)
         iaitem = balchivist.BALArchiver(identifier=identifier,
                                         verbose=self.verbose, debug=self.debug)
@@ -612,20 +754,25 @@ class BALMWikidata(object):
         occurred.
         """
         databases = self.getDatabases()
-        for db in databases:
-            alldumps = self.getDumpDates(database=db)
-            # Step 1: Ensure that all new dumps are registered
-            self.updateNewDumps(db, alldumps=alldumps)
-            # Step 2: Check if the dump is suitable for archiving
-            self.updateCanArchiveStatus(db, alldumps=alldumps)
-            # Step 3: Reset the can_archive statuses of old dumps
-            self.updateOldCanArchiveStatus(db, alldumps=alldumps)
+        # The directories of all databases are listed at the same time and
+        # compared with the stored dumps, which are retrieved at once
+        alldates = self.common.getHttp().map(self.getDumpDates, databases)
+        stored = self.getAllStoredDumps()
+        for db, alldumps in zip(databases, alldates):
+            if alldumps is None:
+                self.common.giveMessage("Unable to list the dumps of %s, "
+                                        "skipping" % (db))
+                continue
+            self.reconcile(db, alldumps, stored.get(db, {}))
 
         return True
 
     def dispatch(self, job, wiki, date, path):
         """
         This function is for dispatching an item to the various functions.
+
+        Returns: None if the item has been deferred as there is not enough
+        staging space, True or False if otherwise.
         """
         updatedetails = {
             'wiki': wiki,
@@ -634,37 +781,57 @@ class BALMWikidata(object):
 
         # Claim the item from the database server if not in debug mode
         if self.debug:
-            pass
+            token = None
         else:
-            self.sqldb.claimItem(params=updatedetails, dbtable=self.dbtable)
+            token = self.sqldb.claimItem(params=updatedetails,
+                                         dbtable=self.dbtable)
+            if token is None:
+                self.common.giveMessage("%s on %s has already been claimed" %
+                                        (wiki, date))
+                return False
 
         msg = "Running %s on the JSON dumps of all Wikibase entries " % (job)
         msg += "for %s on %s" % (wiki, date)
         self.common.giveMessage(msg)
+        # Keep the claim alive while the job is running
+        lease = balchivist.BALLease(sqldb=self.sqldb, dbtable=self.dbtable,
+                                    token=token, debug=self.debug,
+                                    verbose=self.verbose)
         if (job == "archive"):
-            status = self.archive(database=wiki, dumpdate=date, path=path)
+            with lease:
+                status = self.archive(database=wiki, dumpdate=date, path=path)
             if (self.debug):
                 return status
+            elif (status is None):
+                self.common.giveMessage("Deferring %s on %s until there is "
+                                        "enough staging space" % (wiki, date))
+                self.sqldb.releaseClaim(dbtable=self.dbtable, token=token)
+                return None
             elif (self.debug is False and status):
                 self.common.giveMessage("Marking %s on %s as archived" %
                                         (wiki, date))
-                self.markArchived(updatedetails)
+                return self.markArchived(updatedetails, token=token)
             else:
                 self.common.giveMessage("Marking %s on %s as failed"
                                         " archive" % (wiki, date))
-                self.markFailedArchive(updatedetails)
+                return self.markFailedArchive(updatedetails, token=token)
         elif (job == "check"):
-            status = self.check(database=wiki, dumpdate=date)
+            with lease:
+                status = self.check(database=wiki, dumpdate=date)
             if (self.debug):
                 return status
-            elif (self.debug is False and status):
+            # The records of the uploaded files are no longer needed, and
+            # the files are uploaded again if the check has failed
+            balchivist.BALLedger().forget("wikibase-%s-%s" % (wiki, date))
+            if (status):
                 self.common.giveMessage("Marking %s on %s as checked" %
                                         (wiki, date))
-                self.markChecked(updatedetails)
+                return self.markChecked(updatedetails, token=token)
             else:
                 self.common.giveMessage("Marking %s on %s as failed"
                                         " check" % (wiki, date))
-                self.markFailedCheck(updatedetails)
+                return self.markFailedCheck(updatedetails, token=token)
+        return True
 
     def execute(self, args=None):
         """
@@ -703,10 +870,17 @@ class BALMWikidata(object):
 
             while self.getItemsLeft(job=wikidatajob) > 0:
                 itemdetails = self.getRandomItem(job=wikidatajob)
+                if itemdetails['wiki'] is None:
+                    # The cached count is out of date, nothing is left
+                    break
                 wiki = itemdetails['wiki']
                 date = itemdetails['date']
-                self.dispatch(job=wikidatajob, wiki=wiki, date=date,
-                              path=wikidatapath)
+                status = self.dispatch(job=wikidatajob, wiki=wiki, date=date,
+                                       path=wikidatapath)
+                if status is None:
+                    # The staging space is used up, leave the other dumps
+                    # for later instead of deferring them one after another
+                    break
         else:
             self.resume = args.wikidataresume
             self.dispatch(job=args.wikidatajob, wiki=args.wikidatawiki,
@@ -1,14 +1,19 @@
 -- Tables for the Wikidata dumps module
 
 CREATE TABLE wikidata (
-    wiki VARCHAR(255),
-    dumpdate DATE,
+    wiki VARCHAR(255) NOT NULL,
+    dumpdate DATE NOT NULL,
     claimed_by VARCHAR(255),
+    claim_token VARCHAR(255),
+    claimed_at DATETIME,
     can_archive INT,
     is_archived INT,
     is_checked INT,
-    comments VARCHAR(255)
+    comments VARCHAR(255),
+    PRIMARY KEY (wiki, dumpdate)
 );
 
-CREATE INDEX is_archived ON wikidata (is_archived);
-CREATE INDEX is_checked ON wikidata (is_checked);
+CREATE INDEX wikidata_archive ON wikidata (is_archived, can_archive, claimed_by);
+CREATE INDEX wikidata_check ON wikidata (is_archived, is_checked, claimed_by);
+CREATE INDEX wikidata_claim ON wikidata (claim_token);
+CREATE INDEX wikidata_lease ON wikidata (claimed_at);
@@ -75,6 +75,10 @@ class BALRunner(object):
                                  help="Crontab mode: Exit when everything is "
                                  "done instead of sleeping. Useful if you do "
                                  "not intend to run the script forever.")
+        generalopts.add_argument("-s", "--status", action="store_true",
+                                 default=False,
+                                 help="Show the number of items left for "
+                                 "each job of every module, then exit.")
 
         # Declare all the necessary arguments used by each individual modules
         if (self.modules == list()):
@@ -90,6 +94,74 @@ class BALRunner(object):
 
         return parser
 
+    def getStatusTables(self):
+        """
+        This function is used for getting the database tables of all modules
+        and the status columns of each table.
+
+        Returns: Dict with the database tables and their status columns.
+        """
+        tables = {}
+        for module in self.modules:
+            ClassModule = getattr(modules, "BALM" + module.title())
+            tables[ClassModule.dbtable] = ClassModule.statuscolumns
+        return tables
+
+    def getStagingRoots(self):
+        """
+        This function is used for getting the directories where the modules
+        stage their items.
+
+        Returns: List of staging directories.
+        """
+        roots = []
+        for module in self.modules:
+            ClassModule = getattr(modules, "BALM" + module.title())
+            root = ClassModule.config.get('dumpdir')
+            if root not in roots:
+                roots.append(root)
+        return roots
+
+    def showStatus(self, params):
+        """
+        This function is used for showing an overview of the number of items
+        left for each job of every module.
+
+        - params (dict): Information about what is to be done.
+        """
+        # Get the status of all modules at once, the modules will then use
+        # the cached status for their counts.
+        status = self.sqldb.getStatus(self.getStatusTables(), maxage=0)
+        line = "%-15s %10s %10s %10s %10s"
+        print (line % ("Module", "Archive", "Check", "Claimed", "Total"))
+        for module in self.modules:
+            classtype = "BALM" + module.title()
+            ClassModule = getattr(modules, classtype)(params=params,
+                                                      sqldb=self.sqldb)
+            rows = status[ClassModule.dbtable]
+            claimed = sum([row['count'] for row in rows
+                           if not row['unclaimed']])
+            total = sum([row['count'] for row in rows])
+            print (line % (module, ClassModule.getItemsLeft(job="archive"),
+                           ClassModule.getItemsLeft(job="check"), claimed,
+                           total))
+
+        gigabyte = 1024.0 * 1024 * 1024
+        line = "%-30s %10s %10s %10s %10s %5s"
+        print ("")
+        print (line % ("Staging directory (sizes in GB)", "Free", "Budget",
+                       "Reserved", "Available", "Jobs"))
+        for root in self.getStagingRoots():
+            report = balchivist.BALStaging(root).getReport()
+            if (report['budget'] > 0):
+                budget = "%.1f" % (report['budget'] / gigabyte)
+            else:
+                budget = "-"
+            print (line % (root, "%.1f" % (report['free'] / gigabyte), budget,
+                           "%.1f" % (report['reserved'] / gigabyte),
+                           "%.1f" % (report['available'] / gigabyte),
+                           report['jobs']))
+
     def execute(self):
         """
         This function is the main execution function for the archiving scripts.
@@ -103,7 +175,35 @@ class BALRunner(object):
             "verbose": args.verbose,
             "debug": args.debug
         }
+        if (args.status):
+            self.showStatus(params=params)
+            return
+
+        if (args.debug or args.module == "maintenance"):
+            pass
+        else:
+            # Deploy any pending database patches before doing any work
+            BALMaintenance = balchivist.BALMaintenance(params=params,
+                                                       sqldb=self.sqldb)
+            if not BALMaintenance.updateDatabase(automatic=True):
+                common.giveError("Error: The database could not be updated!")
+                return
+            # Remove the files left behind by jobs that have crashed
+            for root in self.getStagingRoots():
+                balchivist.BALStaging(root, debug=args.debug,
+                                      verbose=args.verbose).cleanOrphans()
         while True:
+            if (args.debug or args.module == "maintenance"):
+                pass
+            else:
+                # Release the items claimed by workers that have died
+                for dbtable in sorted(self.getStatusTables()):
+                    released = self.sqldb.releaseExpiredClaims(dbtable)
+                    if (released > 0):
+                        common.giveMessage("Released %d expired claims on "
+                                           "the %s table" %
+                                           (released, dbtable))
+
             if (args.module is not None) and (args.module != "maintenance"):
                 classtype = "BALM" + args.module.title()
                 ClassModule = getattr(modules, classtype)(params=params,
@@ -116,6 +216,8 @@ class BALRunner(object):
                 BALMaintenance.execute()
                 break
             else:
+                # Count the items left for all modules in a single query
+                self.sqldb.getStatus(self.getStatusTables())
                 for module in self.modules:
                     classtype = "BALM" + module.title()
                     ClassModule = getattr(modules, classtype)(params=params,
@@ -0,0 +1,67 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Copyright (C) 2015-2018 Hydriz Scholz
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import sys
+import unittest
+
+import internetarchive
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from balchivist import BALArchiver
+
+
+class TestArchiver(unittest.TestCase):
+    def setUp(self):
+        self.modified = []
+        self.modify = getattr(internetarchive, 'modify_metadata', None)
+        internetarchive.modify_metadata = self.modifyMetadata
+        self.archiver = BALArchiver('test-item')
+        self.archiver.scheduler.wait = lambda identifier: True
+        self.archiver.getMetadata = lambda: {
+            'title': 'Test item',
+            'subject': ['wiki', 'dumps'],
+            'scanner': 'Balchivist Python Library 1.0.0'
+        }
+
+    def tearDown(self):
+        internetarchive.modify_metadata = self.modify
+
+    def modifyMetadata(self, identifier, metadata, **kwargs):
+        self.modified.append(metadata)
+
+    def test_changed_metadata(self):
+        metadata = {
+            'title': 'Test item',
+            'subject': 'wiki;dumps',
+            'date': '2018-01-01'
+        }
+        current = self.archiver.getMetadata()
+        self.assertEqual(self.archiver.getChangedMetadata(metadata, current),
+                         {'date': '2018-01-01'})
+
+    def test_update_metadata(self):
+        metadata = {
+            'title': 'Test item',
+            'date': '2018-01-01'
+        }
+        self.assertTrue(self.archiver.updateMetadata(metadata))
+        # Only the changed fields are sent, without the scanner
+        self.assertEqual(self.modified, [{'date': '2018-01-01'}])
+
+    def test_update_metadata_unchanged(self):
+        self.assertTrue(self.archiver.updateMetadata({'title': 'Test item'}))
+        self.assertEqual(self.modified, [])
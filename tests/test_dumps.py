@@ -0,0 +1,185 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Copyright (C) 2015-2018 Hydriz Scholz
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import collections
+import datetime
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from balchivist import BALLedger, BALMaintenance, BALSqlite
+from modules.dumps import BALMDumpManifest, BALMDumps
+
+
+def getDate(days):
+    date = datetime.date.today() - datetime.timedelta(days=days)
+    return date.strftime("%Y%m%d")
+
+
+def getManifest(status):
+    return BALMDumpManifest({
+        'jobs': {
+            'articlesdump': {
+                'status': status,
+                'files': {
+                    'pages-articles.xml.bz2': {'size': 100, 'md5': 'abc'},
+                    'stub-articles.xml.gz': {'size': 50, 'md5': 'def'}
+                }
+            },
+            'flowhistorydump': {
+                'status': 'skipped'
+            }
+        }
+    })
+
+
+class FakeHttp(object):
+    def map(self, function, items):
+        return [function(item) for item in items]
+
+
+class TestDumps(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.ledgerfile = BALLedger.ledgerfile
+        BALLedger.ledgerfile = os.path.join(self.tempdir, 'ledger.sqlite')
+        self.sqldb = BALSqlite(os.path.join(self.tempdir, 'test.sqlite'))
+        sqlfile = os.path.join(os.path.dirname(__file__), '..', 'modules',
+                               'dumps.sql')
+        for statement in BALMaintenance.getSqlStatements(sqlfile):
+            self.sqldb.execute(statement)
+        params = {
+            'verbose': False,
+            'debug': False
+        }
+        self.dumps = BALMDumps(params=params, sqldb=self.sqldb)
+        self.dumps.retention = 90
+        self.dumps.common.getHttp = lambda: FakeHttp()
+        self.manifests = {}
+        self.listed = []
+        self.dumps.getManifest = lambda wiki, date: self.manifests.get(
+            date, BALMDumpManifest(False))
+        self.dumps.getAllDumps = self.getAllDumps
+        self.listing = []
+
+    def tearDown(self):
+        BALLedger.ledgerfile = self.ledgerfile
+        self.sqldb.close()
+        shutil.rmtree(self.tempdir)
+
+    def getAllDumps(self, wiki):
+        self.listed.append(wiki)
+        return self.listing
+
+    def addDump(self, dumpdate, **values):
+        row = {
+            'wiki': 'testwiki',
+            'dumpdate': datetime.datetime.strptime(dumpdate, '%Y%m%d').date(),
+            'progress': 'done',
+            'can_archive': 0,
+            'is_archived': 0,
+            'is_checked': 0
+        }
+        row.update(values)
+        self.sqldb.insert(dbtable='dumps', values=row)
+
+    def getRows(self):
+        columns = ['dumpdate', 'progress', 'can_archive', 'size',
+                   'stagesize', 'priority']
+        results = self.sqldb.select(dbtable='dumps', columns=columns)
+        output = {}
+        for result in results or ():
+            output[result[0].strftime("%Y%m%d")] = dict(zip(columns[1:],
+                                                            result[1:]))
+        return output
+
+    def test_indexed_dumps(self):
+        latest = (getDate(1), getManifest('done'))
+        rows = {
+            getDate(15): {'is_archived': 0},
+            getDate(40): {'is_archived': 1},
+            getDate(91): {'is_archived': 1},
+            getDate(120): {'is_archived': 0}
+        }
+        # The stored dumps are given newest first
+        rows = collections.OrderedDict(sorted(rows.items(), reverse=True))
+        self.assertEqual(self.dumps.getIndexedDumps(latest, rows),
+                         sorted([getDate(1), getDate(15), getDate(40)]))
+
+    def test_indexed_dumps_unknown(self):
+        latest = (getDate(1), getManifest('done'))
+        # The earlier dumps of a new wiki are not in the index
+        self.assertEqual(self.dumps.getIndexedDumps(latest, {}), None)
+        # A dump in between may have been missed
+        rows = {
+            getDate(40): {'is_archived': 1}
+        }
+        self.assertEqual(self.dumps.getIndexedDumps(latest, rows), None)
+        # A dump that is not archived may have been removed already
+        rows = collections.OrderedDict([
+            (getDate(15), {'is_archived': 1}),
+            (getDate(90), {'is_archived': 0})
+        ])
+        self.assertEqual(self.dumps.getIndexedDumps(latest, rows), None)
+
+    def test_reconcile(self):
+        self.addDump(getDate(120), can_archive=1)
+        self.addDump(getDate(10), progress='progress')
+        self.listing = [getDate(10), getDate(2)]
+        self.manifests[getDate(10)] = getManifest('done')
+        self.manifests[getDate(2)] = getManifest('in-progress')
+        self.assertTrue(self.dumps.reconcile('testwiki'))
+        self.assertEqual(self.getRows(), {
+            getDate(120): {
+                'progress': 'done',
+                'can_archive': 0,
+                'size': None,
+                'stagesize': None,
+                'priority': 0
+            },
+            getDate(10): {
+                'progress': 'done',
+                'can_archive': 1,
+                'size': 150,
+                'stagesize': 150,
+                'priority': self.dumps.getPriority('testwiki', getDate(10))
+            },
+            getDate(2): {
+                'progress': 'progress',
+                'can_archive': 0,
+                'size': None,
+                'stagesize': None,
+                'priority': 0
+            }
+        })
+        self.assertEqual(self.listed, ['testwiki'])
+
+    def test_reconcile_indexed(self):
+        self.addDump(getDate(15), can_archive=1, is_archived=1)
+        latest = (getDate(1), getManifest('done'))
+        self.assertTrue(self.dumps.reconcile('testwiki', latest=latest))
+        # The wiki directory is not listed when the index is enough
+        self.assertEqual(self.listed, [])
+        self.assertEqual(sorted(self.getRows()), [getDate(15), getDate(1)])
+        self.assertEqual(self.getRows()[getDate(1)]['can_archive'], 1)
+
+    def test_reconcile_unlisted(self):
+        self.listing = None
+        self.assertFalse(self.dumps.reconcile('testwiki'))
+        self.assertEqual(self.getRows(), {})
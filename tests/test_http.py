@@ -0,0 +1,151 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Copyright (C) 2015-2018 Hydriz Scholz
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from balchivist import BALHttp
+
+
+class FakeResponse(object):
+    def __init__(self, status_code, content='', headers={}):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers
+        self.closed = False
+
+    def iter_content(self, size):
+        yield self.content
+
+    def close(self):
+        self.closed = True
+
+
+class FakeSession(object):
+    def __init__(self):
+        self.responses = []
+        self.requests = []
+
+    def get(self, url, headers={}, timeout=None):
+        return self.request('GET', url, headers=headers, timeout=timeout)
+
+    def request(self, method, url, headers={}, **kwargs):
+        self.requests.append((method, url, headers))
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+class TestHttp(unittest.TestCase):
+    url = 'https://dumps.example.org/test/'
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.gettempdir = tempfile.tempdir
+        # The cache directory is in the temporary directory by default
+        tempfile.tempdir = self.tempdir
+        self.session = FakeSession()
+        self.http = BALHttp(connections=1)
+        self.http.getSession = lambda: self.session
+
+    def tearDown(self):
+        tempfile.tempdir = self.gettempdir
+        shutil.rmtree(self.tempdir)
+
+    def getCached(self, maxage=0):
+        return self.http.getCached(self.url, 'test.html', maxage=maxage)
+
+    def test_cached(self):
+        self.session.responses.append(FakeResponse(200, 'first', {
+            'ETag': '"1"'
+        }))
+        content, md5 = self.getCached()
+        self.assertEqual(content, 'first')
+        self.assertNotEqual(md5, None)
+        # The local copy is used until it is older than the given age
+        self.assertEqual(self.getCached(maxage=60), (content, md5))
+        self.assertEqual(len(self.session.requests), 1)
+
+    def test_revalidate(self):
+        self.session.responses.append(FakeResponse(200, 'first', {
+            'ETag': '"1"'
+        }))
+        first = self.getCached()
+        self.session.responses.append(FakeResponse(304))
+        self.assertEqual(self.getCached(), first)
+        method, url, headers = self.session.requests[-1]
+        self.assertEqual(headers.get('If-None-Match'), '"1"')
+        self.session.responses.append(FakeResponse(200, 'second', {
+            'ETag': '"2"'
+        }))
+        content, md5 = self.getCached()
+        self.assertEqual(content, 'second')
+        self.assertNotEqual(md5, first[1])
+
+    def test_unreachable(self):
+        self.session.responses.append(IOError())
+        self.assertEqual(self.getCached(), (None, None))
+        self.session.responses.append(FakeResponse(200, 'first'))
+        first = self.getCached()
+        # The local copy is used if the server cannot be reached
+        self.session.responses.append(IOError())
+        self.assertEqual(self.getCached(), first)
+        self.assertEqual(sorted(os.listdir(os.path.join(
+            self.tempdir, 'balchivist-cache'))),
+            ['test.html', 'test.html.meta.json'])
+
+    def test_write_file(self):
+        path = os.path.join(self.tempdir, 'file')
+        contents = ['%d' % (number) * 1024 * 1024 for number in range(8)]
+        threads = [threading.Thread(target=self.http.writeFile,
+                                    args=(path, content))
+                   for content in contents]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # Each thread writes a temporary file of its own
+        with open(path, 'rb') as localfile:
+            self.assertTrue(localfile.read() in contents)
+        self.assertEqual(os.listdir(self.tempdir), ['file'])
+
+    def test_download_limit(self):
+        http = self.http
+        url = self.url
+
+        class StreamedResponse(FakeResponse):
+            def iter_content(self, size):
+                # The limit is still held while the body is read
+                limit = http.getLimit(url)
+                self.held = not limit.acquire(False)
+                if not self.held:
+                    limit.release()
+                yield self.content
+
+        response = StreamedResponse(200, 'contents')
+        self.session.responses.append(response)
+        path = os.path.join(self.tempdir, 'download')
+        self.assertTrue(self.http.download(url, path))
+        self.assertTrue(response.held)
+        self.assertTrue(response.closed)
+        with open(path, 'rb') as localfile:
+            self.assertEqual(localfile.read(), 'contents')
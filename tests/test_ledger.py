@@ -0,0 +1,85 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Copyright (C) 2015-2018 Hydriz Scholz
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from balchivist import BALArchiver, BALLedger
+
+
+class FakeItem(object):
+    def __init__(self, files):
+        self.files = files
+
+
+class TestLedger(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        ledgerfile = os.path.join(self.tempdir, 'ledger.sqlite')
+        self.ledger = BALLedger(ledgerfile=ledgerfile)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_state(self):
+        self.assertEqual(self.ledger.getState('item', 'a.gz'), None)
+        self.ledger.setState('item', 'a.gz', 'hashed', size=10, md5='abc')
+        # The details are kept when they are not given again
+        self.ledger.setState('item', 'a.gz', 'uploaded')
+        self.assertEqual(self.ledger.getState('item', 'a.gz'), {
+            'state': 'uploaded',
+            'size': 10,
+            'md5': 'abc'
+        })
+        self.assertRaises(ValueError, self.ledger.setState, 'item', 'a.gz',
+                          'unknown')
+
+    def test_files(self):
+        self.ledger.setState('item', 'a.gz', 'uploaded')
+        self.ledger.setState('item', 'b.gz', 'uploading')
+        self.ledger.setState('other', 'c.gz', 'verified')
+        self.assertEqual(sorted(self.ledger.getFiles('item')),
+                         ['a.gz', 'b.gz'])
+        self.assertEqual(sorted(self.ledger.getFiles(
+            'item', states=self.ledger.donestates)), ['a.gz'])
+        self.assertTrue(self.ledger.isUploaded('item', 'a.gz'))
+        self.assertFalse(self.ledger.isUploaded('item', 'b.gz'))
+        self.ledger.forget('item')
+        self.assertEqual(self.ledger.getFiles('item'), {})
+        self.assertTrue(self.ledger.isUploaded('other', 'c.gz'))
+
+    def test_done_files(self):
+        self.ledger.setState('item', 'same.gz', 'uploaded', size=10,
+                             md5='abc')
+        self.ledger.setState('item', 'changed.gz', 'uploaded', size=10,
+                             md5='abc')
+        self.ledger.setState('item', 'missing.gz', 'verified')
+        self.ledger.setState('item', 'partial.gz', 'uploading')
+        archiver = BALArchiver('item')
+        archiver.ledger = self.ledger
+        archiver.getItem = lambda: FakeItem([
+            {'name': 'same.gz', 'size': '10', 'md5': 'abc'},
+            {'name': 'changed.gz', 'size': '12', 'md5': 'def'},
+            {'name': 'partial.gz', 'size': '10', 'md5': 'abc'}
+        ])
+        # Only the files on the Internet Archive with the same details count
+        self.assertEqual(archiver.getDoneFiles(), set(['same.gz']))
+        archiver.getItem = lambda: False
+        self.assertEqual(archiver.getDoneFiles(), set())
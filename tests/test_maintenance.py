@@ -0,0 +1,153 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Copyright (C) 2015-2018 Hydriz Scholz
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from StringIO import StringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from balchivist import BALMaintenance, BALSqlite
+
+PATCHES = {
+    'patch-20180101-index.sql': [
+        '-- Table: test',
+        'CREATE INDEX test_value ON test (value);'
+    ],
+    'patch-20180102-column.sql': [
+        '-- Table: test',
+        'ALTER TABLE test ADD COLUMN extra INT;',
+        'UPDATE test SET extra = 1;'
+    ]
+}
+
+
+class FakeConfig(object):
+    def get(self, variable, default=None):
+        return '["test"]'
+
+
+class TestMaintenance(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.sqldb = BALSqlite(os.path.join(self.tempdir, 'test.sqlite'))
+        for patch, lines in PATCHES.items():
+            with open(os.path.join(self.tempdir, patch), 'w') as thefile:
+                thefile.write('\n'.join(lines) + '\n')
+        with open(os.path.join(self.tempdir, 'test.sql'), 'w') as thefile:
+            thefile.write('CREATE TABLE test (name VARCHAR(255) NOT NULL, '
+                          'value INT, PRIMARY KEY (name));\n')
+        params = {
+            'verbose': False,
+            'debug': False
+        }
+        self.maintenance = BALMaintenance(params=params, sqldb=self.sqldb)
+        self.maintenance.patchdir = self.tempdir
+        self.maintenance.moduledir = self.tempdir
+        self.maintenance.config = FakeConfig()
+        self.stdout = sys.stdout
+        sys.stdout = StringIO()
+
+    def tearDown(self):
+        sys.stdout = self.stdout
+        self.sqldb.close()
+        shutil.rmtree(self.tempdir)
+
+    def getApplied(self):
+        applied = self.maintenance.getAppliedPatches()
+        return dict([(patch, appliedat is not None)
+                     for patch, appliedat in applied.items()])
+
+    def createTable(self):
+        self.assertTrue(self.maintenance.createTables())
+        self.assertTrue(self.sqldb.tableExists('test'))
+
+    def test_new_table(self):
+        # The patches for a table that does not exist are only recorded
+        self.assertTrue(self.maintenance.updateDatabase())
+        self.assertTrue(self.sqldb.tableExists('test'))
+        self.assertEqual(self.getApplied(), {
+            'patch-20180101-index.sql': True,
+            'patch-20180102-column.sql': True
+        })
+        self.assertFalse(self.sqldb.columnExists('test', 'extra'))
+
+    def test_apply(self):
+        self.createTable()
+        self.assertTrue(self.maintenance.updateDatabase(automatic=True))
+        self.assertTrue(self.sqldb.indexExists('test', 'test_value'))
+        self.assertTrue(self.sqldb.columnExists('test', 'extra'))
+        self.assertEqual(sys.stdout.getvalue().count('Applying'), 2)
+        # Nothing is done once the database is up-to-date
+        self.assertTrue(self.maintenance.updateDatabase(automatic=True))
+        self.assertEqual(sys.stdout.getvalue().count('Applying'), 2)
+
+    def test_resume(self):
+        self.createTable()
+        self.maintenance.getAppliedPatches()
+        self.maintenance.claimPatch('patch-20180101-index.sql')
+        self.sqldb.execute('CREATE INDEX test_value ON test (value);')
+        # The statements that have taken effect are skipped
+        self.assertTrue(self.maintenance.updateDatabase(automatic=True))
+        self.assertTrue('Resuming interrupted patch patch-20180101-index.sql'
+                        in sys.stdout.getvalue())
+        self.assertEqual(self.getApplied(), {
+            'patch-20180101-index.sql': True,
+            'patch-20180102-column.sql': True
+        })
+
+    def test_resume_failed(self):
+        self.createTable()
+        self.maintenance.getAppliedPatches()
+        self.maintenance.claimPatch('patch-20180101-index.sql')
+        self.sqldb.execute('DROP TABLE test;')
+        self.sqldb.execute('CREATE TABLE test (name VARCHAR(255));')
+        # The patch and the ones after it are skipped when starting up
+        self.assertTrue(self.maintenance.updateDatabase(automatic=True))
+        self.assertTrue('WARNING: Skipping patch-20180101-index.sql' in
+                        sys.stdout.getvalue())
+        self.assertEqual(self.getApplied(), {
+            'patch-20180101-index.sql': False
+        })
+        self.assertFalse(self.maintenance.updateDatabase())
+
+    def test_claimed(self):
+        self.createTable()
+        self.maintenance.claimPatch = lambda patch: False
+        self.assertTrue(self.maintenance.updateDatabase(automatic=True))
+        self.assertTrue('patch-20180101-index.sql is being applied '
+                        'elsewhere' in sys.stdout.getvalue())
+        self.assertFalse(self.sqldb.indexExists('test', 'test_value'))
+        self.assertFalse(self.maintenance.updateDatabase())
+
+    def test_failed(self):
+        self.createTable()
+        self.sqldb.execute('DROP TABLE test;')
+        self.sqldb.execute('CREATE TABLE test (name VARCHAR(255));')
+        # A new patch that fails stops Balchivist from starting
+        self.assertFalse(self.maintenance.updateDatabase(automatic=True))
+        self.assertEqual(self.getApplied(), {
+            'patch-20180101-index.sql': False
+        })
+
+    def test_debug(self):
+        self.createTable()
+        self.maintenance.debug = True
+        self.assertTrue(self.maintenance.updateDatabase())
+        self.assertEqual(self.getApplied(), {})
+        self.assertFalse(self.sqldb.indexExists('test', 'test_value'))
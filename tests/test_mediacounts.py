@@ -0,0 +1,148 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Copyright (C) 2015-2018 Hydriz Scholz
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import datetime
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from balchivist import BALMaintenance, BALSqlite
+from modules.mediacounts import BALMMediacounts
+
+FILES = [
+    "../",
+    "mediacounts.2018-01-01.v00.tsv.bz2",
+    "mediacounts.top1000.2018-01-01.v00.csv.zip",
+    "mediacounts.2018-01-02.v00.tsv.bz2",
+    "mediacounts.top1000.2018-01-03.v00.csv.zip",
+    "README"
+]
+LISTING = "<html><body>\n%s\n</body></html>\n" % ("\n".join(
+    ['<a href="%s">%s</a>' % (thefile, thefile) for thefile in FILES]))
+
+
+class FakeHttp(object):
+    def __init__(self, raw):
+        self.raw = raw
+        self.urls = []
+
+    def getCached(self, url, filename, maxage=None):
+        self.urls.append(url)
+        return self.raw, None
+
+    def map(self, function, items):
+        return [function(item) for item in items]
+
+
+class TestMediacounts(unittest.TestCase):
+    def setUp(self):
+        params = {
+            'verbose': False,
+            'debug': False
+        }
+        self.tempdir = tempfile.mkdtemp()
+        self.sqldb = BALSqlite(os.path.join(self.tempdir, 'test.sqlite'))
+        sqlfile = os.path.join(os.path.dirname(__file__), '..', 'modules',
+                               'mediacounts.sql')
+        for statement in BALMaintenance.getSqlStatements(sqlfile):
+            self.sqldb.execute(statement)
+        self.mediacounts = BALMMediacounts(params=params, sqldb=self.sqldb)
+
+    def tearDown(self):
+        self.sqldb.close()
+        shutil.rmtree(self.tempdir)
+
+    def setListing(self, raw):
+        http = FakeHttp(raw)
+        self.mediacounts.common.getHttp = lambda: http
+        return http
+
+    def test_available_dates(self):
+        http = self.setListing(LISTING)
+        self.assertEqual(self.mediacounts.getAvailableDates('2018'), {
+            '20180101': True,
+            '20180102': True,
+            '20180103': False
+        })
+        self.assertTrue(http.urls[0].endswith('/2018/'))
+
+    def test_available_dates_failure(self):
+        self.setListing(None)
+        self.assertEqual(self.mediacounts.getAvailableDates('2018'), None)
+
+    def test_stored_dates_empty(self):
+        self.assertEqual(self.mediacounts.getStoredDates(), {})
+
+    def test_stored_dates(self):
+        self.sqldb.insert(dbtable='mediacounts', values={
+            'dumpdate': datetime.date(2018, 1, 1),
+            'can_archive': 1,
+            'is_archived': 0,
+            'is_checked': 0
+        })
+        self.assertEqual(self.mediacounts.getStoredDates(), {'20180101': 1})
+
+    def test_stored_dates_failure(self):
+        self.sqldb.execute('DROP TABLE mediacounts;')
+        self.assertEqual(self.mediacounts.getStoredDates(), None)
+
+    def test_discover(self):
+        self.setListing(LISTING)
+        self.sqldb.insert(dbtable='mediacounts', values={
+            'dumpdate': datetime.date(2018, 1, 1),
+            'can_archive': 0,
+            'is_archived': 0,
+            'is_checked': 0
+        })
+        self.assertTrue(self.mediacounts.discover(['2018']))
+        self.assertEqual(self.mediacounts.getStoredDates(), {
+            '20180101': 1,
+            '20180102': 1,
+            '20180103': 0
+        })
+
+    def test_discover_atomic(self):
+        # The new dumps are not added if the other changes cannot be made
+        inserts = [{
+            'dumpdate': datetime.date(2018, 1, 2),
+            'can_archive': 1
+        }]
+        updates = [({'missing': 1}, {'dumpdate': datetime.date(2018, 1, 1)})]
+        self.assertFalse(self.sqldb.writeMany(dbtable='mediacounts',
+                                              inserts=inserts,
+                                              updates=updates))
+        self.assertEqual(self.mediacounts.getStoredDates(), {})
+
+    def test_mark_claimed(self):
+        self.sqldb.insert(dbtable='mediacounts', values={
+            'dumpdate': datetime.date(2018, 1, 1),
+            'can_archive': 1,
+            'is_archived': 0,
+            'is_checked': 0
+        })
+        itemdetails = {
+            'dumpdate': datetime.date(2018, 1, 1)
+        }
+        token = self.sqldb.claimItem(params=itemdetails, dbtable='mediacounts')
+        self.assertNotEqual(token, None)
+        # The item is left alone once the claim has been lost
+        self.assertFalse(self.mediacounts.markArchived('20180101', 'stale'))
+        self.assertEqual(self.mediacounts.getItemsLeft(job='check'), 0)
+        self.assertTrue(self.mediacounts.markArchived('20180101', token))
+        self.assertFalse(self.mediacounts.markArchived('20180101', token))
@@ -0,0 +1,92 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Copyright (C) 2015-2018 Hydriz Scholz
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from balchivist import BALRetry
+
+
+class FakeResponse(object):
+    def __init__(self, status_code, headers={}):
+        self.status_code = status_code
+        self.headers = headers
+
+
+class FakeError(Exception):
+    def __init__(self, response=None):
+        super(FakeError, self).__init__()
+        self.response = response
+
+
+class TestRetry(unittest.TestCase):
+    def test_delay(self):
+        retry = BALRetry(basedelay=2, maxdelay=10)
+        for attempt in range(10):
+            delay = retry.getDelay(attempt)
+            self.assertTrue(1 <= delay <= 10)
+        self.assertTrue(retry.getDelay(0) <= 2)
+
+    def test_retry_after(self):
+        retry = BALRetry(basedelay=2, maxdelay=10)
+        exception = FakeError(FakeResponse(503, {'Retry-After': '120'}))
+        self.assertEqual(retry.getRetryAfter(exception), 120.0)
+        self.assertTrue(retry.getDelay(0, exception) >= 120)
+
+    def test_retriable(self):
+        retry = BALRetry()
+        self.assertTrue(retry.isRetriable(FakeError(FakeResponse(503))))
+        self.assertFalse(retry.isRetriable(FakeError(FakeResponse(404))))
+        self.assertFalse(retry.isRetriable(ValueError()))
+
+    def test_budget(self):
+        retry = BALRetry(client='test_budget')
+        retry.budget = 2
+        self.assertTrue(retry.useBudget())
+        self.assertTrue(retry.useBudget())
+        self.assertFalse(retry.useBudget())
+        # Other clients have their own budget
+        other = BALRetry(client='test_budget_other')
+        other.budget = 2
+        self.assertTrue(other.useBudget())
+
+    def test_call(self):
+        retry = BALRetry(retries=3, basedelay=0, maxdelay=0,
+                         client='test_call')
+        attempts = []
+
+        def function():
+            attempts.append(1)
+            if (len(attempts) < 3):
+                raise FakeError(FakeResponse(503))
+            return True
+
+        self.assertTrue(retry.call(function))
+        self.assertEqual(len(attempts), 3)
+
+    def test_call_fatal(self):
+        retry = BALRetry(retries=3, basedelay=0, maxdelay=0,
+                         client='test_call_fatal')
+        attempts = []
+
+        def function():
+            attempts.append(1)
+            raise FakeError(FakeResponse(404))
+
+        self.assertRaises(FakeError, retry.call, function)
+        self.assertEqual(len(attempts), 1)
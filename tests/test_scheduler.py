@@ -0,0 +1,69 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Copyright (C) 2015-2018 Hydriz Scholz
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from balchivist import BALScheduler
+
+
+class TestScheduler(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.checks = []
+        self.overloaded = False
+        self.scheduler = BALScheduler()
+        self.scheduler.statefile = os.path.join(self.tempdir, 's3.json')
+        self.scheduler.isOverloaded = self.isOverloaded
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def isOverloaded(self, identifier):
+        self.checks.append(identifier)
+        return self.overloaded
+
+    def test_not_overloaded(self):
+        self.assertEqual(self.scheduler.getDelay('item'), 0)
+        # The limit check is trusted for a while
+        self.assertEqual(self.scheduler.getDelay('item'), 0)
+        self.assertEqual(self.checks, ['item'])
+        self.assertTrue(self.scheduler.wait('item'))
+
+    def test_overloaded(self):
+        self.overloaded = True
+        delay = self.scheduler.getDelay('item')
+        self.assertTrue(self.scheduler.basedelay <= delay <=
+                        self.scheduler.maxdelay)
+        # Other uploads are held back without checking the limit again
+        other = BALScheduler()
+        other.statefile = self.scheduler.statefile
+        other.isOverloaded = self.isOverloaded
+        self.assertTrue(0 < other.getDelay('other') <= delay)
+        self.assertEqual(self.checks, ['item'])
+        self.scheduler.maxwait = 0
+        self.assertFalse(self.scheduler.wait('item'))
+
+    def test_mark_overloaded(self):
+        self.assertEqual(self.scheduler.getDelay('item'), 0)
+        self.scheduler.markOverloaded('item')
+        # The next upload checks the limit again
+        self.assertEqual(self.scheduler.getDelay('item'), 0)
+        self.assertEqual(self.checks, ['item', 'item'])
@@ -0,0 +1,78 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Copyright (C) 2015-2018 Hydriz Scholz
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from balchivist import BALSqlDb, BALSqlite
+
+
+class TestSqlDb(unittest.TestCase):
+    def setUp(self):
+        self.sqldb = BALSqlDb()
+
+    def test_conds_null(self):
+        conds = {
+            'claimed_by': None
+        }
+        self.assertEqual(self.sqldb.getConds(conds),
+                         ('claimed_by IS NULL', ()))
+
+    def test_conds_equal(self):
+        conds = {
+            'wiki': 'enwiki',
+            'is_archived': 0
+        }
+        self.assertEqual(self.sqldb.getConds(conds),
+                         ('is_archived = %s AND wiki = %s', (0, 'enwiki')))
+
+    def test_conds_operator(self):
+        conds = {
+            'size <=': 1024
+        }
+        self.assertEqual(self.sqldb.getConds(conds), ('size <= %s', (1024,)))
+
+    def test_conds_in(self):
+        conds = {
+            'wiki': ['enwiki', 'dewiki']
+        }
+        self.assertEqual(self.sqldb.getConds(conds),
+                         ('wiki IN (%s, %s)', ('enwiki', 'dewiki')))
+
+    def test_conds_string(self):
+        self.assertEqual(self.sqldb.getConds('is_archived = 1'),
+                         ('is_archived = 1', ()))
+
+    def test_conds_key(self):
+        # Conditions with the same shape share the same query
+        first = self.sqldb.getCondsKey({'wiki': 'enwiki', 'size <=': 1})
+        second = self.sqldb.getCondsKey({'wiki': 'dewiki', 'size <=': 2})
+        self.assertEqual(first, second)
+        third = self.sqldb.getCondsKey({'wiki': None, 'size <=': 2})
+        self.assertNotEqual(first, third)
+
+    def test_statement(self):
+        sqldb = BALSqlite(':memory:')
+        self.assertEqual(sqldb.count(dbtable='sqlite_master'), 0)
+        statements = dict(sqldb.statements)
+        self.assertEqual(len(statements), 1)
+        # The text of the queries is kept when connecting again
+        sqldb.close()
+        self.assertEqual(sqldb.count(dbtable='sqlite_master'), 0)
+        self.assertEqual(sqldb.statements, statements)
+        sqldb.close()
@@ -0,0 +1,133 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Copyright (C) 2015-2018 Hydriz Scholz
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import datetime
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from balchivist import BALSqlite
+
+
+class TestSqlite(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.sqldb = BALSqlite(os.path.join(self.tempdir, 'test.sqlite'))
+        self.sqldb.execute('CREATE TABLE test (name VARCHAR(255) NOT NULL, '
+                           'dumpdate DATE, claimed_by VARCHAR(255), '
+                           'claim_token VARCHAR(255), claimed_at DATETIME, '
+                           'is_archived INT, PRIMARY KEY (name));')
+        self.sqldb.execute('CREATE INDEX test_archive ON test '
+                           '(is_archived, claimed_by);')
+        self.sqldb.insertMany(dbtable='test', rows=[{
+            'name': 'first',
+            'dumpdate': datetime.date(2018, 1, 1),
+            'is_archived': 0
+        }, {
+            'name': 'second',
+            'dumpdate': datetime.date(2018, 1, 2),
+            'is_archived': 1
+        }])
+
+    def tearDown(self):
+        self.sqldb.close()
+        shutil.rmtree(self.tempdir)
+
+    def test_query(self):
+        self.assertEqual(self.sqldb.getQuery('a = %s AND b = %s'),
+                         'a = ? AND b = ?')
+
+    def test_select(self):
+        results = self.sqldb.select(dbtable='test',
+                                    columns=['name', 'dumpdate'],
+                                    conds={'is_archived': [0, 1]},
+                                    options='ORDER BY name')
+        self.assertEqual(results, (('first', datetime.date(2018, 1, 1)),
+                                   ('second', datetime.date(2018, 1, 2))))
+        self.assertEqual(self.sqldb.select(dbtable='test', columns=['name'],
+                                           conds={'is_archived': 2}), None)
+        self.assertEqual(self.sqldb.count(dbtable='test',
+                                          conds={'claimed_by': None}), 2)
+
+    def test_update(self):
+        self.assertEqual(self.sqldb.update(dbtable='test',
+                                           values={'is_archived': 1},
+                                           conds={'name': 'first'}), 1)
+        # Rows that already have the values are counted as well
+        self.assertEqual(self.sqldb.update(dbtable='test',
+                                           values={'is_archived': 1},
+                                           conds={'name': 'first'}), 1)
+        self.assertEqual(self.sqldb.update(dbtable='test',
+                                           values={'is_archived': 1},
+                                           conds={'name': 'missing'}), 0)
+        self.assertEqual(self.sqldb.update(dbtable='test',
+                                           values={'missing': 1},
+                                           conds={'name': 'first'}), None)
+
+    def test_claims(self):
+        token = self.sqldb.claimItem(params={'name': 'first'},
+                                     dbtable='test')
+        self.assertNotEqual(token, None)
+        self.assertEqual(self.sqldb.claimItem(params={'name': 'first'},
+                                              dbtable='test'), None)
+        self.assertTrue(self.sqldb.renewClaim(dbtable='test', token=token))
+        self.assertFalse(self.sqldb.renewClaim(dbtable='test',
+                                               token='stale'))
+        results = self.sqldb.select(dbtable='test', columns=['claimed_at'],
+                                    conds={'claim_token': token})
+        self.assertTrue(isinstance(results[0][0], datetime.datetime))
+
+    def test_expired_claims(self):
+        token = self.sqldb.claimItem(params={'name': 'first'},
+                                     dbtable='test')
+        self.assertEqual(self.sqldb.releaseExpiredClaims(dbtable='test'), 0)
+        self.sqldb.leaseperiod = -60
+        self.assertEqual(self.sqldb.releaseExpiredClaims(dbtable='test'), 1)
+        self.assertFalse(self.sqldb.renewClaim(dbtable='test', token=token))
+
+    def test_status(self):
+        self.sqldb.claimItem(params={'name': 'second'}, dbtable='test')
+        status = self.sqldb.getStatus({'test': ['is_archived']}, maxage=0)
+        self.assertEqual(sorted(status['test']), sorted([{
+            'is_archived': 0,
+            'unclaimed': True,
+            'count': 1
+        }, {
+            'is_archived': 1,
+            'unclaimed': False,
+            'count': 1
+        }]))
+        self.assertEqual(self.sqldb.getItemCount('test', ['is_archived'],
+                                                 {'is_archived': 1}), 0)
+
+    def test_schema(self):
+        self.assertTrue(self.sqldb.tableExists('test'))
+        self.assertFalse(self.sqldb.tableExists('missing'))
+        self.assertTrue(self.sqldb.columnExists('test', 'claim_token'))
+        self.assertFalse(self.sqldb.columnExists('test', 'missing'))
+        self.assertTrue(self.sqldb.indexExists('test', 'PRIMARY'))
+        self.assertTrue(self.sqldb.indexExists('test', 'test_archive'))
+        self.assertFalse(self.sqldb.indexExists('test', 'missing'))
+
+    def test_copy(self):
+        copy = self.sqldb.getCopy()
+        try:
+            self.assertEqual(copy.count(dbtable='test'), 2)
+        finally:
+            copy.close()
@@ -0,0 +1,65 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Copyright (C) 2015-2018 Hydriz Scholz
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from balchivist import BALStaging
+
+
+class TestStaging(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.tempdir, 'root'))
+        self.staging = BALStaging(os.path.join(self.tempdir, 'root'))
+        self.staging.statefile = os.path.join(self.tempdir, 'state.json')
+        self.staging.dirsfile = os.path.join(self.tempdir, 'dirs.json')
+        self.staging.budget = 1000
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_available(self):
+        self.assertEqual(self.staging.getAvailable(), 1000)
+        self.staging.budget = 0
+        self.assertEqual(self.staging.getAvailable(),
+                         self.staging.getFreeSpace())
+
+    def test_reserve(self):
+        path = os.path.join(self.tempdir, 'root', 'item')
+        token, others = self.staging.tryReserve(path, 600)
+        self.assertNotEqual(token, None)
+        self.assertFalse(others)
+        self.assertEqual(self.staging.getAvailable(), 400)
+        # There is not enough space left for another item
+        second, others = self.staging.tryReserve(path + '2', 500)
+        self.assertEqual(second, None)
+        self.assertTrue(others)
+        self.staging.release(token)
+        self.assertEqual(self.staging.getAvailable(), 1000)
+
+    def test_clean_orphans(self):
+        path = os.path.join(self.tempdir, 'root', 'item')
+        token = self.staging.reserve(path, 10, wait=False)
+        self.staging.release(token)
+        self.staging.orphanage = -1
+        self.assertEqual(self.staging.cleanOrphans(), 1)
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(self.staging.readDirectories(), {})
@@ -0,0 +1,96 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Copyright (C) 2015-2018 Hydriz Scholz
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import datetime
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from modules.wikidata import BALMWikidata
+
+
+class FakeSqlDb(object):
+    def __init__(self):
+        self.inserts = []
+        self.updates = []
+
+    def writeMany(self, dbtable, inserts=[], updates=[]):
+        self.inserts.extend(inserts)
+        self.updates.extend(updates)
+        return True
+
+
+class TestWikidata(unittest.TestCase):
+    def setUp(self):
+        self.sqldb = FakeSqlDb()
+        params = {
+            'verbose': False,
+            'debug': False
+        }
+        self.wikidata = BALMWikidata(params=params, sqldb=self.sqldb)
+        now = datetime.datetime.now()
+        self.old = (now - datetime.timedelta(days=14)).strftime("%Y%m%d")
+        self.new = (now - datetime.timedelta(days=1)).strftime("%Y%m%d")
+        self.gone = (now - datetime.timedelta(days=30)).strftime("%Y%m%d")
+
+    def getDate(self, dump):
+        return self.wikidata.conv.getDateFromWiki(dump, archivedate=True)
+
+    def test_reconcile_new(self):
+        alldumps = [self.old, self.new, 'dcatap.rdf']
+        self.assertTrue(self.wikidata.reconcile('wikidatawiki', alldumps, {}))
+        inserted = dict([(row['dumpdate'], row['can_archive'])
+                         for row in self.sqldb.inserts])
+        self.assertEqual(inserted, {
+            self.getDate(self.old): 1,
+            self.getDate(self.new): 0
+        })
+        self.assertEqual(self.sqldb.updates, [])
+
+    def test_reconcile_stored(self):
+        alldumps = [self.old, self.new]
+        stored = {
+            self.old: 0,
+            self.new: 0,
+            self.gone: 1
+        }
+        self.assertTrue(self.wikidata.reconcile('wikidatawiki', alldumps,
+                                                stored))
+        self.assertEqual(self.sqldb.inserts, [])
+        updated = dict([(params['dumpdate'], values['can_archive'])
+                        for values, params in self.sqldb.updates])
+        self.assertEqual(updated, {
+            self.getDate(self.old): 1,
+            self.getDate(self.gone): 0
+        })
+
+    def test_execute_deferred(self):
+        dispatched = []
+
+        def dispatch(job, wiki, date, path):
+            dispatched.append((wiki, date))
+            return None
+
+        # The same item would be picked again and again after a deferral
+        self.wikidata.getItemsLeft = lambda job=None: 1
+        self.wikidata.getRandomItem = lambda job=None: {
+            'wiki': 'wikidatawiki',
+            'date': self.old
+        }
+        self.wikidata.dispatch = dispatch
+        self.assertTrue(self.wikidata.execute())
+        self.assertEqual(dispatched, [('wikidatawiki', self.old)])